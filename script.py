@@ -9,9 +9,14 @@ import django
 django.setup()
 
 from util.animal_downloader import AnimalDownloader
+from util.bulk_loader import BulkLoader
 from util.database import Database
+from util.download_cache import DownloadCache
+from util.download_benchmark import DownloadBenchmark
 from util.file_manager import FileManager
+from util.populate_benchmark import PopulateBenchmark
 from util.profile_downloader import ProfileDownloader
+from util.synthetic import SyntheticDataset
 
 
 class Script:
@@ -25,7 +30,11 @@ class Script:
             'populate': 'Populate the database',
             'migrate': 'Migrate the database',
             'database': 'Populate and migrate the database',
-            'all': 'Perform all actions'
+            'all': 'Perform all actions',
+            'benchmark': 'Benchmark the animal downloader against a local fixture server',
+            'bulkpopulate': 'Populate the database in bulk with count animals and profiles, repeating the downloaded ones',
+            'benchmarkpopulate': 'Compare populating the database row by row and in bulk',
+            'synth': 'Clear the database and fill it with a synthetic dataset of count animals, offline'
         }
         count = 50
 
@@ -62,9 +71,28 @@ class Script:
         elif action == 'migrate':
             Database.migrate()
 
+        elif action == 'benchmark':
+            DownloadBenchmark.run(count)
+
         elif action == 'populate':
             Database.populate()
 
+        elif action == 'bulkpopulate':
+            animal_dict = BulkLoader.expand_animals(Database.load_animal_dict(), count)
+            profile_dict = BulkLoader.expand_profiles(Database.load_profile_dict(), count)
+            BulkLoader.populate(animal_dict, profile_dict, discussions=count, user_lists=count,
+                                petitions=count, votes=count * 10, upsert=True)
+            print("Populated the database!")
+
+        elif action == 'benchmarkpopulate':
+            PopulateBenchmark.run(count)
+
+        elif action == 'synth':
+            FileManager.clear(Database)
+            Database.migrate()
+            for model, rows in SyntheticDataset.generate(count).items():
+                print(f"{model}: {rows}")
+
         elif action == 'database':
             Database.migrate()
             Database.populate()
@@ -72,8 +100,10 @@ class Script:
         elif action == 'all':
             FileManager.clear_all()
 
-            animal_dict = AnimalDownloader.download(count)
-            profile_dict = ProfileDownloader.download(count)
+            # media is cleared but the downloads are kept, unchanged files aren't downloaded again
+            cache = DownloadCache(max_age=DownloadCache.MAX_AGE)
+            animal_dict = AnimalDownloader.download(count, cache)
+            profile_dict = ProfileDownloader.download(count, cache)
 
             Database.animal_dict = animal_dict
             Database.profile_dict = profile_dict
@@ -0,0 +1,34 @@
+$(document).ready(function() {
+    // without javascript the link opens the next page of comments instead
+    $('#load_comments').click(function(event) {
+        event.preventDefault();
+        var $button = $(this);
+        if ($button.hasClass('disabled')) {
+            return;
+        }
+        $button.addClass('disabled');
+
+        $.ajax({
+            url: $button.attr('data-url'),
+            type: 'GET',
+            data: {
+                'sort_by': $button.attr('data-sort'),
+                'cursor': $button.attr('data-cursor')
+            },
+            success: function(response) {
+                if (response.status === 'success') {
+                    $('#comments').append(response.html);
+                    if (response.next_cursor) {
+                        $button.attr('data-cursor', response.next_cursor);
+                        $button.removeClass('disabled');
+                    } else {
+                        $button.parent().remove();
+                    }
+                }
+            },
+            error: function() {
+                $button.removeClass('disabled');
+            }
+        })
+    });
+});
@@ -0,0 +1,43 @@
+// search-as-you-type suggestions for the navbar search bar
+// see views SuggestView for the endpoint
+$(document).ready(function() {
+    var $input = $('[name=searched]');
+    var $menu = $('#search-suggestions');
+    var lastPrefix = null;
+
+    function showSuggestions(results) {
+        $menu.empty();
+        results.forEach(function(result) {
+            var $link = $('<a class="dropdown-item"></a>').attr('href', result.url).text(result.text);
+            $link.append($('<small class="text-muted ms-2"></small>').text(result.category));
+            $menu.append($('<li></li>').append($link));
+        });
+        $menu.toggleClass('show', results.length > 0);
+    }
+
+    $input.on('input', function() {
+        var prefix = $input.val().trim();
+        if (prefix === lastPrefix) {
+            return;
+        }
+        lastPrefix = prefix;
+        if (!prefix) {
+            showSuggestions([]);
+            return;
+        }
+        $.get('/wildthoughts/search/suggest/', {
+            'q': prefix,
+            'category': $('[name=category]').val()
+        }, function(response) {
+            // ignore responses to prefixes the user has already typed past
+            if (prefix === lastPrefix) {
+                showSuggestions(response.results);
+            }
+        });
+    });
+
+    $input.on('blur', function() {
+        // let a click on a suggestion land before hiding the menu
+        setTimeout(function() { $menu.removeClass('show'); }, 200);
+    });
+});
@@ -1,15 +1,22 @@
-import concurrent.futures
+import asyncio
 import json
 import os
-import requests
 
 from bs4 import BeautifulSoup
 
+from util.download_cache import DownloadCache
+from util.fetcher import Fetcher
+
 
 class AnimalDownloader:
     """
     class dedicated to webscrape https://animalcorner.org/animals/
-    using BeautifulSoup and dividing the workload between threads
+    using BeautifulSoup, with the pages and images downloaded concurrently by Fetcher
+
+    see:
+    util/fetcher for the connection pool, concurrency limit and retries
+    util/download_cache for skipping unchanged pages and images between runs
+    util/fixture_server for scraping and benchmarking offline
 
     Resources used:
     freeCodeCamp.org, Web Scraping tutorial: https://youtu.be/XVv6mJpFOb0?si=cY__8rXOFzQ5jdzv
@@ -18,27 +25,28 @@ class AnimalDownloader:
     """
     FILES = ["animal.json"]
     FOLDERS = ["media\\animal_images"]
+    BASE_URL = 'https://animalcorner.org'
+    CONCURRENCY = 8
 
     @classmethod
-    def __find_urls(cls) -> list[str]:
+    def __find_urls(cls, html_file: bytes) -> list[str]:
         """
         extracts all urls from the page and returns them as a list
         """
         urls = []
-        html_file = requests.get('https://animalcorner.org/animals/').text
         soup = BeautifulSoup(html_file, 'lxml')
         a = soup.find_all('a')
-        for link in a: 
+        for link in a:
             href = link.get('href')
-            if 'animals' in href:
+            if href and 'animals' in href:
                 urls.append(href)
         return urls
-    
+
     @classmethod
     def __reduce_size(cls, urls: list[str], count: int) -> list[str]:
         """
         reduce the size of the list of url to a specified number
-        note that it won't exactly download the specified number of animals 
+        note that it won't exactly download the specified number of animals
         since validation is done at execution
         """
         if len(urls) == 0:
@@ -56,51 +64,73 @@ class AnimalDownloader:
         return div.find('p').text
 
     @classmethod
-    def __save_image(cls, soup: BeautifulSoup) -> str:
+    def __get_image_url(cls, soup: BeautifulSoup) -> str:
         div = soup.find('div', class_="featured-image-wrapper")
         img_tag = div.find('img')
-        img_url = img_tag.get('data-breeze')
-        with requests.get(img_url, stream=True) as response:
-            full_path = os.path.join('media\\animal_images', os.path.basename(img_url))
-            with open(full_path, 'wb') as out_file:
-                out_file.write(response.content)
-            img_path = os.path.join('animal_images', os.path.basename(img_url))
-            return img_path
+        return img_tag.get('data-breeze')
+
+    @classmethod
+    def __parse(cls, html_file: bytes) -> tuple[str, str, str]:
+        soup = BeautifulSoup(html_file, 'lxml')
+        return cls.__get_name(soup), cls.__get_description(soup), cls.__get_image_url(soup)
 
     @classmethod
-    def __get_data(cls, url: list[str]) -> tuple[str, str, str]:
+    async def __get_data(cls, fetcher: Fetcher, url: str, folder: str) -> tuple[str, str, str]:
+        html_file = await fetcher.content(url)
+        if html_file is None:
+            return None
+
         try:
-            html_file = requests.get(url).text
-            soup = BeautifulSoup(html_file, 'lxml')
-            name = cls.__get_name(soup)
-            description = cls.__get_description(soup)
-            if name and description:
-                image_path = cls.__save_image(soup)
-                if image_path:
-                    result = (name, description, image_path)
-                    return result
-        except:
-            pass
-        
+            # parsing is CPU bound, keep it off the event loop
+            loop = asyncio.get_running_loop()
+            name, description, img_url = await loop.run_in_executor(fetcher.executor, cls.__parse, html_file)
+        except (AttributeError, TypeError) as e:
+            # the page doesn't have the layout of an animal page
+            fetcher.failures[url] = f'{type(e).__name__}: {e}'
+            return None
+
+        if name and description and img_url:
+            filename = os.path.basename(img_url)
+            if await fetcher.save(img_url, os.path.join(folder, filename)) is not None:
+                return name, description, os.path.join('animal_images', filename)
+        return None
+
     @classmethod
-    def download(cls, count=50) -> dict[str, dict[str, str]]:
+    def scrape(cls, count: int = 50, base_url: str = None, concurrency: int = None, folder: str = None,
+               cache: DownloadCache = None) -> tuple[dict, dict]:
+        """
+        download up to count animals from base_url, defaulting to animalcorner,
+        with their images saved in folder and unchanged pages and images taken from cache
+        returns the animals and the report of the Fetcher, failures included
+        """
+        base_url = base_url or cls.BASE_URL
+        folder = folder or cls.FOLDERS[0]
         output_dict = {}
-        urls = cls.__find_urls()
-        urls = cls.__reduce_size(urls, count)
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(cls.__get_data, url) for url in urls]
 
-            for future in concurrent.futures.as_completed(futures):
-                result = future.result() 
+        with Fetcher(concurrency=concurrency or cls.CONCURRENCY, cache=cache) as fetcher:
+            [html_file] = fetcher.run([fetcher.content(f'{base_url}/animals/')])
+            if html_file is None:
+                raise Exception(f'Download failed. Are you connected to the internet? {fetcher.failures}')
+            urls = cls.__reduce_size(cls.__find_urls(html_file), count)
+
+            results = fetcher.run([cls.__get_data(fetcher, url, folder) for url in urls])
+            for result in results:
                 if result is not None:
                     name, description, image_path = result
                     output_dict[name] = {
                         'description' : description,
                         'image_path' : image_path
                     }
+            return output_dict, fetcher.report()
+
+    @classmethod
+    def download(cls, count=50, cache: DownloadCache = None) -> dict[str, dict[str, str]]:
+        output_dict, report = cls.scrape(count, cache=cache)
 
         with open("animal.json", "w") as f:
             json.dump(output_dict, f, indent=2)
-        
+
         print(f"{len(output_dict)} animals downloaded!")
+        for url, error in report['failures'].items():
+            print(f"Failed {url}: {error}")
         return output_dict
@@ -0,0 +1,181 @@
+import asyncio
+import threading
+from http import HTTPStatus
+
+
+class ASGIServer:
+    """
+    class dedicated to serve an ASGI application on localhost with HTTP/1.1 and keep-alive,
+    a minimal stand-in for uvicorn so the ASGI deployment can be load tested offline
+    the server runs its own event loop on a thread. Request bodies need a Content-Length,
+    chunked uploads are refused with 411, and the response is sent once the app has sent its body
+
+    usage:
+    with ASGIServer(application) as server:
+        LoadTest.run(server.url, paths)
+    """
+    BACKLOG = 1024
+    MAX_HEADER_LINES = 100
+
+    def __init__(self, application, host: str = '127.0.0.1', port: int = 0):
+        self.application = application
+        self.host, self.port = host, port
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.lifespan = None
+        self.lifespan_task = None
+        self.stopped = None
+        self.ready = threading.Event()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.startup())
+        self.ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.shutdown())
+        self.loop.close()
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def startup(self) -> None:
+        self.lifespan = asyncio.Queue()
+        started = asyncio.Event()
+        stopped = asyncio.Event()
+
+        async def send(message):
+            if message['type'] == 'lifespan.startup.complete':
+                started.set()
+            elif message['type'] == 'lifespan.shutdown.complete':
+                stopped.set()
+
+        self.lifespan_task = asyncio.ensure_future(
+            self.application({'type': 'lifespan', 'asgi': {'version': '3.0'}}, self.lifespan.get, send))
+        self.stopped = stopped
+        await self.lifespan.put({'type': 'lifespan.startup'})
+        await started.wait()
+        self.server = await asyncio.start_server(self.connection, self.host, self.port, backlog=self.BACKLOG)
+
+    async def shutdown(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        await self.lifespan.put({'type': 'lifespan.shutdown'})
+        await self.stopped.wait()
+
+    async def connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            keep_alive = True
+            while keep_alive:
+                keep_alive = await self.request(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """
+        answer one request of the connection, returns whether it's kept alive
+        """
+        line = await reader.readline()
+        if not line:
+            return False
+        try:
+            method, target, version = line.decode('latin1').rstrip('\r\n').split(' ')
+        except ValueError:
+            await self.error(writer, HTTPStatus.BAD_REQUEST)
+            return False
+
+        headers = []
+        for _ in range(self.MAX_HEADER_LINES):
+            line = await reader.readline()
+            if line in [b'\r\n', b'\n', b'']:
+                break
+            name, _, value = line.decode('latin1').partition(':')
+            headers.append((name.strip().lower().encode('latin1'), value.strip().encode('latin1')))
+        fields = dict(headers)
+
+        if b'chunked' in fields.get(b'transfer-encoding', b''):
+            await self.error(writer, HTTPStatus.LENGTH_REQUIRED)
+            return False
+        body = await reader.readexactly(int(fields.get(b'content-length', 0)))
+
+        http_version = version.split('/')[-1]
+        connection = fields.get(b'connection', b'').lower()
+        keep_alive = connection != b'close' if http_version == '1.1' else connection == b'keep-alive'
+
+        path, _, query = target.partition('?')
+        client = writer.get_extra_info('peername')
+        server = writer.get_extra_info('sockname')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': http_version,
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode('latin1'),
+            'query_string': query.encode('latin1'),
+            'root_path': '',
+            'headers': headers,
+            'client': client[:2] if client else None,
+            'server': server[:2] if server else None,
+        }
+
+        received = False
+
+        async def receive():
+            nonlocal received
+            if received:
+                # the body was read already, wait like a server does for the disconnect
+                await asyncio.Future()
+            received = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+
+        response = {'status': 500, 'headers': [], 'body': []}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'], response['headers'] = message['status'], list(message.get('headers', []))
+            elif message['type'] == 'http.response.body':
+                response['body'].append(message.get('body', b''))
+
+        await self.application(scope, receive, send)
+        content = b''.join(response['body'])
+        names = {name.lower() for name, _ in response['headers']}
+        if b'content-length' not in names:
+            response['headers'].append((b'content-length', str(len(content)).encode()))
+        response['headers'].append((b'connection', b'keep-alive' if keep_alive else b'close'))
+
+        try:
+            reason = HTTPStatus(response['status']).phrase
+        except ValueError:
+            reason = ''
+        lines = [f'HTTP/1.1 {response["status"]} {reason}'.encode('latin1')]
+        lines += [name + b': ' + value for name, value in response['headers']]
+        writer.write(b'\r\n'.join(lines) + b'\r\n\r\n' + (b'' if method == 'HEAD' else content))
+        await writer.drain()
+        return keep_alive
+
+    async def error(self, writer: asyncio.StreamWriter, status: HTTPStatus) -> None:
+        writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.encode())
+        await writer.drain()
@@ -0,0 +1,271 @@
+import random
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.text import slugify
+
+from wildthoughts.counters import ProfileCounters
+from wildthoughts.fragments import CardCache
+from wildthoughts.hot import HotScores
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.models import Animal, Discussion, Petition, UserList, UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.search import SearchIndex, SuggestIndex
+from wildthoughts.votes import VoteService
+
+
+class BulkLoader:
+    """
+    class dedicated to populate the database in bulk, the fast path of Database
+    rows are inserted with bulk_create, which Django splits in batches that fit the limits
+    of SQLite, the many to many rows with one executemany per through-table,
+    and every phase runs in its own transaction
+
+    existing rows (same username, animal name or slug) are skipped with ignore_conflicts,
+    so populating again only adds what's missing. With upsert the fields of the
+    existing users and animals are also updated from the dictionaries with bulk_update
+
+    bulk_create sends no signals, so the vote and signature columns, the profile
+    counters and the search indexes are rebuilt once at the end
+
+    see:
+    util/database for the row by row path
+    util/populate_benchmark for the comparison
+    """
+    ADJECTIVES = ['scariest', 'gorgeous', 'fastest', 'slowest']
+    AUTHOR = {'username': 'animalcorner', 'email': 'animalcorner@gmail.com', 'password': 'WAD2Test2024'}
+    # share of the votes that are upvotes
+    UPVOTE_RATIO = 0.8
+
+    @classmethod
+    def add_users(cls, profile_dict: dict, upsert: bool = False) -> dict[str, int]:
+        """
+        returns a dictionary mapping every username to its profile id
+        """
+        with transaction.atomic():
+            users = [User(username=username, email=data['email'], password=data['password'])
+                     for username, data in profile_dict.items()]
+            users.append(User(**cls.AUTHOR))
+            User.objects.bulk_create(users, ignore_conflicts=True)
+            user_ids = dict(User.objects.values_list('username', 'id'))
+
+            profiles = [UserProfile(user_id=user_ids[username], picture=data['image_path'])
+                        for username, data in profile_dict.items()]
+            profiles.append(UserProfile(user_id=user_ids[cls.AUTHOR['username']]))
+            UserProfile.objects.bulk_create(profiles, ignore_conflicts=True)
+
+            if upsert:
+                existing = {profile.user_id: profile for profile in UserProfile.objects.only('id', 'user_id', 'picture')}
+                changed = []
+                for username, data in profile_dict.items():
+                    profile = existing[user_ids[username]]
+                    if profile.picture != data['image_path']:
+                        profile.picture = data['image_path']
+                        changed.append(profile)
+                UserProfile.objects.bulk_update(changed, ['picture'])
+
+            profile_ids = dict(UserProfile.objects.values_list('user__username', 'id'))
+        return {username: profile_ids[username] for username in [*profile_dict, cls.AUTHOR['username']]}
+
+    @classmethod
+    def add_animals(cls, animal_dict: dict, author_id: int, upsert: bool = False) -> dict[str, int]:
+        """
+        returns a dictionary mapping every animal name to its id
+        """
+        with transaction.atomic():
+            # save() isn't called by bulk_create, the slug is set here
+            animals = [Animal(name=name, slug=slugify(name), author_id=author_id,
+                              description=data['description'], picture=data['image_path'])
+                       for name, data in animal_dict.items()]
+            Animal.objects.bulk_create(animals, ignore_conflicts=True)
+
+            if upsert:
+                changed = []
+                for animal in Animal.objects.filter(name__in=list(animal_dict)).only('id', 'name', 'description', 'picture'):
+                    data = animal_dict[animal.name]
+                    if (animal.description, animal.picture) != (data['description'], data['image_path']):
+                        animal.description, animal.picture = data['description'], data['image_path']
+                        changed.append(animal)
+                Animal.objects.bulk_update(changed, ['description', 'picture'])
+
+            animal_ids = dict(Animal.objects.values_list('name', 'id'))
+        return {name: animal_ids[name] for name in animal_dict if name in animal_ids}
+
+    @classmethod
+    def expand(cls, data_dict: dict, count: int, number) -> dict:
+        """
+        repeat the entries of data_dict until there are count of them,
+        number(key, data, copy) returns the key and data of the copy
+        """
+        items = list(data_dict.items())
+        output_dict = {}
+        for i in range(count):
+            key, data = items[i % len(items)]
+            if i >= len(items):
+                key, data = number(key, data, i // len(items) + 1)
+            output_dict[key] = data
+        return output_dict
+
+    @classmethod
+    def expand_animals(cls, animal_dict: dict, count: int) -> dict:
+        return cls.expand(animal_dict, count, lambda name, data, copy: (f'{name} {copy}', data))
+
+    @classmethod
+    def expand_profiles(cls, profile_dict: dict, count: int) -> dict:
+        return cls.expand(profile_dict, count, lambda username, data, copy: (
+            f'{username}{copy}', {**data, 'email': f'{copy}.{data["email"]}'}
+        ))
+
+    @classmethod
+    def pairs(cls, rng: random.Random, first: list, second: list, count: int) -> list[tuple]:
+        # distinct (first, second) pairs without building every combination
+        count = min(count, len(first) * len(second))
+        return [(first[i // len(second)], second[i % len(second)])
+                for i in rng.sample(range(len(first) * len(second)), count)]
+
+    @classmethod
+    def add_discussions(cls, rng: random.Random, profiles: dict, animals: dict, count: int) -> list[int]:
+        with transaction.atomic():
+            discussions = []
+            for (username, user_id), (name, animal_id) in cls.pairs(rng, list(profiles.items()), list(animals.items()), count):
+                title = f"Why do you like {name} by {username}?"
+                discussions.append(Discussion(title=title, slug=slugify(title), author_id=user_id, animal_id=animal_id))
+            Discussion.objects.bulk_create(discussions, ignore_conflicts=True)
+        return list(Discussion.objects.values_list('id', flat=True))
+
+    @classmethod
+    def add_through(cls, through, rows: list[dict]) -> None:
+        """
+        insert rows of column -> id into a through-table with a single executemany,
+        without a model instance per row. Rows already there are skipped
+        """
+        if not rows:
+            return
+        ops = connection.ops
+        columns = list(rows[0])
+        sql = (f'{ops.insert_statement(ignore_conflicts=True)} {ops.quote_name(through._meta.db_table)} '
+               f'({", ".join(ops.quote_name(column) for column in columns)}) '
+               f'VALUES ({", ".join(["%s"] * len(columns))}) {ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}')
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [[row[column] for column in columns] for row in rows])
+
+    @classmethod
+    def add_user_lists(cls, rng: random.Random, profiles: dict, animals: dict, count: int, size: int = 5) -> list[int]:
+        animal_ids = list(animals.values())
+        with transaction.atomic():
+            user_lists = []
+            for (username, user_id), adjective in cls.pairs(rng, list(profiles.items()), cls.ADJECTIVES, count):
+                title = f'Top {adjective} animals by {username}'
+                user_lists.append(UserList(title=title, slug=slugify(title), author_id=user_id))
+            UserList.objects.bulk_create(user_lists, ignore_conflicts=True)
+
+            user_list_ids = dict(UserList.objects.values_list('slug', 'id'))
+            rows = [{'userlist_id': user_list_ids[user_list.slug], 'animal_id': animal_id}
+                    for user_list in user_lists
+                    for animal_id in rng.sample(animal_ids, min(size, len(animal_ids)))]
+            cls.add_through(UserList.animals.through, rows)
+        return list(UserList.objects.values_list('id', flat=True))
+
+    @classmethod
+    def add_petitions(cls, rng: random.Random, profiles: dict, animals: dict, count: int, signatures: int = 50) -> list[int]:
+        profile_ids = list(profiles.values())
+        pictures = dict(Animal.objects.values_list('id', 'picture'))
+        with transaction.atomic():
+            petitions = {}
+            for (username, user_id), (name, animal_id) in cls.pairs(rng, list(profiles.items()), list(animals.items()), count):
+                title = f'Petition for {name} by {username}'
+                petitions[slugify(title)] = (Petition(title=title, slug=slugify(title), author_id=user_id, goal=100,
+                                                      picture=pictures[animal_id],
+                                                      description="This animal is at the risk of extinction!"), animal_id)
+            Petition.objects.bulk_create([petition for petition, _ in petitions.values()], ignore_conflicts=True)
+
+            petition_ids = dict(Petition.objects.values_list('slug', 'id'))
+            cls.add_through(Petition.animals.through, [
+                {'petition_id': petition_ids[slug], 'animal_id': animal_id} for slug, (_, animal_id) in petitions.items()
+            ])
+            # a re-run draws more signers for the existing petitions, never past their goal
+            goals = dict(Petition.objects.values_list('id', 'goal'))
+            signed = dict(Petition.signed_by.through.objects
+                          .values('petition').annotate(total=Count('*')).values_list('petition', 'total'))
+            rows = []
+            for slug in petitions:
+                petition_id = petition_ids[slug]
+                room = max(goals[petition_id] - signed.get(petition_id, 0), 0)
+                rows.extend({'petition_id': petition_id, 'userprofile_id': profile_id}
+                            for profile_id in rng.sample(profile_ids, rng.randint(0, min(signatures, len(profile_ids), room))))
+            cls.add_through(Petition.signed_by.through, rows)
+            cls.update_signatures()
+        return list(petition_ids.values())
+
+    @classmethod
+    def update_signatures(cls) -> None:
+        # the signatures column from the signed_by rows, like the votes in VoteService.reconcile
+        signed = (Petition.signed_by.through.objects
+                  .filter(petition=OuterRef('pk'))
+                  .values('petition')
+                  .annotate(total=Count('*'))
+                  .values('total'))
+        Petition.objects.update(signatures=Coalesce(Subquery(signed, output_field=IntegerField()), Value(0)))
+
+    @classmethod
+    def add_votes(cls, rng: random.Random, profiles: dict, targets: dict, count: int) -> None:
+        """
+        add count votes from random profiles, spread over the targets,
+        a dictionary mapping a category of VoteService to instance ids
+        """
+        profile_ids = list(profiles.values())
+        categories = [category for category in targets if targets[category]]
+        if not categories or not profile_ids:
+            return
+
+        with transaction.atomic():
+            rows = {}
+            for category in categories:
+                model = VoteService.CATEGORY_TO_MODEL[category]
+                # a profile can't both upvote and downvote, skip what was voted by an earlier run
+                voted = set()
+                for field in ['upvoted_by', 'downvoted_by']:
+                    through, source, target = VoteService.through(model, field)
+                    voted.update(through.objects.values_list(f'{target}_id', f'{source}_id'))
+
+                share = count // len(categories)
+                for profile_id, instance_id in cls.pairs(rng, profile_ids, targets[category], share):
+                    if (profile_id, instance_id) in voted:
+                        continue
+                    field = 'upvoted_by' if rng.random() < cls.UPVOTE_RATIO else 'downvoted_by'
+                    through, source, target = VoteService.through(model, field)
+                    rows.setdefault(through, []).append({f'{source}_id': instance_id, f'{target}_id': profile_id})
+            for through, through_rows in rows.items():
+                cls.add_through(through, through_rows)
+        VoteService.reconcile()
+
+    @classmethod
+    def rebuild(cls) -> None:
+        with transaction.atomic():
+            ProfileCounters.rebuild()
+            SearchIndex.rebuild()
+        HotScores.rebuild_all()
+        SuggestIndex.clear()
+        Leaderboard.clear()
+        CardCache.clear()
+        PageCache.invalidate()
+
+    @classmethod
+    def populate(cls, animal_dict: dict, profile_dict: dict, discussions: int = 5, user_lists: int = 5,
+                 petitions: int = 5, votes: int = 0, seed: int = None, upsert: bool = False) -> None:
+        rng = random.Random(seed)
+        profiles = cls.add_users(profile_dict, upsert)
+        author_id = profiles.pop(cls.AUTHOR['username'])
+        animals = cls.add_animals(animal_dict, author_id, upsert)
+
+        discussion_ids = cls.add_discussions(rng, profiles, animals, discussions)
+        user_list_ids = cls.add_user_lists(rng, profiles, animals, user_lists)
+        cls.add_petitions(rng, profiles, animals, petitions)
+        cls.add_votes(rng, profiles, {
+            'animals': list(animals.values()),
+            'discussions': discussion_ids,
+            'lists': user_list_ids,
+        }, votes)
+        cls.rebuild()
@@ -5,6 +5,7 @@ from django.contrib.auth.models import User
 from django.core.management import execute_from_command_line
 from django.utils.text import slugify
 
+from wildthoughts.counters import ProfileCounters
 from wildthoughts.models import Animal, Discussion, Petition, UserList, UserProfile
 
 
@@ -140,6 +141,8 @@ class Database:
         cls.add_discussions()
         cls.add_user_lists()
         cls.add_petitions()
+        # the random votes above are set directly, count them for their authors
+        ProfileCounters.rebuild()
         print("Populated the database!")
         
     @classmethod
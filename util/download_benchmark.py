@@ -0,0 +1,48 @@
+import tempfile
+
+from util.animal_downloader import AnimalDownloader
+from util.download_cache import DownloadCache
+from util.fixture_server import FixtureServer
+
+
+class DownloadBenchmark:
+    """
+    class dedicated to measure the throughput of AnimalDownloader offline
+    the animals are scraped from a FixtureServer into a temporary folder,
+    once per concurrency level, and animal.json is left untouched.
+    Then a DownloadCache is measured cold, revalidated and within max_age
+    """
+    CONCURRENCY_LEVELS = [1, 4, 8, 16]
+    # stands in for the round trip to animalcorner.org
+    LATENCY = 0.02
+
+    @classmethod
+    def run(cls, count: int = 50) -> list[dict]:
+        results = []
+        with FixtureServer(count=count, latency=cls.LATENCY) as server:
+            for concurrency in cls.CONCURRENCY_LEVELS:
+                with tempfile.TemporaryDirectory() as folder:
+                    output_dict, report = AnimalDownloader.scrape(count, base_url=server.url, concurrency=concurrency, folder=folder)
+                # the index page and one page per animal, images excluded
+                pages = len(output_dict) + 1
+                result = {
+                    'concurrency': concurrency,
+                    'animals': len(output_dict),
+                    'failures': len(report['failures']),
+                    'pages_per_second': pages / report['seconds'],
+                    'megabytes_per_second': report['bytes'] / report['seconds'] / 1e6,
+                }
+                results.append(result)
+                print(f"concurrency {concurrency:>2}: {result['animals']} animals, {result['failures']} failures, "
+                      f"{result['pages_per_second']:.1f} pages/s, {result['megabytes_per_second']:.2f} MB/s")
+
+            with tempfile.TemporaryDirectory() as cache_folder:
+                for run, max_age in [('cold cache', 0), ('revalidated', 0), ('within max_age', DownloadCache.MAX_AGE)]:
+                    cache = DownloadCache(cache_folder, max_age=max_age)
+                    with tempfile.TemporaryDirectory() as folder:
+                        output_dict, report = AnimalDownloader.scrape(count, base_url=server.url, folder=folder, cache=cache)
+                    result = {'run': run, 'animals': len(output_dict), 'seconds': report['seconds'], 'bytes': report['bytes'], **report['cache']}
+                    results.append(result)
+                    print(f"{run:>15}: {result['animals']} animals in {result['seconds']:.2f}s, {result['bytes'] / 1e6:.2f} MB received, "
+                          f"{result['hits']} hits, {result['revalidated']} revalidated, {result['downloaded']} downloaded")
+        return results
@@ -0,0 +1,180 @@
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+
+class DownloadCache:
+    """
+    class dedicated to keep what Fetcher downloads between runs of script.py
+    files are stored once under the sha256 of their content, and every url has a small
+    json entry with the ETag, Last-Modified and hash of what it served last time:
+     - an entry younger than max_age is used without any request
+     - an older one is revalidated with a conditional request, a 304 costs no body
+     - an interrupted download keeps its partial file and continues with a Range
+       request, if the server still serves the same version (If-Range)
+
+    see:
+    util/fetcher for how it's used
+    """
+    FOLDER = 'download_cache'
+    # re-seeding within a day makes no requests at all
+    MAX_AGE = 24 * 60 * 60
+    # also how much of an interrupted download is kept, the images are a few dozen KiB
+    CHUNK_SIZE = 8 * 1024
+
+    def __init__(self, folder: str = None, max_age: float = 0):
+        self.folder = folder or self.FOLDER
+        self.max_age = max_age
+        for name in ['objects', 'entries', 'partial']:
+            os.makedirs(os.path.join(self.folder, name), exist_ok=True)
+        # one per url, created under lock so threads fetching the same url share it
+        self.locks = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.resumed = 0
+        self.downloaded = 0
+
+    def report(self) -> dict:
+        return {
+            'hits': self.hits,
+            'revalidated': self.revalidated,
+            'resumed': self.resumed,
+            'downloaded': self.downloaded,
+        }
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def url_lock(self, url: str) -> threading.Lock:
+        with self.lock:
+            return self.locks.setdefault(url, threading.Lock())
+
+    def key(self, url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.folder, 'objects', digest)
+
+    def entry_path(self, url: str) -> str:
+        return os.path.join(self.folder, 'entries', self.key(url) + '.json')
+
+    def partial_path(self, url: str) -> str:
+        return os.path.join(self.folder, 'partial', self.key(url))
+
+    def read_json(self, path: str) -> dict:
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_json(self, path: str, data: dict) -> None:
+        # replaced in one go so an interrupted run never leaves half an entry
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(path + '.tmp', path)
+
+    def remove(self, *paths: str) -> None:
+        for path in paths:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+
+    def entry(self, url: str) -> dict:
+        entry = self.read_json(self.entry_path(url))
+        if entry and os.path.exists(self.blob_path(entry['sha256'])):
+            return entry
+        return None
+
+    def validators(self, response: requests.Response) -> dict:
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+        }
+
+    def headers(self, url: str, entry: dict) -> tuple[dict, int]:
+        """
+        returns the conditional and range headers for url and the offset to resume from
+        """
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        offset = 0
+        partial = self.read_json(self.partial_path(url) + '.json')
+        validator = partial and (partial['etag'] or partial['last_modified'])
+        if validator and os.path.exists(self.partial_path(url)):
+            offset = os.path.getsize(self.partial_path(url))
+            if offset:
+                headers['Range'] = f'bytes={offset}-'
+                headers['If-Range'] = validator
+        return headers, offset
+
+    def fetch(self, session: requests.Session, url: str, timeout: float, check) -> tuple[str, int]:
+        """
+        returns the path of the cached file for url and the number of bytes received
+        check(response) raises for a response that isn't usable, see Fetcher.check
+        """
+        with self.url_lock(url):
+            entry = self.entry(url)
+            if entry and time.time() - entry['checked'] < self.max_age:
+                self.count('hits')
+                return self.blob_path(entry['sha256']), 0
+
+            headers, offset = self.headers(url, entry)
+            partial_path = self.partial_path(url)
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 304 and entry:
+                    entry['checked'] = time.time()
+                    self.write_json(self.entry_path(url), entry)
+                    self.count('revalidated')
+                    return self.blob_path(entry['sha256']), 0
+                if response.status_code == 416:
+                    # the partial file can't be continued, start again on the retry
+                    self.remove(partial_path, partial_path + '.json')
+                check(response)
+
+                digest = hashlib.sha256()
+                if response.status_code == 206 and offset:
+                    # continue the partial file, its bytes are part of the hash
+                    with open(partial_path, 'rb') as f:
+                        for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                            digest.update(chunk)
+                    mode = 'ab'
+                    self.count('resumed')
+                else:
+                    mode = 'wb'
+                    self.count('downloaded')
+                validators = self.validators(response)
+                self.write_json(partial_path + '.json', validators)
+
+                received = 0
+                with open(partial_path, mode) as out_file:
+                    for chunk in response.iter_content(self.CHUNK_SIZE):
+                        out_file.write(chunk)
+                        digest.update(chunk)
+                        received += len(chunk)
+
+            blob_path = self.blob_path(digest.hexdigest())
+            if os.path.exists(blob_path):
+                os.remove(partial_path)
+            else:
+                os.replace(partial_path, blob_path)
+            os.remove(partial_path + '.json')
+            self.write_json(self.entry_path(url), {
+                'url': url,
+                'sha256': digest.hexdigest(),
+                'size': os.path.getsize(blob_path),
+                'checked': time.time(),
+                **validators,
+            })
+            return blob_path, received
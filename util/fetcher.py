@@ -0,0 +1,164 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import random
+import shutil
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ChunkedEncodingError
+
+
+class FetchError(Exception):
+    pass
+
+
+class Fetcher:
+    """
+    class dedicated to download many urls concurrently for the downloaders
+    asyncio schedules the downloads, at most `concurrency` at a time, and the
+    blocking requests calls run in a thread pool of the same size sharing one
+    requests.Session, so connections are kept alive and reused between urls
+
+    failed requests are retried with exponential backoff, and the urls that
+    still fail are reported in failures instead of being dropped silently.
+    Given a DownloadCache, unchanged urls are served from disk between runs
+
+    usage:
+    with Fetcher(concurrency=8) as fetcher:
+        results = fetcher.run([fetcher.content(url) for url in urls])
+    """
+    CHUNK_SIZE = 64 * 1024
+    RETRY_STATUS = {416, 429, 500, 502, 503, 504}
+
+    def __init__(self, concurrency: int = 8, retries: int = 3, backoff: float = 0.5, timeout: float = 10, cache=None):
+        self.concurrency = concurrency
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = None
+        self.failures: dict[str, str] = {}
+        self.requests = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.session.close()
+
+    def run(self, coroutines: list) -> list:
+        """
+        run the coroutines on a new event loop and return their results in order
+        a coroutine whose url failed returns None, see failures
+        """
+        async def gather():
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+            return await asyncio.gather(*coroutines)
+
+        start = time.perf_counter()
+        try:
+            return asyncio.run(gather())
+        finally:
+            self.seconds += time.perf_counter() - start
+
+    def report(self) -> dict:
+        report = {
+            'requests': self.requests,
+            'bytes': self.bytes,
+            'seconds': self.seconds,
+            'failures': dict(self.failures),
+        }
+        if self.cache:
+            report['cache'] = self.cache.report()
+        return report
+
+    def check(self, response: requests.Response) -> None:
+        if response.status_code in self.RETRY_STATUS:
+            raise FetchError(f'{response.status_code} {response.reason}')
+        response.raise_for_status()
+
+    # get and stream run in the thread pool and return (result, bytes received)
+
+    def get(self, url: str) -> tuple[bytes, int]:
+        if self.cache:
+            path, received = self.cache.fetch(self.session, url, self.timeout, self.check)
+            with open(path, 'rb') as f:
+                return f.read(), received
+        response = self.session.get(url, timeout=self.timeout)
+        self.check(response)
+        return response.content, len(response.content)
+
+    def stream(self, url: str, path: str) -> tuple[int, int]:
+        if self.cache:
+            blob_path, received = self.cache.fetch(self.session, url, self.timeout, self.check)
+            shutil.copyfile(blob_path, path)
+            return os.path.getsize(path), received
+
+        # written chunk by chunk to a temporary file, so a failed download leaves no partial image
+        with self.session.get(url, stream=True, timeout=self.timeout) as response:
+            self.check(response)
+            size = 0
+            partial_path = path + '.part'
+            try:
+                with open(partial_path, 'wb') as out_file:
+                    for chunk in response.iter_content(self.CHUNK_SIZE):
+                        out_file.write(chunk)
+                        size += len(chunk)
+            except BaseException:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+                raise
+        os.replace(partial_path, path)
+        return size, size
+
+    async def call(self, url: str, function, *args):
+        """
+        run function(url, *args) in the thread pool, retrying on connection errors,
+        timeouts and the statuses in RETRY_STATUS. Returns None once retries run out
+        """
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            for attempt in range(self.retries + 1):
+                self.requests += 1
+                try:
+                    result, received = await loop.run_in_executor(self.executor, function, url, *args)
+                    # counted here, on the event loop, rather than in the threads
+                    self.bytes += received
+                    return result
+                except (FetchError, requests.ConnectionError, requests.Timeout, ChunkedEncodingError) as e:
+                    error = e
+                except (requests.RequestException, OSError) as e:
+                    # e.g. a 404 or a full disk, retrying won't help
+                    error = e
+                    break
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+        self.failures[url] = f'{type(error).__name__}: {error}'
+        return None
+
+    async def content(self, url: str) -> bytes:
+        return await self.call(url, self.get)
+
+    async def json(self, url: str):
+        content = await self.call(url, self.get)
+        return json.loads(content) if content is not None else None
+
+    async def save(self, url: str, path: str) -> int:
+        """
+        stream url to path, returns the number of bytes written or None
+        """
+        return await self.call(url, self.stream, path)
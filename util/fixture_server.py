@@ -0,0 +1,164 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.utils.text import slugify
+
+
+class FixtureServer:
+    """
+    class dedicated to serve animalcorner like pages on localhost, so
+    AnimalDownloader can be run and benchmarked offline
+    the pages are rebuilt from animal.json and the images served from
+    media/animal_images, repeated with a numbered name to reach count animals.
+    An image missing from media is replaced by random looking bytes of IMAGE_SIZE
+
+    latency delays every response to stand in for the round trip to the real site,
+    failures maps a path to the number of 503 responses it returns before succeeding
+    and interruptions to the number of times its body is cut in half.
+    Responses carry an ETag and answer conditional and Range requests like the real site
+
+    usage:
+    with FixtureServer(count=100, latency=0.05) as server:
+        AnimalDownloader.scrape(100, base_url=server.url)
+    """
+    IMAGE_FOLDERS = ['media\\animal_images', os.path.join('media', 'animal_images')]
+    IMAGE_SIZE = 20 * 1024
+
+    LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+    def __init__(self, count: int = None, latency: float = 0.0, failures: dict = None, interruptions: dict = None,
+                 animal_file: str = 'animal.json'):
+        with open(animal_file, 'r') as f:
+            animal_dict = json.load(f)
+        self.latency = latency
+        self.failures = dict(failures or {})
+        self.interruptions = dict(interruptions or {})
+        self.requests = []
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.images = {}
+
+        animals = list(animal_dict.items())
+        count = count or len(animals)
+        for i in range(count):
+            name, data = animals[i % len(animals)]
+            # saved as e.g. animal_images\lion.jpg on windows
+            source = data['image_path'].replace('\\', '/').split('/')[-1]
+            filename = source
+            if i >= len(animals):
+                copy = i // len(animals) + 1
+                name = f'{name} {copy}'
+                filename = f'{copy}-{source}'
+            self.pages[f'/animals/{slugify(name)}/'] = (name, data['description'], filename)
+            self.images[f'/images/{filename}'] = source
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def index(self) -> bytes:
+        links = ''.join(f'<li><a href="{self.url}{path}">{escape(name)}</a></li>' for path, (name, _, _) in self.pages.items())
+        return f'<html><head><title>Animals - Animal Corner</title></head><body><ul>{links}</ul></body></html>'.encode()
+
+    def page(self, path: str) -> bytes:
+        name, description, filename = self.pages[path]
+        return (f'<html><head><title>{escape(name)} - Animal Corner</title></head><body>'
+                f'<div class="featured-image-wrapper"><img data-breeze="{self.url}/images/{filename}"></div>'
+                f'<div class="entry-content"><p>{escape(description)}</p></div>'
+                f'</body></html>').encode()
+
+    def image(self, path: str) -> bytes:
+        filename = self.images[path]
+        for folder in self.IMAGE_FOLDERS:
+            full_path = os.path.join(folder, filename)
+            if os.path.exists(full_path):
+                with open(full_path, 'rb') as f:
+                    return f.read()
+        seed = hashlib.sha256(filename.encode()).digest()
+        return (seed * (self.IMAGE_SIZE // len(seed) + 1))[:self.IMAGE_SIZE]
+
+    def respond(self, path: str) -> tuple[int, str, bytes]:
+        with self.lock:
+            self.requests.append(path)
+            if self.failures.get(path):
+                self.failures[path] -= 1
+                return 503, 'text/plain', b'Service Unavailable'
+        if path == '/animals/':
+            return 200, 'text/html', self.index()
+        if path in self.pages:
+            return 200, 'text/html', self.page(path)
+        if path in self.images:
+            return 200, 'image/jpeg', self.image(path)
+        return 404, 'text/plain', b'Not Found'
+
+    def handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, so the connection pool of Fetcher is exercised
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                if server.latency:
+                    time.sleep(server.latency)
+                status, content_type, body = server.respond(self.path)
+                headers = {'Content-Type': content_type}
+                if status == 200:
+                    etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+                    headers.update({'ETag': etag, 'Last-Modified': server.LAST_MODIFIED})
+                    if self.headers.get('If-None-Match') == etag:
+                        status, body = 304, b''
+                    elif self.headers.get('Range', '').startswith('bytes=') and self.headers.get('If-Range') == etag:
+                        start = int(self.headers['Range'][len('bytes='):].split('-')[0])
+                        if start >= len(body):
+                            status, body = 416, b''
+                        else:
+                            headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+                            status, body = 206, body[start:]
+
+                with server.lock:
+                    interrupted = server.interruptions.get(self.path, 0) > 0 and status in (200, 206)
+                    if interrupted:
+                        server.interruptions[self.path] -= 1
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if interrupted:
+                    # announce the whole body but drop the connection halfway through
+                    self.wfile.write(body[:len(body) // 2])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
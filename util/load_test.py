@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+logger = logging.getLogger(__name__)
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    a WSGI server on localhost with a fixed number of worker threads,
+    each one holds a connection from the request line to the last byte of the response,
+    like the sync workers of a WSGI deployment. Connections wait in the listen backlog
+
+    usage:
+    with PooledWSGIServer(application, workers=8) as server:
+        LoadTest.run(server.url, paths)
+    """
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def __init__(self, application, workers: int = 8, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), QuietWSGIRequestHandler)
+        self.set_app(application)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wsgi')
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.thread.join()
+        self.executor.shutdown(wait=True)
+        self.server_close()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self.work, request, client_address)
+
+    def work(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+
+class LoadTest:
+    """
+    class dedicated to load a server with concurrent clients on one event loop
+    every client sends its share of the paths one after the other, each request on a new
+    connection like a browser behind a proxy that doesn't reuse them, and the latency is
+    measured from the connect to the last byte. Cookies are sent as given, per client
+
+    usage:
+    LoadTest.run('http://127.0.0.1:8000', ['/wildthoughts/theme/?theme=dark'] * 1000, concurrency=100)
+    """
+    TIMEOUT = 30
+
+    @classmethod
+    async def fetch(cls, host: str, port: int, path: str, cookie: str) -> int:
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            request = f'GET {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n'
+            if cookie:
+                request += f'Cookie: {cookie}\r\n'
+            writer.write((request + '\r\n').encode('latin1'))
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        return int(response.split(b' ', 2)[1]) if response else 0
+
+    @classmethod
+    async def client(cls, host: str, port: int, paths: list, cookie: str, durations: list, errors: list) -> None:
+        for path in paths:
+            start = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(cls.fetch(host, port, path, cookie), cls.TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as exc:
+                errors.append(type(exc).__name__)
+                continue
+            durations.append(time.perf_counter() - start)
+            if not 200 <= status < 400:
+                errors.append(status)
+
+    @classmethod
+    async def load(cls, url: str, paths: list, concurrency: int, cookies: list) -> dict:
+        parts = urlsplit(url)
+        durations, errors = [], []
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            cls.client(parts.hostname, parts.port, paths[i::concurrency], cookies[i % len(cookies)] if cookies else '', durations, errors)
+            for i in range(concurrency)
+        ])
+        seconds = time.perf_counter() - start
+
+        durations.sort()
+
+        def percentile(share: float) -> float:
+            return round(durations[min(int(len(durations) * share), len(durations) - 1)] * 1000, 1) if durations else 0.0
+
+        return {
+            'requests': len(paths),
+            'requests/s': round(len(paths) / seconds, 1),
+            'p50_ms': round(statistics.median(durations) * 1000, 1) if durations else 0.0,
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(durations[-1] * 1000, 1) if durations else 0.0,
+            'errors': len(errors),
+        }
+
+    @classmethod
+    def run(cls, url: str, paths: list, concurrency: int = 100, cookies: list = None) -> dict:
+        """
+        returns the throughput, latency percentiles and errors of requesting paths
+        """
+        return asyncio.run(cls.load(url, paths, concurrency, cookies))
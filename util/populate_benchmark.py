@@ -0,0 +1,86 @@
+import random
+import time
+
+from django.db import transaction
+
+from util.bulk_loader import BulkLoader
+from util.database import Database
+
+
+class PopulateBenchmark:
+    """
+    class dedicated to compare Database and BulkLoader on the same data
+    animal.json and profile.json are repeated to reach count animals and profiles,
+    each run happens in a transaction that is rolled back, so the database is left untouched
+    """
+
+    @classmethod
+    def timed(cls, function, *args, **kwargs) -> float:
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        return time.perf_counter() - start
+
+    @classmethod
+    def rolled_back(cls, phases: list) -> dict[str, float]:
+        """
+        run the (name, function) phases in order in one transaction and return their durations
+        """
+        seconds = {}
+        with transaction.atomic():
+            for name, function in phases:
+                seconds[name] = cls.timed(function)
+            transaction.set_rollback(True)
+        return seconds
+
+    @classmethod
+    def run(cls, count: int = 1000, votes: int = None) -> dict[str, dict[str, float]]:
+        animal_dict = BulkLoader.expand_animals(Database.load_animal_dict(), count)
+        profile_dict = BulkLoader.expand_profiles(Database.load_profile_dict(), count)
+        votes = count if votes is None else votes
+
+        Database.animal_dict, Database.profile_dict = animal_dict, profile_dict
+        Database.animals, Database.users = None, None
+        try:
+            row_by_row = cls.rolled_back([
+                ('users', Database.add_users),
+                ('animals', Database.add_animals),
+                ('others', lambda: (Database.add_discussions(), Database.add_user_lists(), Database.add_petitions())),
+            ])
+        finally:
+            Database.animal_dict, Database.profile_dict = None, None
+            Database.animals, Database.users = None, None
+
+        profiles, animals = {}, {}
+
+        def add_users():
+            profiles.update(BulkLoader.add_users(profile_dict))
+            profiles.pop(BulkLoader.AUTHOR['username'])
+
+        def add_animals():
+            author_id = BulkLoader.add_users({})[BulkLoader.AUTHOR['username']]
+            animals.update(BulkLoader.add_animals(animal_dict, author_id))
+
+        def add_others():
+            # as many as Database adds
+            BulkLoader.add_discussions(rng, profiles, animals, 5)
+            BulkLoader.add_user_lists(rng, profiles, animals, 5)
+            BulkLoader.add_petitions(rng, profiles, animals, 5)
+
+        rng = random.Random(0)
+        bulk = cls.rolled_back([
+            ('users', add_users),
+            ('animals', add_animals),
+            ('others', add_others),
+            ('votes', lambda: BulkLoader.add_votes(rng, profiles, {'animals': list(animals.values())}, votes)),
+            ('rebuild', BulkLoader.rebuild),
+        ])
+
+        print(f'{count} animals and profiles, {votes} votes')
+        for phase, seconds in bulk.items():
+            if phase in row_by_row:
+                print(f'{phase:>8}: {row_by_row[phase]:.2f}s row by row, {seconds:.2f}s in bulk, '
+                      f'{row_by_row[phase] / seconds:.1f}x faster')
+            else:
+                print(f'{phase:>8}: {seconds:.2f}s in bulk')
+        print(f'{"total":>8}: {sum(row_by_row.values()):.2f}s row by row, {sum(bulk.values()):.2f}s in bulk')
+        return {'row_by_row': row_by_row, 'bulk': bulk}
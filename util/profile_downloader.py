@@ -1,7 +1,8 @@
-import concurrent.futures
 import json
 import os
-import requests
+
+from util.download_cache import DownloadCache
+from util.fetcher import Fetcher
 
 
 class ProfileDownloader:
@@ -11,51 +12,39 @@ class ProfileDownloader:
     """
     FILES = ["profile.json"]
     FOLDERS = ["media\\profile_images"]
+    CONCURRENCY = 8
 
     @classmethod
-    def __get_json(cls, count):
-        url = f'https://randomuser.me/api/?inc=email,login,picture&results={count}'
-        response = requests.get(url)
-        if response.status_code == 200:
-            data = response.json()
-            return data
-        else:
-            raise Exception("Download failed. Are you connected to the internet?")
-
-    @classmethod
-    def __save_image(cls, entry) -> str:
-        img_url = entry['picture']['large']
-        with requests.get(img_url, stream=True) as response:
-            full_path = os.path.join('media\\profile_images', os.path.basename(img_url))
-            with open(full_path, 'wb') as out_file:
-                out_file.write(response.content)
-            img_path = os.path.join('profile_images', os.path.basename(img_url))
-            return img_path
-        
-    @classmethod
-    def __get_data(cls, entry) -> tuple[str, str, str, str]:
+    async def __get_data(cls, fetcher: Fetcher, source: str, entry: dict) -> tuple[str, str, str, str]:
         try:
             username = entry['login']['username']
             email = entry['email']
             password = entry['login']['password']
-            if username and password:
-                image_path = cls.__save_image(entry)
-                if image_path:
-                    result = (username, email, password, image_path)
-                    return result
-        except:
-            pass
-        
+            img_url = entry['picture']['large']
+        except (KeyError, TypeError) as e:
+            # reported like a failed url, the other entries are still downloaded
+            fetcher.failures[source] = f'Malformed entry, {type(e).__name__}: {e}'
+            return None
+        if username and password:
+            full_path = os.path.join(cls.FOLDERS[0], os.path.basename(img_url))
+            if await fetcher.save(img_url, full_path) is not None:
+                image_path = os.path.join('profile_images', os.path.basename(img_url))
+                return username, email, password, image_path
+        return None
+
     @classmethod
-    def download(cls, count=50) -> dict[str, dict[str, str]]:
-        profile_dict = cls.__get_json(count)
+    def download(cls, count=50, cache: DownloadCache = None) -> dict[str, dict[str, str]]:
         output_dict = {}
 
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            futures = [executor.submit(cls.__get_data, entry) for entry in profile_dict['results']]
+        with Fetcher(concurrency=cls.CONCURRENCY, cache=cache) as fetcher:
+            url = f'https://randomuser.me/api/?inc=email,login,picture&results={count}'
+            [profile_dict] = fetcher.run([fetcher.json(url)])
+            if profile_dict is None:
+                raise Exception("Download failed. Are you connected to the internet?")
 
-            for future in concurrent.futures.as_completed(futures):
-                result = future.result() 
+            results = fetcher.run([cls.__get_data(fetcher, f'{url}#results[{i}]', entry)
+                                   for i, entry in enumerate(profile_dict['results'])])
+            for result in results:
                 if result is not None:
                     username, email, password, image_path = result
                     output_dict[username] = {
@@ -64,10 +53,11 @@ class ProfileDownloader:
                         'image_path' : image_path
                     }
 
+            for url, error in fetcher.failures.items():
+                print(f"Failed {url}: {error}")
+
         with open("profile.json", "w") as f:
             json.dump(output_dict, f, indent=2)
-        
+
         print(f"{len(output_dict)} profiles downloaded!")
         return output_dict
-
-        
\ No newline at end of file
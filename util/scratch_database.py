@@ -0,0 +1,40 @@
+import os
+import sqlite3
+import tempfile
+
+from django.db import connection
+
+
+class ScratchDatabase:
+    """
+    class dedicated to point every connection of the process at a copy of the sqlite database
+    for as long as it's entered, e.g. for a benchmark whose writes come from server or worker
+    threads that a transaction of the main thread can't roll back. The copy is deleted on exit
+
+    usage:
+    with ScratchDatabase():
+        ...
+    """
+    def __init__(self):
+        self.folder = None
+        self.name = None
+
+    def __enter__(self):
+        if connection.vendor != 'sqlite':
+            raise RuntimeError('ScratchDatabase copies the sqlite database, it needs the sqlite backend')
+        connection.ensure_connection()
+        self.folder = tempfile.TemporaryDirectory()
+        path = os.path.join(self.folder.name, 'db.sqlite3')
+        copy = sqlite3.connect(path)
+        connection.connection.backup(copy)
+        copy.close()
+        self.name = connection.settings_dict['NAME']
+        connection.close()
+        # the connections of every thread share settings_dict
+        connection.settings_dict['NAME'] = path
+        return self
+
+    def __exit__(self, *args):
+        connection.close()
+        connection.settings_dict['NAME'] = self.name
+        self.folder.cleanup()
@@ -0,0 +1,282 @@
+import datetime
+import itertools
+import random
+
+from django.db import connection, transaction
+from django.urls import reverse
+from django.utils.text import slugify
+
+from util.bulk_loader import BulkLoader
+from wildthoughts.models import Animal, Comment, Discussion, Petition, UserList, UserProfile
+from wildthoughts.votes import VoteService
+
+
+class SyntheticDataset:
+    """
+    class dedicated to generate a large dataset offline, without animal.json or profile.json,
+    skewed like real traffic: a few animals get most of the votes, discussions and
+    list memberships (Zipf), a few users write most of the content, comments and
+    signatures (power law) and most discussions only have a handful of comments
+
+    everything is drawn from random.Random(seed) and the rows are inserted by BulkLoader,
+    so the same seed and scale give the same dataset and benchmark runs stay comparable,
+    the dates included, which are counted back from END_DATE rather than today
+
+    see:
+    util/bulk_loader for the inserts
+    script.py synth
+    """
+    # how many rows of each model per animal
+    RATIOS = {
+        'users': 1,
+        'discussions': 2,
+        'comments': 10,
+        'lists': 0.5,
+        'petitions': 0.1,
+        'votes': 20,
+    }
+    # exponent of the Zipf distribution over animals, discussions and lists
+    SKEW = 1.1
+    # exponent of the Zipf distribution over user activity
+    ACTIVITY = 1.2
+    # shape of the Pareto distribution of list sizes and signatures, lower is more skewed
+    TAIL = 1.5
+    MAX_LIST_SIZE = 200
+    MAX_SIGNATURES = 2000
+    DAYS = 3650
+    # the newest date, the rows are dated up to DAYS before it whatever day the dataset is made
+    END_DATE = datetime.date(2024, 1, 1)
+    UPVOTE_RATIO = 0.8
+
+    ADJECTIVES = ['swift', 'silent', 'golden', 'spotted', 'striped', 'giant', 'pygmy', 'crested', 'horned', 'woolly',
+                  'royal', 'desert', 'arctic', 'river', 'mountain', 'forest', 'island', 'common', 'lesser', 'greater']
+    NOUNS = ['lion', 'tiger', 'otter', 'falcon', 'gecko', 'lemur', 'ibis', 'marmot', 'newt', 'orca',
+             'panda', 'quokka', 'raven', 'shrew', 'tapir', 'vole', 'wombat', 'yak', 'zebra', 'heron']
+    WORDS = ['lives', 'in', 'the', 'wild', 'and', 'eats', 'small', 'insects', 'at', 'night', 'endangered', 'habitat',
+             'loss', 'is', 'a', 'threat', 'to', 'its', 'survival', 'can', 'run', 'fast', 'swims', 'well', 'sleeps',
+             'most', 'of', 'day', 'social', 'groups', 'solitary', 'hunter', 'migrates', 'every', 'year']
+    SYLLABLES = ['ka', 'lo', 'mi', 'ra', 'to', 'ne', 'su', 'vi', 'da', 'el', 'an', 'jo', 'be', 'ri', 'po', 'xu']
+
+    @classmethod
+    def counts(cls, scale: int) -> dict[str, int]:
+        counts = {name: max(int(scale * ratio), 1) for name, ratio in cls.RATIOS.items()}
+        counts['animals'] = scale
+        return counts
+
+    @classmethod
+    def zipf(cls, rng: random.Random, population: list, skew: float) -> tuple[list, list]:
+        """
+        returns the population in a random order of popularity and the cumulative
+        weights to draw from it with rng.choices, the n-th most popular has weight 1 / n ** skew
+        """
+        ranked = list(population)
+        rng.shuffle(ranked)
+        return ranked, list(itertools.accumulate(1 / rank ** skew for rank in range(1, len(ranked) + 1)))
+
+    @classmethod
+    def draw(cls, rng: random.Random, weighted: tuple[list, list], k: int) -> list:
+        population, cum_weights = weighted
+        return rng.choices(population, cum_weights=cum_weights, k=k)
+
+    @classmethod
+    def distinct(cls, rng: random.Random, weighted: tuple[list, list], k: int) -> set:
+        # popular items come up again and again, draw until k distinct ones or give up
+        chosen = set()
+        for _ in range(4):
+            chosen.update(cls.draw(rng, weighted, k - len(chosen)))
+            if len(chosen) >= k:
+                break
+        return chosen
+
+    @classmethod
+    def sentence(cls, rng: random.Random, length: int) -> str:
+        return ' '.join(rng.choices(cls.WORDS, k=length)).capitalize() + '.'
+
+    @classmethod
+    def animal_dict(cls, rng: random.Random, count: int) -> dict:
+        animal_dict = {}
+        for i in range(count):
+            name = f'{rng.choice(cls.ADJECTIVES).title()} {rng.choice(cls.NOUNS)} {i}'
+            animal_dict[name] = {'description': cls.sentence(rng, rng.randint(8, 40)), 'image_path': ''}
+        return animal_dict
+
+    @classmethod
+    def profile_dict(cls, rng: random.Random, count: int) -> dict:
+        profile_dict = {}
+        for i in range(count):
+            username = ''.join(rng.choice(cls.SYLLABLES) for _ in range(3)) + str(i)
+            profile_dict[username] = {'email': f'{username}@example.com', 'password': 'synthetic', 'image_path': ''}
+        return profile_dict
+
+    @classmethod
+    def spread_dates(cls, rng: random.Random, model, ids: list[int]) -> None:
+        # auto_now_add gives every row today's date, spread them over the DAYS before END_DATE
+        rows = [[cls.END_DATE - datetime.timedelta(days=int(rng.triangular(0, cls.DAYS, 0))), row_id] for row_id in ids]
+        sql = f'UPDATE {connection.ops.quote_name(model._meta.db_table)} SET date = %s WHERE id = %s'
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+    @classmethod
+    def add_discussions(cls, rng: random.Random, authors, animals, count: int) -> list[int]:
+        with transaction.atomic():
+            discussions = []
+            for i, (author_id, animal_id) in enumerate(zip(cls.draw(rng, authors, count), cls.draw(rng, animals, count))):
+                title = f'{cls.sentence(rng, rng.randint(3, 8))[:-1]}? {i}'
+                discussions.append(Discussion(title=title, slug=slugify(title), author_id=author_id, animal_id=animal_id,
+                                              description=cls.sentence(rng, rng.randint(5, 60))))
+            Discussion.objects.bulk_create(discussions)
+            ids = list(Discussion.objects.order_by('id').values_list('id', flat=True))
+            cls.spread_dates(rng, Discussion, ids)
+        return ids
+
+    @classmethod
+    def add_comments(cls, rng: random.Random, authors, discussions, count: int) -> list[int]:
+        # drawn from a Zipf over discussions, a few threads are long and most have one or two comments
+        with transaction.atomic():
+            Comment.objects.bulk_create([
+                Comment(author_id=author_id, discussion_id=discussion_id, content=cls.sentence(rng, rng.randint(3, 50)))
+                for author_id, discussion_id in zip(cls.draw(rng, authors, count), cls.draw(rng, discussions, count))
+            ])
+            ids = list(Comment.objects.order_by('id').values_list('id', flat=True))
+            cls.spread_dates(rng, Comment, ids)
+        return ids
+
+    @classmethod
+    def size(cls, rng: random.Random, minimum: int, limit: int) -> int:
+        # a power law, most are close to minimum and a few are huge
+        return min(int(minimum * rng.paretovariate(cls.TAIL)), limit)
+
+    @classmethod
+    def add_user_lists(cls, rng: random.Random, authors, animals, count: int) -> list[int]:
+        with transaction.atomic():
+            user_lists = []
+            for i, author_id in enumerate(cls.draw(rng, authors, count)):
+                title = f'Top {rng.choice(BulkLoader.ADJECTIVES)} animals {i}'
+                user_lists.append(UserList(title=title, slug=slugify(title), author_id=author_id))
+            UserList.objects.bulk_create(user_lists)
+            ids = list(UserList.objects.order_by('id').values_list('id', flat=True))
+
+            limit = min(cls.MAX_LIST_SIZE, len(animals[0]))
+            BulkLoader.add_through(UserList.animals.through, [
+                {'userlist_id': user_list_id, 'animal_id': animal_id}
+                for user_list_id in ids
+                for animal_id in sorted(cls.distinct(rng, animals, cls.size(rng, 5, limit)))
+            ])
+            cls.spread_dates(rng, UserList, ids)
+        return ids
+
+    @classmethod
+    def add_petitions(cls, rng: random.Random, authors, animals, signers, count: int) -> list[int]:
+        with transaction.atomic():
+            limit = min(cls.MAX_SIGNATURES, len(signers[0]))
+            signatures = [sorted(cls.distinct(rng, signers, cls.size(rng, 10, limit))) for _ in range(count)]
+            petitions = []
+            for i, (author_id, signed_by) in enumerate(zip(cls.draw(rng, authors, count), signatures)):
+                title = f'Save the {rng.choice(cls.NOUNS)}s {i}'
+                # the goal is never below the signatures, see Petition.save
+                goal = max(100, -(-len(signed_by) // 100) * 100)
+                petitions.append(Petition(title=title, slug=slugify(title), author_id=author_id, goal=goal,
+                                          description=cls.sentence(rng, rng.randint(10, 80))))
+            Petition.objects.bulk_create(petitions)
+            ids = list(Petition.objects.order_by('id').values_list('id', flat=True))
+
+            BulkLoader.add_through(Petition.animals.through, [
+                {'petition_id': petition_id, 'animal_id': animal_id}
+                for petition_id, animal_id in zip(ids, cls.draw(rng, animals, count))
+            ])
+            BulkLoader.add_through(Petition.signed_by.through, [
+                {'petition_id': petition_id, 'userprofile_id': profile_id}
+                for petition_id, signed_by in zip(ids, signatures)
+                for profile_id in signed_by
+            ])
+            BulkLoader.update_signatures()
+            cls.spread_dates(rng, Petition, ids)
+        return ids
+
+    @classmethod
+    def add_votes(cls, rng: random.Random, voters, targets: dict, count: int) -> None:
+        """
+        targets maps a category of VoteService to the weighted instances,
+        the votes are shared between them like the requests of VoteView
+        """
+        with transaction.atomic():
+            rows = {}
+            shares = {'animals': 0.4, 'discussions': 0.25, 'comments': 0.25, 'lists': 0.1}
+            for category, weighted in targets.items():
+                model = VoteService.CATEGORY_TO_MODEL[category]
+                k = int(count * shares[category])
+                pairs = set(zip(cls.draw(rng, weighted, k), cls.draw(rng, voters, k)))
+                for instance_id, profile_id in sorted(pairs):
+                    field = 'upvoted_by' if rng.random() < cls.UPVOTE_RATIO else 'downvoted_by'
+                    through, source, target = VoteService.through(model, field)
+                    rows.setdefault(through, []).append({f'{source}_id': instance_id, f'{target}_id': profile_id})
+            for through, through_rows in rows.items():
+                BulkLoader.add_through(through, through_rows)
+        VoteService.reconcile()
+
+    @classmethod
+    def generate(cls, scale: int = 1000, seed: int = 0, **counts) -> dict[str, int]:
+        """
+        fill an empty database with scale animals, the other models scale with RATIOS
+        unless their count is given, e.g. generate(1000, comments=50000)
+        returns the number of rows of every model
+        """
+        rng = random.Random(seed)
+        counts = {**cls.counts(scale), **counts}
+
+        profiles = BulkLoader.add_users(cls.profile_dict(rng, counts['users']))
+        author_id = profiles.pop(BulkLoader.AUTHOR['username'])
+        animals = BulkLoader.add_animals(cls.animal_dict(rng, counts['animals']), author_id)
+        cls.spread_dates(rng, Animal, sorted(animals.values()))
+        cls.spread_dates(rng, UserProfile, sorted([author_id, *profiles.values()]))
+
+        # the same users are the most active everywhere
+        authors = cls.zipf(rng, sorted(profiles.values()), cls.ACTIVITY)
+        animals = cls.zipf(rng, sorted(animals.values()), cls.SKEW)
+        discussions = cls.zipf(rng, cls.add_discussions(rng, authors, animals, counts['discussions']), cls.SKEW)
+        comments = cls.zipf(rng, cls.add_comments(rng, authors, discussions, counts['comments']), cls.SKEW)
+        user_lists = cls.zipf(rng, cls.add_user_lists(rng, authors, animals, counts['lists']), cls.SKEW)
+        cls.add_petitions(rng, authors, animals, authors, counts['petitions'])
+        cls.add_votes(rng, authors, {
+            'animals': animals,
+            'discussions': discussions,
+            'comments': comments,
+            'lists': user_lists,
+        }, counts['votes'])
+        BulkLoader.rebuild()
+
+        return {model.__name__: model.objects.count() for model in [UserProfile, Animal, Discussion, Comment, UserList, Petition]}
+
+    @classmethod
+    def load_profile(cls, count: int = 1000, seed: int = 0) -> list[str]:
+        """
+        returns count urls to request, the pages visited most on a real site:
+        the most voted animals, discussions and lists get most of the views
+        """
+        rng = random.Random(seed)
+        pages = [
+            ('wildthoughts:animal', Animal.objects.order_by('-votes', '-id').values_list('slug', flat=True), 0.35),
+            ('wildthoughts:discussion', Discussion.objects.order_by('-votes', '-id').values_list('slug', flat=True), 0.25),
+            ('wildthoughts:list', UserList.objects.order_by('-votes', '-id').values_list('slug', flat=True), 0.1),
+            ('wildthoughts:petition', Petition.objects.order_by('-signatures', '-id').values_list('slug', flat=True), 0.05),
+            ('wildthoughts:profile', UserProfile.objects.order_by('-votes_received', '-id').values_list('user__username', flat=True), 0.05),
+        ]
+        listings = ['wildthoughts:index', 'wildthoughts:animals', 'wildthoughts:discussions',
+                    'wildthoughts:lists', 'wildthoughts:petitions', 'wildthoughts:profiles']
+
+        weighted = []
+        for name, slugs, share in pages:
+            slugs = list(slugs[:10000])
+            if slugs:
+                cum_weights = list(itertools.accumulate(1 / rank ** cls.SKEW for rank in range(1, len(slugs) + 1)))
+                weighted.append((name, slugs, cum_weights, share))
+
+        urls = []
+        shares = [share for _, _, _, share in weighted]
+        for _ in range(count):
+            if rng.random() < 1 - sum(shares):
+                urls.append(reverse(rng.choice(listings)))
+                continue
+            name, slugs, cum_weights, _ = rng.choices(weighted, weights=shares)[0]
+            urls.append(reverse(name, args=[rng.choices(slugs, cum_weights=cum_weights)[0]]))
+        return urls
@@ -0,0 +1,21 @@
+"""
+ASGI config for wad2_project project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Django 2.2 has no ASGI support of its own, the WSGI application is served
+through wildthoughts.asgi.ASGIHandler, e.g.
+
+    uvicorn wad2_project.asgi:application
+"""
+
+import os
+
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wad2_project.settings')
+
+wsgi_application = get_wsgi_application()
+
+from wildthoughts.asgi import ASGIHandler  # noqa: E402, the apps must be loaded first
+
+application = ASGIHandler(wsgi_application)
@@ -48,20 +48,24 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'wildthoughts.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'wildthoughts.middleware.StaticAssetsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'wildthoughts.middleware.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'wildthoughts.middleware.PageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'wad2_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'wildthoughts.metrics.TimedDjangoTemplates',
         'DIRS': [TEMPLATE_DIR, ],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -86,6 +90,21 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # a file backed test database so the concurrency tests get real locking
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+    }
+}
+
+# the widget cards and anonymous pages are cached, see: wildthoughts fragments and page_cache
+# the default of 300 entries would be evicting them all the time
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
@@ -136,6 +155,10 @@ STATIC_URL = '/static/'
 
 STATICFILES_DIRS = [STATIC_DIR, ]
 
+# collectstatic hashes the files and compresses the text ones, see: wildthoughts static_assets
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+STATICFILES_STORAGE = 'wildthoughts.static_assets.CompressedManifestStorage'
+
 MEDIA_ROOT = MEDIA_DIR
 MEDIA_URL = '/media/'
 
@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class AnimalsOfAllTimeConfig(AppConfig):
     name = 'wildthoughts'
+
+    def ready(self):
+        # connect the signal receivers
+        from wildthoughts import signals
+        # register the check of the static files in the templates
+        from wildthoughts import static_assets
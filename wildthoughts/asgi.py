@@ -0,0 +1,163 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import HttpResponse, QueryDict
+from django.urls import Resolver404, resolve
+
+from wildthoughts.views import ThemeView
+
+
+class ASGIHandler:
+    """
+    class dedicated to serve the project to an ASGI server, Django 2.2 only speaks WSGI
+    the event loop holds the connections and reads the request bodies, the views run
+    in a bounded pool of ASGI_THREADS threads with the WSGI handler, so a slow client
+    never holds a thread and the number of database connections is bounded.
+    The ORM is synchronous, the vote, sign and search views do their queries on the pool
+
+    the views of WRITERS get their own pool of ASGI_WRITE_THREADS, one by default: sqlite
+    lets one connection write at a time and the others sleep in its busy handler, so the
+    votes and signatures wait their turn on the event loop instead and the reads don't wait
+    behind them. The views of NATIVE don't touch the database and are answered on the event
+    loop without a thread or the middleware, e.g. the theme switch of static/js/theme
+
+    see:
+    wad2_project/asgi for the entry point
+    util/asgi_server and management/commands/benchmark_asgi for the load test
+    """
+    NATIVE = {
+        'wildthoughts:theme': 'theme',
+    }
+    WRITERS = ['wildthoughts:vote', 'wildthoughts:sign_petition']
+
+    def __init__(self, wsgi_application):
+        self.wsgi_application = wsgi_application
+        self.executors = {}
+
+    @classmethod
+    def threads(cls) -> int:
+        return getattr(settings, 'ASGI_THREADS', 8)
+
+    @classmethod
+    def write_threads(cls) -> int:
+        return getattr(settings, 'ASGI_WRITE_THREADS', 1)
+
+    def executor(self, lane: str) -> ThreadPoolExecutor:
+        if lane not in self.executors:
+            threads = self.write_threads() if lane == 'write' else self.threads()
+            self.executors[lane] = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f'asgi-{lane}')
+        return self.executors[lane]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for executor in self.executors.values():
+                    executor.shutdown(wait=True)
+                self.executors = {}
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def http(self, scope, receive, send) -> None:
+        view_name = self.view_name(scope)
+        if view_name in self.NATIVE:
+            return await self.send_response(send, getattr(self, self.NATIVE[view_name])(scope))
+
+        body = io.BytesIO()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body.write(message.get('body', b''))
+            more_body = message.get('more_body', False)
+        body.seek(0)
+
+        executor = self.executor('write' if view_name in self.WRITERS else 'read')
+        loop = asyncio.get_running_loop()
+        status, headers, content = await loop.run_in_executor(executor, self.run_wsgi, self.environ(scope, body))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': content})
+
+    def view_name(self, scope) -> str:
+        try:
+            return resolve(scope['path']).view_name
+        except Resolver404:
+            return None
+
+    def theme(self, scope) -> HttpResponse:
+        query = QueryDict(scope.get('query_string', b'').decode('latin1'))
+        return ThemeView.respond(query.get('theme'))
+
+    async def send_response(self, send, response: HttpResponse) -> None:
+        headers = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in response.items()]
+        headers += [(b'set-cookie', cookie.output(header='').strip().encode('latin1')) for cookie in response.cookies.values()]
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': response.content})
+
+    @classmethod
+    def environ(cls, scope, body: io.BytesIO) -> dict:
+        """
+        the WSGI environ of an ASGI http scope, see: PEP 3333
+        """
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': body,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope.get('headers', []):
+            name, value = name.decode('latin1').upper().replace('-', '_'), value.decode('latin1')
+            if name not in ['CONTENT_TYPE', 'CONTENT_LENGTH']:
+                name = f'HTTP_{name}'
+            if name in environ:
+                # repeated headers are joined, cookies with their own separator
+                value = environ[name] + ('; ' if name == 'HTTP_COOKIE' else ',') + value
+            environ[name] = value
+        return environ
+
+    def run_wsgi(self, environ: dict) -> tuple[int, list, bytes]:
+        """
+        call the WSGI handler on a thread of the pool and read the whole response,
+        Django closes the database connection when the response is closed
+        """
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started['status'], started['headers'] = status, headers
+
+        result = self.wsgi_application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+        headers = [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in started['headers']]
+        return int(started['status'].split(' ', 1)[0]), headers, content
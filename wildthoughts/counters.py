@@ -0,0 +1,112 @@
+from django.db.models import Count, F, IntegerField, Model, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from wildthoughts.models import Animal, Comment, Discussion, Petition, UserList, UserProfile
+
+
+class ProfileCounters:
+    """
+    class dedicated to keep the activity counters of UserProfile in step with the content tables
+    every change is a database side F() increment of the profile row, made in the same
+    transaction as the change it counts, so a profile header or the profile list
+    shows and sorts by activity without counting anything
+
+    see:
+    signals for created and deleted content
+    votes VoteService for votes received
+    signatures SignatureService for petitions signed
+    management/commands/rebuild_profile_counters for fixing drift
+    """
+    AUTHORED = {
+        Animal: 'animals_count',
+        Discussion: 'discussions_count',
+        Comment: 'comments_count',
+        UserList: 'lists_count',
+        Petition: 'petitions_count',
+    }
+    VOTED = [Animal, Discussion, Comment, UserList]
+
+    @classmethod
+    def add(cls, profiles, **deltas) -> None:
+        deltas = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if deltas:
+            profiles.update(**deltas)
+
+    @classmethod
+    def authored(cls, instance: Model, delta: int) -> None:
+        """
+        count a created (delta 1) or deleted (delta -1) animal, discussion, comment, list or petition
+        its votes are added to or taken away from its author's votes received
+        """
+        model = type(instance)
+        deltas = {cls.AUTHORED[model]: delta}
+        if model in cls.VOTED:
+            deltas['votes_received'] = delta * instance.votes
+        cls.add(UserProfile.objects.filter(id=instance.author_id), **deltas)
+
+    @classmethod
+    def voted(cls, model: Model, instance_id: int, delta: int) -> None:
+        author = model.objects.filter(id=instance_id).values('author_id')
+        cls.add(UserProfile.objects.filter(id=Subquery(author)), votes_received=delta)
+
+    @classmethod
+    def signed(cls, profile_id: int, delta: int = 1) -> None:
+        cls.add(UserProfile.objects.filter(id=profile_id), signatures_count=delta)
+
+    @classmethod
+    def petition_deleted(cls, petition: Petition) -> None:
+        # the signed_by rows are deleted by the cascade without a signal
+        cls.add(UserProfile.objects.filter(signed_petitions=petition), signatures_count=-1)
+
+    @classmethod
+    def total(cls, expressions: list):
+        total = expressions[0]
+        for expression in expressions[1:]:
+            total = total + expression
+        return total
+
+    @classmethod
+    def activity(cls):
+        # everything a profile has authored, sorted by in Sorter.sort_profiles
+        return cls.total([F(field) for field in cls.AUTHORED.values()])
+
+    @classmethod
+    def aggregate(cls, model: Model, aggregate) -> Coalesce:
+        values = (model.objects.filter(author=OuterRef('pk'))
+                  .values('author')
+                  .annotate(total=aggregate)
+                  .values('total'))
+        return Coalesce(Subquery(values, output_field=IntegerField()), Value(0))
+
+    @classmethod
+    def actual(cls) -> dict:
+        """
+        returns a dictionary mapping every counter to an expression
+        computing it from the content tables
+        """
+        actual = {field: cls.aggregate(model, Count('*')) for model, field in cls.AUTHORED.items()}
+        actual['votes_received'] = cls.total([cls.aggregate(model, Sum('votes')) for model in cls.VOTED])
+        signed = (Petition.signed_by.through.objects
+                  .filter(userprofile=OuterRef('pk'))
+                  .values('userprofile')
+                  .annotate(total=Count('*'))
+                  .values('total'))
+        actual['signatures_count'] = Coalesce(Subquery(signed, output_field=IntegerField()), Value(0))
+        return actual
+
+    @classmethod
+    def rebuild(cls, dry_run: bool = False) -> int:
+        """
+        recompute every counter and fix the drifted profiles
+        returns how many profiles had drifted
+        """
+        actual = cls.actual()
+        annotations = {f'actual_{field}': expression for field, expression in actual.items()}
+        drift = Q()
+        for field in actual:
+            drift |= ~Q(**{field: F(f'actual_{field}')})
+        drifted = UserProfile.objects.annotate(**annotations).filter(drift)
+        count = drifted.count()
+        if count and not dry_run:
+            UserProfile.objects.filter(id__in=drifted.values('id')).update(**actual)
+        return count
@@ -0,0 +1,166 @@
+import hashlib
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Model
+
+from wildthoughts.counters import ProfileCounters
+from wildthoughts.models import Animal, Discussion, Petition, UserList, UserProfile
+
+
+class CardBatch:
+    """
+    the cache keys and cached html of the cards of one widget, see: CardCache.fetch
+    """
+    def __init__(self, keys: dict, fragments: dict):
+        self.keys = keys
+        self.fragments = fragments
+
+    def get(self, instance: Model) -> str:
+        html = self.fragments.get(self.keys.get(instance.id))
+        if self.keys:
+            CardCache.record(type(instance), html is not None)
+        return html
+
+    def set(self, instance: Model, html: str) -> None:
+        key = self.keys.get(instance.id)
+        if key:
+            cache.set(key, html, CardCache.timeout())
+
+
+class CardCache:
+    """
+    class dedicated to keep the rendered html of the widget cards in the cache
+    a card is cached under its id and the versions of the rows it shows: its own and its
+    author's, and the animal of a discussion. Saving, deleting, voting or signing bumps the
+    version of the row, so the cards showing it are rendered again on the next request
+
+    a version is a random token that lives in the cache, bumping deletes it and a new token
+    is made the next time it's read, so an evicted version can never match an old card.
+    The profile counters are moved by F() updates without signals, their values from
+    the row are part of the key of a profile card instead
+
+    the vote buttons depend on the viewer, they are left out of the cached html
+    as SLOT and rendered for every request, see: templatetags/wildthoughts card()
+
+    see:
+    signals for saved and deleted rows
+    votes VoteService and signatures SignatureService for votes and signatures
+    """
+    PREFIX = 'wildthoughts:card'
+    GENERATION = 'wildthoughts:card:generation'
+    SLOT = '<!-- vote -->'
+    # model -> foreign keys to the rows its card shows
+    DEPENDENCIES = {
+        Animal: {'author_id': UserProfile},
+        Discussion: {'author_id': UserProfile, 'animal_id': Animal},
+        Petition: {'author_id': UserProfile},
+        UserList: {'author_id': UserProfile},
+        UserProfile: {},
+    }
+    # model -> fields read from the row itself
+    FIELDS = {
+        UserProfile: [*ProfileCounters.AUTHORED.values(), 'votes_received', 'signatures_count'],
+    }
+
+    lock = threading.Lock()
+    hits: Counter = Counter()
+    misses: Counter = Counter()
+
+    @classmethod
+    def timeout(cls) -> int:
+        # 0 turns the cache off
+        return getattr(settings, 'CARD_CACHE_TIMEOUT', 3600)
+
+    @classmethod
+    def version_key(cls, model: Model, id: int) -> str:
+        return f'{cls.PREFIX}:version:{model._meta.model_name}:{id}'
+
+    @classmethod
+    def versions(cls, keys: list[str]) -> dict[str, str]:
+        versions = cache.get_many(keys)
+        for key in keys:
+            if key not in versions:
+                # another request may have made it first
+                cache.add(key, uuid.uuid4().hex, None)
+                versions[key] = cache.get(key)
+        return versions
+
+    @classmethod
+    def fetch(cls, instances) -> CardBatch:
+        """
+        look up the cards of a page of instances with two cache round trips
+        """
+        instances = list(instances)
+        if not instances or not cls.timeout():
+            return CardBatch({}, {})
+
+        model = type(instances[0])
+        dependencies = {}
+        for instance in instances:
+            dependencies[instance.id] = [cls.version_key(model, instance.id)] + [
+                cls.version_key(related, getattr(instance, field))
+                for field, related in cls.DEPENDENCIES[model].items()
+            ]
+        versions = cls.versions([cls.GENERATION, *{key for keys in dependencies.values() for key in keys}])
+
+        keys = {}
+        for instance in instances:
+            parts = [versions[cls.GENERATION]] + [versions[key] for key in dependencies[instance.id]]
+            parts += [str(getattr(instance, field)) for field in cls.FIELDS.get(model, [])]
+            digest = hashlib.md5(':'.join(parts).encode()).hexdigest()
+            keys[instance.id] = f'{cls.PREFIX}:{model._meta.model_name}:{instance.id}:{digest}'
+        return CardBatch(keys, cache.get_many(list(keys.values())))
+
+    @classmethod
+    def bump(cls, model: Model, *ids: int) -> None:
+        if model in cls.DEPENDENCIES:
+            cache.delete_many([cls.version_key(model, id) for id in ids])
+
+    @classmethod
+    def record(cls, model: Model, hit: bool) -> None:
+        with cls.lock:
+            (cls.hits if hit else cls.misses)[model._meta.model_name] += 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        """
+        returns the hits, misses and hit ratio of this process per card
+        """
+        with cls.lock:
+            stats = {}
+            for name in sorted(set(cls.hits) | set(cls.misses)):
+                hits, misses = cls.hits[name], cls.misses[name]
+                stats[name] = {'hits': hits, 'misses': misses, 'ratio': round(hits / (hits + misses), 4)}
+            return stats
+
+    @classmethod
+    def prometheus(cls) -> str:
+        descriptions = {
+            'hits': (cls.hits, 'Widget cards served from the cache'),
+            'misses': (cls.misses, 'Widget cards rendered and cached'),
+        }
+        lines = []
+        with cls.lock:
+            for name, (counter, description) in descriptions.items():
+                lines.append(f'# HELP wildthoughts_card_cache_{name}_total {description}')
+                lines.append(f'# TYPE wildthoughts_card_cache_{name}_total counter')
+                lines.extend(f'wildthoughts_card_cache_{name}_total{{card="{card}"}} {count}'
+                             for card, count in sorted(counter.items()))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def clear(cls) -> None:
+        """
+        forget every card, e.g. after rows were added in bulk without signals
+        """
+        cache.delete(cls.GENERATION)
+
+    @classmethod
+    def reset_stats(cls) -> None:
+        with cls.lock:
+            cls.hits.clear()
+            cls.misses.clear()
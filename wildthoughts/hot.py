@@ -0,0 +1,103 @@
+import datetime
+import math
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Model
+
+from wildthoughts.models import Animal, Discussion, UserList
+
+try:
+    import numpy
+except ImportError:
+    # the scores are computed row by row, the same values only slower
+    numpy = None
+
+
+class HotScores:
+    """
+    class dedicated to keep the hot column of the voteable lists, what Sorter sorts by for 'hot'
+    the score is the order of magnitude of the votes plus the age of the row counted from EPOCH:
+        sign(votes) * log10(max(|votes|, 1)) + days since EPOCH / HOT_DECAY_DAYS
+    so a row HOT_DECAY_DAYS newer needs ten times fewer votes to rank the same. Every row decays
+    at the same rate, which leaves the order as it is, so a score never goes stale with time and
+    a vote only has to rewrite the score of its own row, see: VoteService.vote and VoteBuffer.flush
+
+    rows written without a vote or a save, by bulk_create, reconcile_votes or BulkLoader, and
+    every row after a change of HOT_DECAY_DAYS are caught up by rebuild(), which computes the
+    scores of a whole table at once with numpy and writes the ones that changed
+
+    see:
+    signals for created and edited rows
+    management/commands/update_hot_scores for the periodic job
+    """
+    MODELS = [Animal, Discussion, UserList]
+    EPOCH = datetime.date(2020, 1, 1)
+    BATCH_SIZE = 5000
+
+    @classmethod
+    def decay_days(cls) -> float:
+        return getattr(settings, 'HOT_DECAY_DAYS', 1)
+
+    @classmethod
+    def score(cls, votes: int, date: datetime.date) -> float:
+        sign = (votes > 0) - (votes < 0)
+        return sign * math.log10(max(abs(votes), 1)) + (date - cls.EPOCH).days / cls.decay_days()
+
+    @classmethod
+    def scores(cls, votes: list[int], dates: list[datetime.date]) -> list[float]:
+        """
+        the score of every (votes, date) pair, vectorised when numpy is installed
+        """
+        if numpy is None:
+            return [cls.score(count, date) for count, date in zip(votes, dates)]
+        votes = numpy.array(votes, dtype=numpy.float64)
+        days = (numpy.array(dates, dtype='datetime64[D]') - numpy.datetime64(cls.EPOCH, 'D')).astype(numpy.float64)
+        scores = numpy.sign(votes) * numpy.log10(numpy.maximum(numpy.abs(votes), 1)) + days / cls.decay_days()
+        return scores.tolist()
+
+    @classmethod
+    def columns(cls, model: Model, votes: int, date: datetime.date) -> dict[str, float]:
+        """
+        the hot column of a row to write along with its votes, empty for a model without one
+        """
+        return {'hot': cls.score(votes, date)} if model in cls.MODELS else {}
+
+    @classmethod
+    def refresh(cls, model: Model, instance_id: int, votes: int = None, date: datetime.date = None) -> None:
+        """
+        rewrite the score of one row, its votes and date are read unless given
+        """
+        if model not in cls.MODELS:
+            return
+        if votes is None or date is None:
+            row = model.objects.filter(id=instance_id).values_list('votes', 'date').first()
+            if row is None:
+                return
+            votes, date = row
+        model.objects.filter(id=instance_id).update(hot=cls.score(votes, date))
+
+    @classmethod
+    def rebuild(cls, model: Model, dry_run: bool = False) -> int:
+        """
+        recompute the score of every row of model, returns how many had changed
+        """
+        if model not in cls.MODELS:
+            return 0
+        with transaction.atomic():
+            rows = list(model.objects.values_list('id', 'votes', 'date', 'hot'))
+            if not rows:
+                return 0
+            ids, votes, dates, hots = zip(*rows)
+            changed = [(score, instance_id) for instance_id, score, hot in zip(ids, cls.scores(votes, dates), hots) if score != hot]
+            if changed and not dry_run:
+                table, column, pk = (connection.ops.quote_name(name) for name in [model._meta.db_table, 'hot', 'id'])
+                with connection.cursor() as cursor:
+                    for start in range(0, len(changed), cls.BATCH_SIZE):
+                        cursor.executemany(f'UPDATE {table} SET {column} = %s WHERE {pk} = %s',
+                                           changed[start:start + cls.BATCH_SIZE])
+        return len(changed)
+
+    @classmethod
+    def rebuild_all(cls, dry_run: bool = False) -> dict[str, int]:
+        return {model.__name__: cls.rebuild(model, dry_run) for model in cls.MODELS}
@@ -0,0 +1,143 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from wildthoughts.models import Animal, Discussion, Petition, UserProfile
+
+
+class ImageDerivatives:
+    """
+    class dedicated to make resized copies of the uploaded pictures, in WebP and in the
+    format of the original, for every size the templates show them at and twice that
+    for high density screens. The copies are cropped to fill the size, like object-fit: cover,
+    and a size the original can't fill is left to the original
+
+    a copy lives under MEDIA_ROOT/derivatives with the path of its original, e.g.
+    derivatives/animal_images/Lion.150x90@2x.webp. They are made when a picture is saved
+    and in bulk by the build_image_derivatives command, a copy older than its original
+    is made again
+
+    see:
+    templatetags/wildthoughts picture() for the srcset
+    management/commands/benchmark_images for the bytes per page
+    """
+    FOLDER = 'derivatives'
+    DENSITIES = [1, 2]
+    # the (width, height) each picture is shown at
+    SIZES = {
+        Animal: [(24, 24), (38, 38), (150, 90), (615, 410)],
+        Discussion: [(615, 410)],
+        Petition: [(230, 230), (615, 410)],
+        UserProfile: [(24, 24), (38, 38), (64, 64), (260, 260)],
+    }
+    WEBP_QUALITY = 80
+    JPEG_QUALITY = 85
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return getattr(settings, 'IMAGE_DERIVATIVES', True)
+
+    @classmethod
+    def extension(cls, name: str) -> str:
+        # the fallback keeps transparency when the original can have it
+        return 'png' if name.lower().endswith(('.png', '.gif')) else 'jpg'
+
+    @classmethod
+    def path(cls, name: str, width: int, height: int, density: int, extension: str) -> str:
+        stem, _ = os.path.splitext(name)
+        return f'{cls.FOLDER}/{stem}.{width}x{height}@{density}x.{extension}'
+
+    @classmethod
+    def sources(cls, name: str, width: int, height: int) -> dict[str, list[tuple[str, int]]]:
+        """
+        returns the derivatives of name on disk for a size by extension,
+        as (path relative to MEDIA_ROOT, density)
+        """
+        sources = {}
+        for extension in ['webp', cls.extension(name)]:
+            for density in cls.DENSITIES:
+                path = cls.path(name, width, height, density, extension)
+                if os.path.exists(os.path.join(settings.MEDIA_ROOT, path)):
+                    sources.setdefault(extension, []).append((path, density))
+        return sources
+
+    @classmethod
+    def generate_file(cls, media_root: str, name: str, sizes: list, force: bool = False) -> int:
+        """
+        make the missing or outdated derivatives of one picture, returns how many were written
+        runs in the worker processes of build, so it only takes plain arguments
+        """
+        source = os.path.join(media_root, name)
+        if not os.path.isfile(source):
+            return 0
+        modified = os.path.getmtime(source)
+        written = 0
+        try:
+            with Image.open(source) as original:
+                original = ImageOps.exif_transpose(original)
+                for width, height in sizes:
+                    for density in cls.DENSITIES:
+                        box = (width * density, height * density)
+                        # never enlarge, the browser does that as well from a smaller copy or the
+                        # original, and a copy bigger than its original is only more bytes
+                        too_small = original.width < box[0] or original.height < box[1]
+                        image = None
+                        for extension in ['webp', cls.extension(name)]:
+                            target = os.path.join(media_root, cls.path(name, width, height, density, extension))
+                            if too_small:
+                                # an enlarged copy made before would still be served
+                                if os.path.exists(target):
+                                    os.remove(target)
+                                continue
+                            if not force and os.path.exists(target) and os.path.getmtime(target) >= modified:
+                                continue
+                            if image is None:
+                                image = ImageOps.fit(original, box, Image.LANCZOS)
+                            cls.save(image, target, extension)
+                            written += 1
+        except OSError:
+            # not an image, or a truncated one
+            return written
+        return written
+
+    @classmethod
+    def save(cls, image: Image.Image, target: str, extension: str) -> None:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if extension == 'webp':
+            image.save(target, 'WEBP', quality=cls.WEBP_QUALITY, method=4)
+        elif extension == 'png':
+            image.save(target, 'PNG', optimize=True)
+        else:
+            image.convert('RGB').save(target, 'JPEG', quality=cls.JPEG_QUALITY, optimize=True, progressive=True)
+
+    @classmethod
+    def generate(cls, instance, force: bool = False) -> int:
+        if not cls.enabled() or not instance.picture:
+            return 0
+        return cls.generate_file(settings.MEDIA_ROOT, instance.picture.name, cls.SIZES[type(instance)], force)
+
+    @classmethod
+    def pictures(cls) -> dict[str, list]:
+        """
+        returns every picture in the database with the sizes it's shown at
+        """
+        pictures = {}
+        for model, sizes in cls.SIZES.items():
+            for name in model.objects.exclude(picture='').values_list('picture', flat=True).distinct():
+                pictures.setdefault(name, set()).update(sizes)
+        return {name: sorted(sizes) for name, sizes in pictures.items()}
+
+    @classmethod
+    def build(cls, workers: int = None, force: bool = False) -> dict[str, int]:
+        """
+        make the derivatives of every picture with a pool of processes,
+        resizing is CPU bound so threads would share one core
+        """
+        pictures = cls.pictures()
+        names = list(pictures)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            written = executor.map(cls.generate_file, [settings.MEDIA_ROOT] * len(names), names,
+                                   [pictures[name] for name in names], [force] * len(names), chunksize=8)
+            return {'pictures': len(names), 'written': sum(written)}
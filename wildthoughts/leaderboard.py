@@ -0,0 +1,158 @@
+import copy
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from wildthoughts.models import Animal
+from wildthoughts.sorter import Sorter
+
+
+class Leaderboard:
+    """
+    class dedicated to keep the most and least voted animals of the homepage in the cache
+    each side holds a window of twice the displayed size, ordered like
+    Sorter's overrated and underrated options. Votes, new animals and deletions
+    move animals in and out of the windows instead of querying the animal table,
+    a side is only rebuilt once it no longer has enough animals to display
+
+    the cached board also expires LEADERBOARD_STALENESS seconds after it was built,
+    which bounds the drift of updates racing between processes
+
+    see:
+    votes VoteService for the vote path
+    signals for saved and deleted animals
+    """
+    KEY = 'wildthoughts:leaderboard'
+    # side -> descending
+    SIDES = {'top': True, 'bottom': False}
+
+    @classmethod
+    def size(cls) -> int:
+        return getattr(settings, 'LEADERBOARD_SIZE', 5)
+
+    @classmethod
+    def staleness(cls) -> int:
+        return getattr(settings, 'LEADERBOARD_STALENESS', 300)
+
+    @classmethod
+    def rank(cls, votes: int, id: int, descending: bool) -> tuple:
+        # smaller ranks first, ties broken by id like Sorter.order
+        return (-votes, -id) if descending else (votes, id)
+
+    @classmethod
+    def queryset(cls):
+        return Sorter.build(Animal.objects.all())
+
+    @classmethod
+    def build(cls) -> dict:
+        window = cls.size() * 2
+        board = {'built': time.time()}
+        for side, descending in cls.SIDES.items():
+            field = '-votes' if descending else 'votes'
+            animals = list(cls.queryset().order_by(*Sorter.order(field))[:window + 1])
+            # complete means the window holds every animal, so anything can enter it
+            board[side] = {'animals': animals[:window], 'complete': len(animals) <= window}
+        cache.set(cls.KEY, board, cls.staleness())
+        return board
+
+    @classmethod
+    def get(cls) -> dict:
+        board = cache.get(cls.KEY)
+        if board is None:
+            board = cls.build()
+        return board
+
+    @classmethod
+    def animals(cls) -> tuple[list[Animal], list[Animal]]:
+        """
+        returns the overrated and underrated animals of the homepage
+        """
+        board = cls.get()
+        return board['top']['animals'][:cls.size()], board['bottom']['animals'][:cls.size()]
+
+    @classmethod
+    def save(cls, board: dict) -> None:
+        remaining = board['built'] + cls.staleness() - time.time()
+        short = any(len(board[side]['animals']) < cls.size() and not board[side]['complete'] for side in cls.SIDES)
+        if remaining <= 0 or short:
+            # rebuilt on the next read
+            cache.delete(cls.KEY)
+        else:
+            cache.set(cls.KEY, board, remaining)
+
+    @classmethod
+    def find(cls, board: dict, animal_id: int) -> Animal:
+        for side in cls.SIDES:
+            for animal in board[side]['animals']:
+                if animal.id == animal_id:
+                    return animal
+        return None
+
+    @classmethod
+    def enters(cls, entry: dict, votes: int, id: int, descending: bool) -> bool:
+        # an animal ranking after the last of an incomplete window may be behind animals outside it
+        animals = entry['animals']
+        if entry['complete']:
+            return True
+        return bool(animals) and cls.rank(votes, id, descending) < cls.rank(animals[-1].votes, animals[-1].id, descending)
+
+    @classmethod
+    def place(cls, entry: dict, animal_id: int, animal: Animal, descending: bool) -> None:
+        animals = [cached for cached in entry['animals'] if cached.id != animal_id]
+        if animal is not None and cls.enters({**entry, 'animals': animals}, animal.votes, animal.id, descending):
+            animals.append(animal)
+            animals.sort(key=lambda cached: cls.rank(cached.votes, cached.id, descending))
+            window = cls.size() * 2
+            if len(animals) > window:
+                animals = animals[:window]
+                entry['complete'] = False
+        entry['animals'] = animals
+
+    @classmethod
+    def update(cls, animal_id: int, votes: int = None) -> None:
+        """
+        move an animal to its new place
+        the vote path passes the new count, which is enough for an animal already cached,
+        otherwise the animal is loaded, but only if it enters one of the windows
+        """
+        board = cache.get(cls.KEY)
+        if board is None:
+            return
+
+        animal = None
+        if votes is not None:
+            cached = cls.find(board, animal_id)
+            if cached is not None:
+                animal = copy.copy(cached)
+                animal.votes = votes
+            elif not any(cls.enters(board[side], votes, animal_id, descending) for side, descending in cls.SIDES.items()):
+                return
+        if animal is None:
+            animal = cls.queryset().filter(id=animal_id).first()
+
+        for side, descending in cls.SIDES.items():
+            cls.place(board[side], animal_id, animal, descending)
+        cls.save(board)
+
+    @classmethod
+    def remove(cls, animal_id: int) -> None:
+        board = cache.get(cls.KEY)
+        if board is None or cls.find(board, animal_id) is None:
+            return
+        for side, descending in cls.SIDES.items():
+            cls.place(board[side], animal_id, None, descending)
+        cls.save(board)
+
+    @classmethod
+    def update_author(cls, profile_id: int) -> None:
+        # the cards show their author, rebuild if one of them changed
+        board = cache.get(cls.KEY)
+        if board is None:
+            return
+        if any(animal.author_id == profile_id for side in cls.SIDES for animal in board[side]['animals']):
+            cls.clear()
+
+    @classmethod
+    def clear(cls) -> None:
+        cache.delete(cls.KEY)
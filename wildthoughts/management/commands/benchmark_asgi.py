@@ -0,0 +1,119 @@
+import logging
+import random
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from util.asgi_server import ASGIServer
+from util.load_test import LoadTest, PooledWSGIServer
+from util.scratch_database import ScratchDatabase
+from util.synthetic import SyntheticDataset
+from wildthoughts.asgi import ASGIHandler
+from wildthoughts.fragments import CardCache
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.models import Animal, Petition, UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.search import SuggestIndex
+
+
+class Command(BaseCommand):
+    """
+    load the vote, sign, search and theme endpoints with logged in clients at rising
+    concurrency, served once by a WSGI server with a fixed pool of worker threads and
+    once by util/asgi_server with ASGIHandler and a pool of the same size, plus its
+    ASGI_WRITE_THREADS for the votes and signatures, and report the throughput and
+    tail latency of both
+
+    the servers run on threads with their own database connections, which a transaction
+    can't roll back, so the benchmark runs on a ScratchDatabase copy that is thrown
+    away at the end. With --scale a SyntheticDataset is generated in the copy first
+
+    usage: python manage.py benchmark_asgi [--scale 1000] [--requests 2000] [--concurrency 10 100 500]
+    """
+    help = 'Compare the WSGI and ASGI deployments under concurrent ajax traffic'
+
+    # share of the requests per endpoint, like the clicks of static/js
+    MIX = {'vote': 0.4, 'sign': 0.2, 'search': 0.2, 'theme': 0.2}
+    STATUSES = ['upvote', 'downvote', 'upvoted', 'downvoted']
+    TARGETS = 200
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, help='Generate a synthetic dataset of this many animals first')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 500])
+        parser.add_argument('--threads', type=int, default=ASGIHandler.threads(), help='Workers of both servers')
+        parser.add_argument('--write-threads', type=int, default=ASGIHandler.write_threads(),
+                            help='Workers of the votes and signatures with ASGI')
+        parser.add_argument('--users', type=int, default=50, help='Logged in clients')
+
+    def cookies(self, count: int) -> list[str]:
+        cookies = []
+        for i in range(count):
+            user = User.objects.create_user(f'benchmark_asgi_{i}', password=None)
+            UserProfile.objects.create(user=user)
+            client = Client()
+            client.force_login(user)
+            cookies.append(f'{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}')
+        return cookies
+
+    def paths(self, rng: random.Random, count: int) -> list[str]:
+        animal_ids = list(Animal.objects.order_by('-votes', 'id').values_list('id', flat=True)[:self.TARGETS])
+        petition_ids = list(Petition.objects.order_by('-signatures', 'id').values_list('id', flat=True)[:self.TARGETS])
+        words = [name.split()[0] for name in Animal.objects.values_list('name', flat=True)[:self.TARGETS]]
+        if not animal_ids or not petition_ids:
+            raise CommandError('No animals or petitions to vote on, use --scale')
+
+        endpoints = {
+            'vote': lambda: reverse('wildthoughts:vote') + '?' + urlencode(
+                {'category': 'animals', 'id': rng.choice(animal_ids), 'status': rng.choice(self.STATUSES)}),
+            'sign': lambda: reverse('wildthoughts:sign_petition') + '?' + urlencode({'petition_id': rng.choice(petition_ids)}),
+            'search': lambda: reverse('wildthoughts:search') + '?' + urlencode({'searched': rng.choice(words), 'category': 'Animals'}),
+            'theme': lambda: reverse('wildthoughts:theme') + '?' + urlencode({'theme': rng.choice(['dark', 'light'])}),
+        }
+        names = rng.choices(list(self.MIX), weights=list(self.MIX.values()), k=count)
+        return [endpoints[name]() for name in names]
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        results = []
+        # every vote waiting on the sqlite lock would be logged as a slow request
+        logging.getLogger('wildthoughts.metrics').setLevel(logging.ERROR)
+        overrides = {'DEBUG': False, 'ASGI_THREADS': options['threads'], 'ASGI_WRITE_THREADS': options['write_threads']}
+        with ScratchDatabase(), override_settings(**overrides):
+            if options['scale']:
+                self.stdout.write(f"Generating {options['scale']} animals...")
+                SyntheticDataset.generate(options['scale'], options['seed'])
+            cookies = self.cookies(options['users'])
+            paths = self.paths(rng, options['requests'])
+            application = get_wsgi_application()
+
+            servers = [
+                ('wsgi', lambda: PooledWSGIServer(application, workers=options['threads'])),
+                ('asgi', lambda: ASGIServer(ASGIHandler(application))),
+            ]
+            self.stdout.write(f"{options['requests']} requests, {options['threads']} threads per server")
+            for concurrency in options['concurrency']:
+                for label, server in servers:
+                    with server() as running:
+                        # the first requests load the urls and templates
+                        LoadTest.run(running.url, paths[:20], concurrency=1, cookies=cookies)
+                        result = LoadTest.run(running.url, paths, concurrency=concurrency, cookies=cookies)
+                    results.append((concurrency, label, result))
+                    self.stdout.write(f'concurrency {concurrency:>4} {label}: ' + ', '.join(f'{key} {value}' for key, value in result.items()))
+
+        # the caches may hold rows of the copy
+        Leaderboard.clear()
+        SuggestIndex.clear()
+        CardCache.clear()
+        PageCache.invalidate()
+
+        for concurrency in options['concurrency']:
+            wsgi, asgi = [result for level, _, result in results if level == concurrency]
+            self.stdout.write(f"concurrency {concurrency:>4}: {asgi['requests/s'] / wsgi['requests/s']:.2f}x the throughput, "
+                              f"p99 {wsgi['p99_ms']} -> {asgi['p99_ms']} ms")
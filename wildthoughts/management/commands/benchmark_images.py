@@ -0,0 +1,142 @@
+import os
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from util.synthetic import SyntheticDataset
+from wildthoughts.fragments import CardCache
+from wildthoughts.images import ImageDerivatives
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.models import Animal, Petition, UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.search import SuggestIndex
+
+
+class PageImages(HTMLParser):
+    """
+    the media urls a browser fetches for the images of a page, for a screen density,
+    taking the WebP <source> of a <picture> when there is one
+    """
+    def __init__(self, density: int):
+        super().__init__()
+        self.density = density
+        self.urls = set()
+        self.webp = None
+
+    def pick(self, srcset: str) -> str:
+        candidates = []
+        for candidate in srcset.split(','):
+            url, _, descriptor = candidate.strip().partition(' ')
+            candidates.append((float(descriptor.rstrip('x') or 1), url))
+        fitting = [candidate for candidate in candidates if candidate[0] <= self.density]
+        return max(fitting)[1] if fitting else min(candidates)[1]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'picture':
+            self.webp = None
+        elif tag == 'source' and attrs.get('type') == 'image/webp':
+            self.webp = self.pick(attrs['srcset'])
+        elif tag == 'img':
+            if self.webp:
+                url = self.webp
+            elif attrs.get('srcset'):
+                url = self.pick(attrs['srcset'])
+            else:
+                url = attrs.get('src', '')
+            if url.startswith(settings.MEDIA_URL):
+                self.urls.add(url)
+
+    def handle_endtag(self, tag):
+        if tag == 'picture':
+            self.webp = None
+
+    def bytes(self) -> int:
+        total = 0
+        for url in self.urls:
+            path = os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):])
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+        return total
+
+
+class Command(BaseCommand):
+    """
+    compare the bytes of the uploaded pictures each list page makes the browser download,
+    the originals against the copies of ImageDerivatives, on a 1x and a 2x screen.
+    Rows without a picture are given one of the files already in media first
+
+    with --scale a SyntheticDataset is generated first, otherwise the current database
+    is used. Everything but the copies written to media/derivatives is rolled back at the end
+
+    usage: python manage.py benchmark_images [--scale 500]
+    """
+    help = 'Compare the image bytes per page with and without the resized copies'
+
+    PAGES = ['wildthoughts:index', 'wildthoughts:animals', 'wildthoughts:discussions', 'wildthoughts:lists',
+             'wildthoughts:petitions', 'wildthoughts:profiles']
+    # model -> folder of media the pictures are taken from
+    FOLDERS = {Animal: 'animal_images', Petition: 'animal_images', UserProfile: 'profile_images'}
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, help='Generate a synthetic dataset of this many animals first')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def add_pictures(self) -> None:
+        for model, folder in self.FOLDERS.items():
+            path = os.path.join(settings.MEDIA_ROOT, folder)
+            files = sorted(f'{folder}/{name}' for name in os.listdir(path)
+                           if name.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.webp'))) if os.path.isdir(path) else []
+            if not files:
+                continue
+            ids = list(model.objects.filter(picture='').order_by('id').values_list('id', flat=True))
+            for i, name in enumerate(files):
+                model.objects.filter(id__in=ids[i::len(files)]).update(picture=name)
+
+    def measure(self, client: Client, url: str) -> dict:
+        html = client.get(url).content.decode()
+        sizes = {}
+        for density in [1, 2]:
+            parser = PageImages(density)
+            parser.feed(html)
+            sizes[density] = (len(parser.urls), parser.bytes())
+        return sizes
+
+    def handle(self, *args, **options):
+        client = Client()
+        results = []
+        # cached pages and cards would hide the difference
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                               CARD_CACHE_TIMEOUT=0, PAGE_CACHE_TIMEOUT=0), transaction.atomic():
+            if options['scale']:
+                self.stdout.write(f"Generating {options['scale']} animals...")
+                SyntheticDataset.generate(options['scale'], options['seed'])
+            self.add_pictures()
+            Leaderboard.clear()
+            built = ImageDerivatives.build()
+            self.stdout.write(f"{built['written']} copies written for {built['pictures']} pictures")
+
+            for name in self.PAGES:
+                url = reverse(name)
+                with override_settings(IMAGE_DERIVATIVES=False):
+                    before = self.measure(client, url)
+                after = self.measure(client, url)
+                results.append((name.split(':')[1], before, after))
+            transaction.set_rollback(True)
+
+        Leaderboard.clear()
+        SuggestIndex.clear()
+        CardCache.clear()
+        PageCache.invalidate()
+
+        totals = [0, 0, 0]
+        for page, before, after in results:
+            totals = [totals[0] + before[1][1], totals[1] + after[1][1], totals[2] + after[2][1]]
+            self.stdout.write(f'{page:<12} {before[1][0]:>3} images  originals {before[1][1] / 1024:8.1f} KiB  '
+                              f'copies 1x {after[1][1] / 1024:7.1f} KiB  2x {after[2][1] / 1024:7.1f} KiB')
+        self.stdout.write(f'{"total":<12}             originals {totals[0] / 1024:8.1f} KiB  '
+                          f'copies 1x {totals[1] / 1024:7.1f} KiB  2x {totals[2] / 1024:7.1f} KiB')
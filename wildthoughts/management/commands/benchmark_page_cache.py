@@ -0,0 +1,113 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from util.synthetic import SyntheticDataset
+from wildthoughts.fragments import CardCache
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.models import Animal, Petition
+from wildthoughts.page_cache import PageCache
+from wildthoughts.search import SuggestIndex
+
+
+class Command(BaseCommand):
+    """
+    replay the same anonymous browsing with and without PageCache and report the
+    throughput, latency and hit ratio. Visitors pick pages with a zipf popularity,
+    list pages with a sort option, animal and petition pages, a tenth of them in the
+    dark theme, and every --write-every requests an animal is edited, which starts
+    a new generation of the cache like an author would
+
+    with --scale a SyntheticDataset is generated first, otherwise the current database
+    is used. Everything is rolled back at the end
+
+    usage: python manage.py benchmark_page_cache [--scale 2000] [--requests 2000] [--write-every 100]
+    """
+    help = 'Compare anonymous throughput with and without the page cache'
+
+    LIST_PAGES = {
+        'wildthoughts:animals': ['overrated', 'newest', 'name'],
+        'wildthoughts:discussions': ['overrated', 'newest'],
+    }
+    DETAIL_PAGES = 200
+    SKEW = 1.1
+    DARK = 0.1
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, help='Generate a synthetic dataset of this many animals first')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--write-every', type=int, default=0, help='Edit an animal every this many requests, 0 for never')
+
+    def urls(self) -> list[str]:
+        urls = [reverse('wildthoughts:index')]
+        for name, choices in self.LIST_PAGES.items():
+            urls += [f'{reverse(name)}?sort_by={choice}' for choice in choices]
+        for slug in Animal.objects.order_by('-votes', 'id').values_list('slug', flat=True)[:self.DETAIL_PAGES]:
+            urls.append(reverse('wildthoughts:animal', args=[slug]))
+        for slug in Petition.objects.order_by('-signatures', 'id').values_list('slug', flat=True)[:self.DETAIL_PAGES]:
+            urls.append(reverse('wildthoughts:petition', args=[slug]))
+        return urls
+
+    def replay(self, urls: list[str], options: dict) -> dict:
+        rng = random.Random(options['seed'])
+        weighted = SyntheticDataset.zipf(rng, urls, self.SKEW)
+        visits = SyntheticDataset.draw(rng, weighted, options['requests'])
+        animal_ids = list(Animal.objects.values_list('id', flat=True)[:self.DETAIL_PAGES])
+        clients = {'light': Client(), 'dark': Client()}
+        clients['dark'].cookies['theme'] = 'dark'
+
+        PageCache.invalidate()
+        CardCache.clear()
+        PageCache.reset_stats()
+        durations = []
+        start = time.perf_counter()
+        for i, url in enumerate(visits):
+            if options['write_every'] and i and i % options['write_every'] == 0 and animal_ids:
+                animal = Animal.objects.get(id=rng.choice(animal_ids))
+                animal.description += ' Edited.'
+                animal.save()
+            client = clients['dark' if rng.random() < self.DARK else 'light']
+            request_start = time.perf_counter()
+            client.get(url)
+            durations.append(time.perf_counter() - request_start)
+        seconds = time.perf_counter() - start
+
+        durations.sort()
+        return {
+            'requests/s': round(len(visits) / seconds, 1),
+            'p50_ms': round(statistics.median(durations) * 1000, 2),
+            'p95_ms': round(durations[int(len(durations) * 0.95)] * 1000, 2),
+            **PageCache.stats(),
+        }
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), transaction.atomic():
+            if options['scale']:
+                self.stdout.write(f"Generating {options['scale']} animals...")
+                SyntheticDataset.generate(options['scale'], options['seed'])
+            urls = self.urls()
+            self.stdout.write(f"{options['requests']} requests over {len(urls)} pages")
+
+            results = {}
+            for label, timeout in [('without', 0), ('with', PageCache.timeout() or 60)]:
+                with override_settings(PAGE_CACHE_TIMEOUT=timeout):
+                    results[label] = self.replay(urls, options)
+                self.stdout.write(f'{label:>7} page cache: ' + ', '.join(f'{key} {value}' for key, value in results[label].items()))
+            transaction.set_rollback(True)
+
+        # the caches may hold rows that were just rolled back
+        Leaderboard.clear()
+        SuggestIndex.clear()
+        CardCache.clear()
+        PageCache.invalidate()
+
+        speedup = results['with']['requests/s'] / results['without']['requests/s']
+        self.stdout.write(f'{speedup:.1f}x the throughput with a hit ratio of {results["with"]["ratio"]:.0%}')
+        return None
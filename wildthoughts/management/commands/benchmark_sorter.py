@@ -0,0 +1,162 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from wildthoughts.hot import HotScores
+from wildthoughts.models import Animal, Comment, Discussion, Petition, UserList, UserProfile
+from wildthoughts.sorter import Sorter
+
+
+class Command(BaseCommand):
+    """
+    seed a large dataset and time the first page of every Sorter path
+    once without the Meta indexes of the models and once with them,
+    printing the EXPLAIN QUERY PLAN and p50/p95 latency of both runs
+
+    everything, the seeded rows and the dropped indexes included,
+    happens in one transaction that is rolled back at the end
+
+    usage: python manage.py benchmark_sorter [--scale 10000] [--repeat 20]
+    """
+    help = 'Benchmark every Sorter query before and after the composite indexes'
+
+    MODELS = [UserProfile, Animal, Discussion, Comment, Petition, UserList]
+    CHOICES = {
+        Animal: ['name', 'overrated', 'underrated', 'hot', 'newest', 'oldest'],
+        Comment: ['overrated', 'underrated', 'newest', 'oldest'],
+        Discussion: ['title', 'overrated', 'underrated', 'hot', 'newest', 'oldest'],
+        Petition: ['title', 'most_signed', 'least_signed', 'newest', 'oldest'],
+        UserList: ['title', 'overrated', 'underrated', 'hot', 'newest', 'oldest'],
+    }
+    PAGE_SIZE = 20
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=10000, help='Number of animals to seed, other models scale with it')
+        parser.add_argument('--repeat', type=int, default=20, help='Times each query is run')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def seed(self, scale: int, rng: random.Random) -> dict:
+        profiles_count = max(scale // 50, 2)
+        users = User.objects.bulk_create(
+            [User(username=f'benchmark-{i}') for i in range(profiles_count)], batch_size=500)
+        # sqlite doesn't return ids from bulk_create in this Django version
+        users = User.objects.filter(username__startswith='benchmark-')
+        UserProfile.objects.bulk_create([UserProfile(user=user) for user in users], batch_size=500)
+        profiles = list(UserProfile.objects.filter(user__username__startswith='benchmark-').values_list('id', flat=True))
+
+        Animal.objects.bulk_create([
+            Animal(name=f'benchmark animal {i}', slug=f'benchmark-animal-{i}',
+                   author_id=rng.choice(profiles), votes=rng.randint(-50, 500))
+            for i in range(scale)], batch_size=500)
+        animals = list(Animal.objects.filter(slug__startswith='benchmark-').values_list('id', flat=True))
+
+        Discussion.objects.bulk_create([
+            Discussion(title=f'benchmark discussion {i}', slug=f'benchmark-discussion-{i}',
+                       author_id=rng.choice(profiles), animal_id=rng.choice(animals), votes=rng.randint(-50, 500))
+            for i in range(scale * 2)], batch_size=500)
+        discussions = list(Discussion.objects.filter(slug__startswith='benchmark-').values_list('id', flat=True))
+
+        Comment.objects.bulk_create([
+            Comment(content=f'benchmark comment {i}', author_id=rng.choice(profiles),
+                    discussion_id=rng.choice(discussions), votes=rng.randint(-50, 500))
+            for i in range(scale * 5)], batch_size=500)
+
+        Petition.objects.bulk_create([
+            Petition(title=f'benchmark petition {i}', slug=f'benchmark-petition-{i}',
+                     author_id=rng.choice(profiles), goal=1000, signatures=rng.randint(0, 1000))
+            for i in range(scale // 2)], batch_size=500)
+
+        UserList.objects.bulk_create([
+            UserList(title=f'benchmark list {i}', slug=f'benchmark-list-{i}',
+                     author_id=rng.choice(profiles), votes=rng.randint(-50, 500))
+            for i in range(scale // 2)], batch_size=500)
+
+        # auto_now_add gives every row today's date, spread them over ten years
+        with connection.cursor() as cursor:
+            for model in self.MODELS:
+                cursor.execute(f"UPDATE {model._meta.db_table} SET date = date('now', '-' || (abs(random()) % 3650) || ' days')")
+        HotScores.rebuild_all()
+
+        profile = UserProfile.objects.get(id=rng.choice(profiles))
+        animal = Animal.objects.get(id=rng.choice(animals))
+        discussion = Discussion.objects.get(id=rng.choice(discussions))
+        return {'profile': profile, 'animal': animal, 'discussion': discussion}
+
+    def paths(self, profile: UserProfile, animal: Animal, discussion: Discussion) -> list:
+        """
+        every (label, queryset) the views can ask Sorter for
+        """
+        paths = []
+        for model, choices in self.CHOICES.items():
+            for choice in choices:
+                if model is not Comment:
+                    paths.append((f'{model.__name__} {choice}', Sorter.sort_model(choice, model)[1]))
+                paths.append((f'{model.__name__} {choice} by author', Sorter.sort_model(choice, model, profile)[1]))
+        for choice in self.CHOICES[Discussion]:
+            paths.append((f'animal discussions {choice}', Sorter.sort_animal_discussions(choice, animal)[1]))
+        for choice in self.CHOICES[Comment]:
+            paths.append((f'discussion comments {choice}', Sorter.sort_discussion_comments(choice, discussion)[1]))
+        for choice in ['name', 'newest', 'oldest']:
+            paths.append((f'UserProfile {choice}', Sorter.sort_profiles(choice)[1]))
+        return paths
+
+    def explain(self, results) -> list:
+        sql, params = results[:self.PAGE_SIZE].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def measure(self, paths: list, repeat: int) -> dict:
+        measures = {}
+        for label, results in paths:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                list(results[:self.PAGE_SIZE])
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p50 = timings[len(timings) // 2]
+            p95 = timings[min(int(len(timings) * 0.95), len(timings) - 1)]
+            measures[label] = (self.explain(results), p50, p95)
+        return measures
+
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for model in self.MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(f'DROP INDEX IF EXISTS "{index.name}"')
+
+    def create_indexes(self):
+        # schema_editor() can't be entered inside an atomic block on SQLite, only its SQL is used
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for model in self.MODELS:
+                for index in model._meta.indexes:
+                    cursor.execute(str(index.create_sql(model, editor)))
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('benchmark_sorter reads SQLite query plans, use a SQLite database')
+
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self.stdout.write(f'Seeding {options["scale"]} animals...')
+            objects = self.seed(options['scale'], rng)
+            paths = self.paths(**objects)
+
+            self.drop_indexes()
+            before = self.measure(paths, options['repeat'])
+            self.create_indexes()
+            after = self.measure(paths, options['repeat'])
+
+            for label, _ in paths:
+                self.stdout.write(label)
+                for phase, measures in (('before', before), ('after', after)):
+                    plan, p50, p95 = measures[label]
+                    self.stdout.write(f'  {phase}: p50 {p50:.2f}ms p95 {p95:.2f}ms')
+                    for line in plan:
+                        self.stdout.write(f'    {line}')
+            transaction.set_rollback(True)
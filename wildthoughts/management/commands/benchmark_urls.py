@@ -0,0 +1,284 @@
+import json
+import math
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from util.synthetic import SyntheticDataset
+from wildthoughts.fragments import CardCache
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.models import Animal, Comment, Discussion, Petition, UserList, UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.pagination import CursorPaginator
+from wildthoughts.search import PythonBackend, SearchIndex, SuggestIndex
+from wildthoughts.sorter import Sorter
+from wildthoughts.views import ProfileView
+
+
+class Command(BaseCommand):
+    """
+    request every url of wildthoughts through the test client and report the
+    p50/p95/p99 latency, queries and bytes of every request, anonymous and logged in
+
+    list pages are requested for every sort option on the first page and halfway
+    through, numbered and with a cursor, detail pages for their largest rows
+    (the discussion with the most comments...), and the vote and sign ajax calls
+
+    the results are saved as json, --compare prints the difference with an
+    earlier run so a regression shows up between two commits:
+        git checkout main && python manage.py benchmark_urls --scale 5000 --output main.json
+        git checkout branch && python manage.py benchmark_urls --scale 5000 --compare main.json
+
+    with --scale a SyntheticDataset is generated first, otherwise the current database
+    is used. Everything, votes and signatures included, is rolled back at the end
+
+    usage: python manage.py benchmark_urls [--scale 5000] [--repeat 10] [--filter discussion] [--compare old.json]
+    """
+    help = 'Benchmark every wildthoughts url and save the results as json'
+
+    LIST_PAGES = {
+        'wildthoughts:animals': (Animal, ['name', 'overrated', 'underrated', 'newest', 'oldest']),
+        'wildthoughts:discussions': (Discussion, ['title', 'overrated', 'underrated', 'newest', 'oldest']),
+        'wildthoughts:lists': (UserList, ['title', 'overrated', 'underrated', 'newest', 'oldest']),
+        'wildthoughts:petitions': (Petition, ['title', 'most_signed', 'least_signed', 'newest', 'oldest']),
+        'wildthoughts:profiles': (UserProfile, list(Sorter.PROFILE_OPTIONS_ORDER)),
+    }
+    FORM_PAGES = ['wildthoughts:add_animal', 'wildthoughts:add_discussion', 'wildthoughts:add_list',
+                  'wildthoughts:add_petition', 'wildthoughts:edit_profile']
+    PAGE_SIZE = 20
+    # a slower p50 below this many milliseconds is noise, not a regression
+    NOISE_MS = 1.0
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, help='Generate a synthetic dataset of this many animals first')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=10, help='Times each url is requested')
+        parser.add_argument('--warmup', type=int, default=1, help='Requests per url not measured')
+        parser.add_argument('--filter', default='', help='Only the urls whose label contains this')
+        parser.add_argument('--output', default='benchmark_urls.json')
+        parser.add_argument('--compare', help='Json of an earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown of the p50 reported as a regression')
+        parser.add_argument('--strict', action='store_true', help='Fail when there is a regression')
+
+    def list_cases(self) -> list[dict]:
+        cases = []
+        for name, (model, choices) in self.LIST_PAGES.items():
+            for choice in choices:
+                if model is UserProfile:
+                    _, results = Sorter.sort_profiles(choice)
+                else:
+                    _, results = Sorter.sort_model(choice, model)
+                page = name.split(':')[1]
+                cases.append({'label': f'{page} {choice}', 'url': reverse(name), 'data': {'sort_by': choice}})
+
+                paginator = Paginator(results, self.PAGE_SIZE)
+                if paginator.num_pages > 2:
+                    middle = paginator.num_pages // 2
+                    cases.append({'label': f'{page} {choice} page {middle}', 'url': reverse(name),
+                                  'data': {'sort_by': choice, 'page': middle}})
+                    # the same depth with keyset pagination
+                    cursors = CursorPaginator(results, self.PAGE_SIZE)
+                    row = results[middle * self.PAGE_SIZE]
+                    cases.append({'label': f'{page} {choice} cursor at page {middle}', 'url': reverse(name),
+                                  'data': {'sort_by': choice, 'cursor': cursors.encode(cursors.value(row), row.id, 'next')}})
+        return cases
+
+    def detail_cases(self, profile: UserProfile) -> list[dict]:
+        cases = []
+        animal = Animal.objects.annotate(size=Count('discussion')).order_by('-size', 'id').first()
+        if animal:
+            for choice in ['overrated', 'newest']:
+                cases.append({'label': f'animal most discussed {choice}', 'url': reverse('wildthoughts:animal', args=[animal.slug]),
+                              'data': {'sort_by': choice}})
+
+        discussions = list(Discussion.objects.annotate(size=Count('comment')).order_by('-size', 'id').values_list('slug', 'size'))
+        if discussions:
+            for label, (slug, size) in [('most comments', discussions[0]), ('median comments', discussions[len(discussions) // 2])]:
+                for choice in ['overrated', 'newest']:
+                    cases.append({'label': f'discussion {label} ({size}) {choice}',
+                                  'url': reverse('wildthoughts:discussion', args=[slug]), 'data': {'sort_by': choice}})
+
+            slug, size = discussions[0]
+            discussion = Discussion.objects.get(slug=slug)
+            comments = Comment.objects.filter(discussion=discussion).order_by('-date', '-id')
+            if size > self.PAGE_SIZE:
+                # load more halfway through the largest thread
+                row = comments[size // 2]
+                cursors = CursorPaginator(comments, self.PAGE_SIZE)
+                cases.append({'label': f'discussion most comments ({size}) load more halfway',
+                              'url': reverse('wildthoughts:discussion_comments', args=[slug]),
+                              'data': {'sort_by': 'newest', 'cursor': cursors.encode(cursors.value(row), row.id, 'next')}})
+
+        user_list = UserList.objects.annotate(size=Count('animals')).order_by('-size', 'id').first()
+        if user_list:
+            cases.append({'label': f'list largest ({user_list.size})', 'url': reverse('wildthoughts:list', args=[user_list.slug]),
+                          'data': {'sort_by': 'overrated'}})
+
+        petition = Petition.objects.order_by('-signatures', 'id').first()
+        if petition:
+            cases.append({'label': 'petition most signed', 'url': reverse('wildthoughts:petition', args=[petition.slug]), 'data': {}})
+
+        for tab in ProfileView.TAB_TO_MODEL:
+            cases.append({'label': f'profile most active {tab}', 'url': reverse('wildthoughts:profile', args=[profile.user.username]),
+                          'data': {'tab': tab}})
+        return cases
+
+    def search_cases(self) -> list[dict]:
+        animal = Animal.objects.order_by('-votes', 'id').first()
+        words = [word for word in SearchIndex.tokenize(animal.name if animal else '') if word.isalpha()] or ['lion']
+        cases = [{'label': f'search {category}', 'url': reverse('wildthoughts:search'),
+                  'data': {'searched': words[-1], 'category': category}}
+                 for category in SearchIndex.CATEGORY_TO_MODEL]
+        cases.append({'label': 'suggest', 'url': reverse('wildthoughts:suggest'), 'data': {'q': words[-1][:3]}})
+        return cases
+
+    def ajax_cases(self, profile: UserProfile) -> list[dict]:
+        cases = []
+        targets = {
+            'animals': Animal.objects.order_by('-votes', 'id').first(),
+            'discussions': Discussion.objects.order_by('-votes', 'id').first(),
+            'lists': UserList.objects.order_by('-votes', 'id').first(),
+        }
+        for category, instance in targets.items():
+            if instance:
+                # every other request takes the vote back, so the writes don't become no-ops
+                cases.append({'label': f'vote {category}', 'url': reverse('wildthoughts:vote'), 'ajax': True,
+                              'data': [{'category': category, 'id': instance.id, 'status': status} for status in ['upvote', 'upvoted']]})
+
+        petitions = list(Petition.objects.exclude(signed_by=profile).order_by('id').values_list('id', flat=True)[:100])
+        if petitions:
+            cases.append({'label': 'sign petition', 'url': reverse('wildthoughts:sign_petition'), 'ajax': True,
+                          'data': [{'petition_id': petition_id} for petition_id in petitions]})
+        cases.append({'label': 'theme', 'url': reverse('wildthoughts:theme'), 'ajax': True, 'data': {'theme': 'dark'}})
+        return cases
+
+    def cases(self, profile: UserProfile) -> list[dict]:
+        cases = [{'label': 'index', 'url': reverse('wildthoughts:index'), 'data': {}}]
+        cases += self.list_cases() + self.detail_cases(profile) + self.search_cases() + self.ajax_cases(profile)
+        cases += [{'label': name.split(':')[1], 'url': reverse(name), 'data': {}, 'login_required': True} for name in self.FORM_PAGES]
+        return cases
+
+    def percentile(self, timings: list[float], q: float) -> float:
+        timings = sorted(timings)
+        return timings[min(math.ceil(len(timings) * q) - 1, len(timings) - 1)]
+
+    def measure(self, client: Client, case: dict, repeat: int, warmup: int) -> dict:
+        data = case['data'] if isinstance(case['data'], list) else [case['data']]
+        headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if case.get('ajax') else {}
+        timings, queries, sizes, statuses = [], [], [], set()
+        for i in range(warmup + repeat):
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = client.get(case['url'], data[i % len(data)], **headers)
+                elapsed = (time.perf_counter() - start) * 1000
+            if i < warmup:
+                continue
+            timings.append(elapsed)
+            queries.append(len(context.captured_queries))
+            sizes.append(len(response.content))
+            statuses.add(response.status_code)
+        return {
+            'url': case['url'],
+            'status': sorted(statuses),
+            'p50': self.percentile(timings, 0.50),
+            'p95': self.percentile(timings, 0.95),
+            'p99': self.percentile(timings, 0.99),
+            'mean': statistics.mean(timings),
+            'queries': max(queries),
+            'bytes': max(sizes),
+        }
+
+    def run(self, options: dict) -> dict:
+        profile = UserProfile.objects.select_related('user').order_by('-comments_count', 'id').first()
+        if profile is None:
+            raise CommandError('The database is empty, seed it or use --scale')
+
+        clients = {'anonymous': Client()}
+        clients['logged in'] = Client()
+        clients['logged in'].force_login(profile.user)
+
+        results = {}
+        for case in self.cases(profile):
+            for name, client in clients.items():
+                if case.get('login_required') and name == 'anonymous':
+                    continue
+                if case.get('ajax') and name == 'anonymous' and case['label'] != 'theme':
+                    # only answers with the login url
+                    continue
+                label = f"{case['label']} ({name})"
+                if options['filter'] not in label:
+                    continue
+                results[label] = self.measure(client, case, options['repeat'], options['warmup'])
+                self.stdout.write(self.line(label, results[label]))
+        return results
+
+    def line(self, label: str, result: dict) -> str:
+        status = '' if result['status'] == [200] else f" status {result['status']}"
+        return (f"{label:<70} p50 {result['p50']:8.2f}ms p95 {result['p95']:8.2f}ms p99 {result['p99']:8.2f}ms "
+                f"{result['queries']:4d} queries {result['bytes'] / 1024:8.1f} KiB{status}")
+
+    def commit(self) -> str:
+        try:
+            return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=settings.BASE_DIR).stdout.strip() or None
+        except OSError:
+            return None
+
+    def compare(self, results: dict, path: str, threshold: float) -> list[str]:
+        with open(path, 'r') as f:
+            previous = json.load(f)
+        self.stdout.write(f"\nCompared with {path} (commit {previous['meta'].get('commit')})")
+        regressions = []
+        for label, result in results.items():
+            old = previous['results'].get(label)
+            if old is None:
+                continue
+            ratio = result['p50'] / old['p50'] if old['p50'] else 1.0
+            slower = ratio > 1 + threshold and result['p50'] - old['p50'] > self.NOISE_MS
+            if slower or result['queries'] > old['queries']:
+                regressions.append(label)
+            if slower or result['queries'] != old['queries'] or ratio < 1 - threshold:
+                self.stdout.write(f"{'REGRESSION ' if label in regressions else ''}{label}: p50 {old['p50']:.2f}ms -> "
+                                  f"{result['p50']:.2f}ms ({ratio:.2f}x), queries {old['queries']} -> {result['queries']}, "
+                                  f"{old['bytes']} -> {result['bytes']} bytes")
+        self.stdout.write(f'{len(regressions)} regressions in {len(results)} urls')
+        return regressions
+
+    def handle(self, *args, **options):
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), transaction.atomic():
+            if options['scale']:
+                self.stdout.write(f"Generating {options['scale']} animals...")
+                SyntheticDataset.generate(options['scale'], options['seed'])
+            results = self.run(options)
+            transaction.set_rollback(True)
+
+        # the caches may hold rows that were just rolled back
+        Leaderboard.clear()
+        SuggestIndex.clear()
+        CardCache.clear()
+        PageCache.invalidate()
+        if SearchIndex.backend() is PythonBackend:
+            PythonBackend.clear()
+            PythonBackend.loaded = False
+
+        with open(options['output'], 'w') as f:
+            json.dump({
+                'meta': {'commit': self.commit(), 'scale': options['scale'], 'seed': options['seed'],
+                         'repeat': options['repeat'], 'vendor': connection.vendor},
+                'results': results,
+            }, f, indent=2)
+        self.stdout.write(f"Saved {len(results)} urls to {options['output']}")
+
+        if options['compare']:
+            regressions = self.compare(results, options['compare'], options['threshold'])
+            if regressions and options['strict']:
+                raise CommandError(f'{len(regressions)} regressions')
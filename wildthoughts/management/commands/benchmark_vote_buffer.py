@@ -0,0 +1,115 @@
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from util.scratch_database import ScratchDatabase
+from wildthoughts.fragments import CardCache
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.models import Animal, UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.search import SuggestIndex
+from wildthoughts.votes import VoteBuffer, VoteService
+
+
+class Command(BaseCommand):
+    """
+    vote on a single animal from --threads threads for --seconds, every voter flipping
+    between an upvote and taking it back, once writing the votes column on every vote and
+    once with VoteBuffer, and report the sustained votes per second, the latency and the errors.
+    At the end the buffer is written and the count checked against the through-tables
+
+    the threads have their own database connections, so it runs on a ScratchDatabase copy
+
+    usage: python manage.py benchmark_vote_buffer [--threads 8] [--seconds 5] [--events 100] [--interval 500]
+    """
+    help = 'Compare the votes per second on one animal with and without the vote buffer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--voters', type=int, default=400)
+        parser.add_argument('--events', type=int, default=VoteBuffer.max_events(), help='VOTE_BUFFER_EVENTS')
+        parser.add_argument('--interval', type=int, default=int(VoteBuffer.interval() * 1000), help='VOTE_BUFFER_INTERVAL in ms')
+
+    def setup(self, voters: int) -> tuple[Animal, list[UserProfile]]:
+        author = UserProfile.objects.create(user=User.objects.create_user('benchmark_vote_author', password=None))
+        animal = Animal.objects.create(name='Benchmark Vote Buffer Animal', author=author)
+        User.objects.bulk_create([User(username=f'benchmark_voter_{i}') for i in range(voters)])
+        users = User.objects.filter(username__startswith='benchmark_voter_').order_by('id')
+        UserProfile.objects.bulk_create([UserProfile(user=user) for user in users])
+        profiles = list(UserProfile.objects.filter(user__username__startswith='benchmark_voter_').order_by('id'))
+        return animal, profiles
+
+    def hammer(self, animal: Animal, profiles: list, threads: int, seconds: float) -> dict:
+        durations, errors = [], []
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def voter(share: list) -> None:
+            upvoted = set()
+            local_durations, local_errors = [], 0
+            try:
+                i = 0
+                while time.perf_counter() < deadline:
+                    profile = share[i % len(share)]
+                    status = 'upvoted' if profile.id in upvoted else 'upvote'
+                    start = time.perf_counter()
+                    try:
+                        VoteService.vote(profile, 'animals', animal.id, status)
+                    except Exception:
+                        local_errors += 1
+                    else:
+                        local_durations.append(time.perf_counter() - start)
+                        upvoted ^= {profile.id}
+                    i += 1
+            finally:
+                connection.close()
+                with lock:
+                    durations.extend(local_durations)
+                    errors.append(local_errors)
+
+        workers = [threading.Thread(target=voter, args=(profiles[i::threads],)) for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        durations.sort()
+        return {
+            'votes': len(durations),
+            'votes/s': round(len(durations) / elapsed, 1),
+            'p50_ms': round(statistics.median(durations) * 1000, 2) if durations else 0.0,
+            'p99_ms': round(durations[int(len(durations) * 0.99)] * 1000, 2) if durations else 0.0,
+            'errors': sum(errors),
+        }
+
+    def handle(self, *args, **options):
+        results = {}
+        with ScratchDatabase():
+            animal, profiles = self.setup(options['voters'])
+            for label, buffered in [('direct', False), ('buffered', True)]:
+                overrides = {'VOTE_BUFFER': buffered, 'VOTE_BUFFER_EVENTS': options['events'],
+                             'VOTE_BUFFER_INTERVAL': options['interval']}
+                with override_settings(**overrides):
+                    results[label] = self.hammer(animal, profiles, options['threads'], options['seconds'])
+                    VoteBuffer.flush()
+                self.stdout.write(f'{label:>8}: ' + ', '.join(f'{key} {value}' for key, value in results[label].items()))
+
+            drift = VoteService.reconcile(dry_run=True)['animals']
+            self.stdout.write(f"the votes column {'matches' if not drift else 'drifted from'} the through-tables")
+
+        VoteBuffer.clear()
+        Leaderboard.clear()
+        SuggestIndex.clear()
+        CardCache.clear()
+        PageCache.invalidate()
+
+        speedup = results['buffered']['votes/s'] / results['direct']['votes/s']
+        self.stdout.write(f"{speedup:.1f}x the votes per second on one animal")
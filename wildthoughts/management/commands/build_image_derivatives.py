@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from wildthoughts.images import ImageDerivatives
+
+
+class Command(BaseCommand):
+    """
+    make the resized and WebP copies of every picture already in the database,
+    new pictures get theirs when they are saved. Copies newer than their original are kept
+
+    usage: python manage.py build_image_derivatives [--workers 4] [--force]
+    """
+    help = 'Make the resized and WebP copies of every uploaded picture'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Processes resizing, defaults to the number of CPUs')
+        parser.add_argument('--force', action='store_true', help='Make every copy again')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        result = ImageDerivatives.build(options['workers'], options['force'])
+        self.stdout.write(f"Wrote {result['written']} copies of {result['pictures']} pictures "
+                          f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wildthoughts.counters import ProfileCounters
+
+
+class Command(BaseCommand):
+    """
+    recompute the activity counters of every profile from the
+    content tables and fix any drift
+
+    usage: python manage.py rebuild_profile_counters [--dry-run]
+    """
+    help = 'Recompute the activity counters of every profile'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift, do not fix it')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = ProfileCounters.rebuild(dry_run=options['dry_run'])
+        self.stdout.write(f'profiles: {count} drifted')
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from wildthoughts.search import SearchIndex
+
+
+class Command(BaseCommand):
+    """
+    index every animal, discussion, list, petition and profile from scratch
+    the signals keep the index up to date afterwards
+
+    usage: python manage.py rebuild_search_index
+    """
+    help = 'Rebuild the full-text search index'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = SearchIndex.rebuild()
+        self.stdout.write(f'Indexed {count} objects using {SearchIndex.backend().__name__}')
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from wildthoughts.votes import VoteService
+
+
+class Command(BaseCommand):
+    """
+    recompute the votes column of every voteable model from the
+    upvoted_by/downvoted_by through-tables and fix any drift
+
+    usage: python manage.py reconcile_votes [--dry-run]
+    """
+    help = 'Recompute votes from the upvoted_by/downvoted_by through-tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the drift, do not fix it')
+
+    def handle(self, *args, **options):
+        for category, count in VoteService.reconcile(dry_run=options['dry_run']).items():
+            self.stdout.write(f'{category}: {count} drifted')
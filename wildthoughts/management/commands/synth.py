@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from util.synthetic import SyntheticDataset
+from wildthoughts.models import Animal
+
+
+class Command(BaseCommand):
+    """
+    fill an empty database with a skewed synthetic dataset, offline
+    the same --scale, --seed and counts always give the same dataset
+
+    usage: python manage.py synth [--scale 1000] [--seed 0] [--comments 50000] ...
+    """
+    help = 'Generate a large synthetic dataset without downloading anything'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1000, help='Number of animals, other models scale with it')
+        parser.add_argument('--seed', type=int, default=0)
+        for name in SyntheticDataset.RATIOS:
+            parser.add_argument(f'--{name}', type=int, help=f'Number of {name}, defaults to {SyntheticDataset.RATIOS[name]} per animal')
+
+    def handle(self, *args, **options):
+        if Animal.objects.exists():
+            raise CommandError('The database is not empty, run script.py cleardatabase first')
+        counts = {name: options[name] for name in SyntheticDataset.RATIOS if options[name] is not None}
+        for model, count in SyntheticDataset.generate(options['scale'], options['seed'], **counts).items():
+            self.stdout.write(f'{model}: {count}')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from wildthoughts.hot import HotScores
+from wildthoughts.page_cache import PageCache
+
+
+class Command(BaseCommand):
+    """
+    recompute the hot score of every animal, discussion and list from
+    their votes and dates and write the ones that changed, meant to run
+    periodically, e.g. from cron, and once after the hot column is migrated
+
+    usage: python manage.py update_hot_scores [--dry-run]
+    """
+    help = 'Recompute the hot scores sorted by in the lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the changed scores, do not write them')
+
+    def handle(self, *args, **options):
+        counts = HotScores.rebuild_all(dry_run=options['dry_run'])
+        if any(counts.values()) and not options['dry_run']:
+            # the scores are written without signals
+            PageCache.invalidate()
+        for model, count in counts.items():
+            self.stdout.write(f'{model}: {count} changed')
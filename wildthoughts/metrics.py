@@ -0,0 +1,245 @@
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.template.backends.django import DjangoTemplates, Template
+
+logger = logging.getLogger(__name__)
+
+
+class RequestRecord:
+    """
+    what one sampled request spent its time on, filled in by the query wrapper
+    and the template backend while the view runs
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.fingerprints = Counter()
+        self.template_seconds = 0.0
+        self.template_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # installed with connection.execute_wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - start
+            self.queries += 1
+            self.fingerprints[Metrics.fingerprint(sql)] += 1
+
+    def duplicates(self) -> dict[str, int]:
+        threshold = getattr(settings, 'METRICS_DUPLICATE_THRESHOLD', 3)
+        return {sql: count for sql, count in self.fingerprints.items() if count >= threshold}
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        record = Metrics.current()
+        if record is None:
+            return super().render(context, request)
+        # render_to_string inside a template tag is part of the outer render
+        record.template_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            record.template_depth -= 1
+            if not record.template_depth:
+                record.template_seconds += time.perf_counter() - start
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    the Django template backend, with the render time of sampled requests recorded by Metrics
+    """
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return TimedTemplate(template.template, self)
+
+
+class Metrics:
+    """
+    class dedicated to keep per view timings of the requests sampled by MetricsMiddleware
+    every view, by url name, has a latency histogram for Prometheus and the last
+    WINDOW requests for percentiles, with the time spent in the database and templates,
+    the number of queries and the queries repeated within a request (N+1 candidates)
+
+    the metrics live in the process, like PythonBackend, so every worker reports its own
+
+    see:
+    middleware MetricsMiddleware for the sampling and the Server-Timing header
+    views MetricsView for the json and Prometheus endpoint
+    """
+    # upper bounds of the histogram buckets, in seconds
+    BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    WINDOW = 1000
+    SLOW_REQUESTS = 50
+    TOP_DUPLICATES = 10
+
+    lock = threading.Lock()
+    local = threading.local()
+    views: dict = {}
+    slow: deque = deque(maxlen=SLOW_REQUESTS)
+
+    @classmethod
+    def sample_rate(cls) -> float:
+        return getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+
+    @classmethod
+    def sampled(cls) -> bool:
+        rate = cls.sample_rate()
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+    @classmethod
+    def current(cls) -> RequestRecord:
+        return getattr(cls.local, 'record', None)
+
+    @classmethod
+    def fingerprint(cls, sql: str) -> str:
+        # the parameters are already separate, only IN lists of different lengths differ
+        return re.sub(r'IN \((%s, )*%s\)', 'IN (...)', sql)
+
+    @classmethod
+    def new_view(cls) -> dict:
+        return {
+            'view': None,
+            'count': 0,
+            'buckets': [0] * (len(cls.BUCKETS) + 1),
+            'seconds': 0.0,
+            'db_seconds': 0.0,
+            'template_seconds': 0.0,
+            'queries': 0,
+            'duplicate_queries': 0,
+            'durations': deque(maxlen=cls.WINDOW),
+            'duplicates': Counter(),
+        }
+
+    @classmethod
+    def start(cls) -> RequestRecord:
+        cls.local.record = RequestRecord()
+        return cls.local.record
+
+    @classmethod
+    def finish(cls, record: RequestRecord, url_name: str, view: str, path: str) -> float:
+        """
+        add a finished request to the metrics of its view and returns its duration
+        """
+        cls.local.record = None
+        seconds = time.perf_counter() - record.start
+        duplicates = record.duplicates()
+        with cls.lock:
+            metrics = cls.views.setdefault(url_name, cls.new_view())
+            metrics['view'] = view
+            metrics['count'] += 1
+            metrics['buckets'][bisect.bisect_left(cls.BUCKETS, seconds)] += 1
+            metrics['seconds'] += seconds
+            metrics['db_seconds'] += record.db_seconds
+            metrics['template_seconds'] += record.template_seconds
+            metrics['queries'] += record.queries
+            metrics['duplicate_queries'] += sum(duplicates.values())
+            metrics['durations'].append(seconds)
+            metrics['duplicates'].update(duplicates)
+
+        slow_ms = getattr(settings, 'METRICS_SLOW_MS', 500)
+        if seconds * 1000 >= slow_ms:
+            report = {
+                'url_name': url_name,
+                'path': path,
+                'ms': round(seconds * 1000, 2),
+                'db_ms': round(record.db_seconds * 1000, 2),
+                'template_ms': round(record.template_seconds * 1000, 2),
+                'queries': record.queries,
+                'duplicates': duplicates,
+            }
+            with cls.lock:
+                cls.slow.append(report)
+            logger.warning('Slow request %s %s: %.0fms, %d queries (%.0fms), templates %.0fms, %d repeated queries',
+                           url_name, path, report['ms'], record.queries, report['db_ms'], report['template_ms'],
+                           sum(duplicates.values()))
+        return seconds
+
+    @classmethod
+    def percentile(cls, durations: list, q: float) -> float:
+        if not durations:
+            return 0.0
+        durations = sorted(durations)
+        return durations[min(int(len(durations) * q), len(durations) - 1)]
+
+    @classmethod
+    def snapshot(cls) -> dict:
+        with cls.lock:
+            views = {}
+            for url_name, metrics in sorted(cls.views.items()):
+                count = metrics['count']
+                durations = list(metrics['durations'])
+                views[url_name] = {
+                    'view': metrics['view'],
+                    'count': count,
+                    'p50_ms': round(cls.percentile(durations, 0.50) * 1000, 2),
+                    'p95_ms': round(cls.percentile(durations, 0.95) * 1000, 2),
+                    'p99_ms': round(cls.percentile(durations, 0.99) * 1000, 2),
+                    'mean_ms': round(metrics['seconds'] / count * 1000, 2),
+                    'mean_db_ms': round(metrics['db_seconds'] / count * 1000, 2),
+                    'mean_template_ms': round(metrics['template_seconds'] / count * 1000, 2),
+                    'mean_queries': round(metrics['queries'] / count, 2),
+                    'duplicate_queries': metrics['duplicate_queries'],
+                    'top_duplicates': dict(metrics['duplicates'].most_common(cls.TOP_DUPLICATES)),
+                }
+            return {'sample_rate': cls.sample_rate(), 'views': views, 'slow': list(cls.slow)}
+
+    @classmethod
+    def prometheus(cls) -> str:
+        """
+        the metrics in the Prometheus text exposition format
+        """
+        lines = [
+            '# HELP wildthoughts_request_duration_seconds Duration of the sampled requests',
+            '# TYPE wildthoughts_request_duration_seconds histogram',
+        ]
+        totals = defaultdict(list)
+        with cls.lock:
+            for url_name, metrics in sorted(cls.views.items()):
+                label = 'view="{}"'.format(url_name.replace('\\', '\\\\').replace('"', '\\"'))
+                cumulative = 0
+                for bound, count in zip(cls.BUCKETS + ['+Inf'], metrics['buckets']):
+                    cumulative += count
+                    lines.append(f'wildthoughts_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+                lines.append(f'wildthoughts_request_duration_seconds_sum{{{label}}} {metrics["seconds"]}')
+                lines.append(f'wildthoughts_request_duration_seconds_count{{{label}}} {metrics["count"]}')
+                for name in ['db_seconds', 'template_seconds', 'queries', 'duplicate_queries']:
+                    totals[name].append(f'wildthoughts_request_{name}_total{{{label}}} {metrics[name]}')
+
+        descriptions = {
+            'db_seconds': 'Time spent in database queries',
+            'template_seconds': 'Time spent rendering templates',
+            'queries': 'Database queries',
+            'duplicate_queries': 'Queries repeated within a request, N+1 candidates',
+        }
+        for name, description in descriptions.items():
+            lines.append(f'# HELP wildthoughts_request_{name}_total {description}')
+            lines.append(f'# TYPE wildthoughts_request_{name}_total counter')
+            lines.extend(totals[name])
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls.lock:
+            cls.views.clear()
+            cls.slow.clear()
+
+    @classmethod
+    def server_timing(cls, record: RequestRecord, seconds: float) -> str:
+        return (f'total;dur={seconds * 1000:.1f}, '
+                f'db;dur={record.db_seconds * 1000:.1f};desc="{record.queries} queries", '
+                f'tpl;dur={record.template_seconds * 1000:.1f}')
@@ -0,0 +1,123 @@
+from django.conf import settings
+from django.db import connection
+from django.utils.functional import SimpleLazyObject
+
+from wildthoughts.metrics import Metrics
+from wildthoughts.models import UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.static_assets import StaticAssets
+
+
+class ProfileMiddleware:
+    """
+    attach the UserProfile of the logged in user to the request as request.profile
+    it is looked up, joined with its User, the first time it's used
+    and then shared by the views and template tags for the rest of the request.
+    None for anonymous users and users without a profile
+
+    see:
+    templatetags/wildthoughts profile() and profile_picture()
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.profile = SimpleLazyObject(lambda: self.get_profile(request))
+        return self.get_response(request)
+
+    @classmethod
+    def get_profile(cls, request) -> UserProfile:
+        if not request.user.is_authenticated:
+            return None
+        try:
+            return UserProfile.objects.select_related('user').get(user_id=request.user.id)
+        except UserProfile.DoesNotExist:
+            return None
+
+
+class MetricsMiddleware:
+    """
+    record the wall time, database time, queries and template time of a sample of the
+    requests per url name, see: metrics Metrics. The share of requests sampled is the
+    METRICS_SAMPLE_RATE setting, 0 turns it off and a request then costs one comparison
+
+    a sampled response carries a Server-Timing header, shown in the network tab of the browser
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not Metrics.sampled():
+            return self.get_response(request)
+
+        record = Metrics.start()
+        try:
+            with connection.execute_wrapper(record):
+                response = self.get_response(request)
+        except BaseException:
+            Metrics.local.record = None
+            raise
+
+        match = request.resolver_match
+        url_name = match.view_name if match else 'unresolved'
+        view = match._func_path if match else None
+        seconds = Metrics.finish(record, url_name, view, request.path)
+        response['Server-Timing'] = Metrics.server_timing(record, seconds)
+        return response
+
+
+class PageCacheMiddleware:
+    """
+    serve the pages of PageCache.views() to anonymous visitors from the cache, see: page_cache PageCache
+    only GET and HEAD requests without a messages cookie are looked up, and only 200 responses
+    that didn't use the csrf token or set a cookie are cached, e.g. the discussion page with
+    its comment form never is. The response carries an X-Page-Cache header, hit or miss
+
+    it comes last, so the response of a hit still goes through every other middleware
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        key = getattr(request, 'page_cache_key', None)
+        if key and PageCache.set(key, request, response):
+            response['X-Page-Cache'] = 'miss'
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not PageCache.timeout() or request.method not in ['GET', 'HEAD']:
+            return None
+        if request.resolver_match.view_name not in PageCache.views():
+            return None
+        if 'messages' in request.COOKIES or request.user.is_authenticated:
+            return None
+
+        key = PageCache.key(request)
+        if key is None:
+            return None
+        response = PageCache.get(key)
+        if response is None:
+            request.page_cache_key = key
+            return None
+        response['X-Page-Cache'] = 'hit'
+        return response
+
+
+class StaticAssetsMiddleware:
+    """
+    serve the files collectstatic gathered in STATIC_ROOT, see: static_assets StaticAssets
+    a request under STATIC_URL for a file that isn't there goes on to the urls like before,
+    with DEBUG the runserver answers static requests itself and this is never reached
+
+    it comes right after SecurityMiddleware, which still adds its headers
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method in ['GET', 'HEAD'] and request.path.startswith(settings.STATIC_URL) and StaticAssets.enabled():
+            response = StaticAssets.serve(request, request.path[len(settings.STATIC_URL):])
+            if response is not None:
+                return response
+        return self.get_response(request)
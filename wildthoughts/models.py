@@ -9,6 +9,20 @@ class UserProfile(models.Model):
     picture = models.ImageField(upload_to='profile_images', blank=True)
     date = models.DateField(auto_now_add=True)
     description = models.TextField(blank=True)
+    # denormalized activity counters, see: counters ProfileCounters
+    animals_count = models.IntegerField(default=0)
+    discussions_count = models.IntegerField(default=0)
+    comments_count = models.IntegerField(default=0)
+    lists_count = models.IntegerField(default=0)
+    petitions_count = models.IntegerField(default=0)
+    votes_received = models.IntegerField(default=0)
+    signatures_count = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-date', '-id'], name='profile_date_idx'),
+            models.Index(fields=['-votes_received', '-id'], name='profile_votes_received_idx'),
+        ]
     
     def __str__(self):
         return self.user.username
@@ -25,11 +39,27 @@ class Animal(models.Model):
     description = models.TextField(blank=True)
     picture = models.ImageField(upload_to='animal_images', blank=True)
     votes = models.IntegerField(default=0)
+    # precomputed ranking, see: hot HotScores
+    hot = models.FloatField(default=0)
     upvoted_by = models.ManyToManyField(UserProfile, related_name='upvoted_animals')
     downvoted_by = models.ManyToManyField(UserProfile, related_name='downvoted_animals')
     date = models.DateField(auto_now_add=True)
     slug = models.SlugField(unique=True)
 
+    class Meta:
+        # composite indexes matching the filters and orderings built by sorter Sorter,
+        # an index is scanned in either direction so one serves both overrated and underrated
+        # see: management/commands/benchmark_sorter
+        indexes = [
+            models.Index(fields=['-votes', '-id'], name='animal_votes_idx'),
+            models.Index(fields=['-hot', '-id'], name='animal_hot_idx'),
+            models.Index(fields=['-date', '-id'], name='animal_date_idx'),
+            models.Index(fields=['author', '-votes', '-id'], name='animal_author_votes_idx'),
+            models.Index(fields=['author', '-hot', '-id'], name='animal_author_hot_idx'),
+            models.Index(fields=['author', '-date', '-id'], name='animal_author_date_idx'),
+            models.Index(fields=['author', 'name'], name='animal_author_name_idx'),
+        ]
+
     def __str__(self):
         return self.name
     
@@ -46,10 +76,28 @@ class Discussion(models.Model):
     description = models.TextField(blank=True)
     picture = models.ImageField(upload_to='discussion_images', blank=True)
     votes = models.IntegerField(default=0)
+    # precomputed ranking, see: hot HotScores
+    hot = models.FloatField(default=0)
     upvoted_by = models.ManyToManyField(UserProfile, related_name='upvoted_discussions')
     downvoted_by = models.ManyToManyField(UserProfile, related_name='downvoted_discussions')
     slug = models.SlugField(unique=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-votes', '-id'], name='discussion_votes_idx'),
+            models.Index(fields=['-hot', '-id'], name='discussion_hot_idx'),
+            models.Index(fields=['-date', '-id'], name='discussion_date_idx'),
+            models.Index(fields=['title', 'id'], name='discussion_title_idx'),
+            models.Index(fields=['animal', '-votes', '-id'], name='discussion_animal_votes_idx'),
+            models.Index(fields=['animal', '-hot', '-id'], name='discussion_animal_hot_idx'),
+            models.Index(fields=['animal', '-date', '-id'], name='discussion_animal_date_idx'),
+            models.Index(fields=['animal', 'title', 'id'], name='discussion_animal_title_idx'),
+            models.Index(fields=['author', '-votes', '-id'], name='discussion_author_votes_idx'),
+            models.Index(fields=['author', '-hot', '-id'], name='discussion_author_hot_idx'),
+            models.Index(fields=['author', '-date', '-id'], name='discussion_author_date_idx'),
+            models.Index(fields=['author', 'title', 'id'], name='discussion_author_title_idx'),
+        ]
+
     def __str__(self):
         return self.title
     
@@ -67,6 +115,14 @@ class Comment(models.Model):
     upvoted_by = models.ManyToManyField(UserProfile, related_name='upvoted_comments')
     downvoted_by = models.ManyToManyField(UserProfile, related_name='downvoted_comments')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['discussion', '-votes', '-id'], name='comment_discussion_votes_idx'),
+            models.Index(fields=['discussion', '-date', '-id'], name='comment_discussion_date_idx'),
+            models.Index(fields=['author', '-votes', '-id'], name='comment_author_votes_idx'),
+            models.Index(fields=['author', '-date', '-id'], name='comment_author_date_idx'),
+        ]
+
     def __str__(self):
         return self.content
     
@@ -84,6 +140,16 @@ class Petition(models.Model):
     signed_by = models.ManyToManyField(UserProfile, related_name='signed_petitions')
     slug = models.SlugField(unique=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-signatures', '-id'], name='petition_signatures_idx'),
+            models.Index(fields=['-date', '-id'], name='petition_date_idx'),
+            models.Index(fields=['title', 'id'], name='petition_title_idx'),
+            models.Index(fields=['author', '-signatures', '-id'], name='petition_author_signatures_idx'),
+            models.Index(fields=['author', '-date', '-id'], name='petition_author_date_idx'),
+            models.Index(fields=['author', 'title', 'id'], name='petition_author_title_idx'),
+        ]
+
     def __str__(self):
         return self.title
     
@@ -105,10 +171,24 @@ class UserList(models.Model):
     animals = models.ManyToManyField(Animal)
     description = models.TextField(blank=True)
     votes = models.IntegerField(default=0)
+    # precomputed ranking, see: hot HotScores
+    hot = models.FloatField(default=0)
     upvoted_by = models.ManyToManyField(UserProfile, related_name='upvoted_user_lists')
     downvoted_by = models.ManyToManyField(UserProfile, related_name='downvoted_user_lists')
     slug = models.SlugField(unique=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-votes', '-id'], name='user_list_votes_idx'),
+            models.Index(fields=['-hot', '-id'], name='user_list_hot_idx'),
+            models.Index(fields=['-date', '-id'], name='user_list_date_idx'),
+            models.Index(fields=['title', 'id'], name='user_list_title_idx'),
+            models.Index(fields=['author', '-votes', '-id'], name='user_list_author_votes_idx'),
+            models.Index(fields=['author', '-hot', '-id'], name='user_list_author_hot_idx'),
+            models.Index(fields=['author', '-date', '-id'], name='user_list_author_date_idx'),
+            models.Index(fields=['author', 'title', 'id'], name='user_list_author_title_idx'),
+        ]
+
     def __str__(self):
         return self.title
     
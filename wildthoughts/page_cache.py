@@ -0,0 +1,134 @@
+import hashlib
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+
+class PageCache:
+    """
+    class dedicated to keep the rendered pages seen by anonymous visitors in the cache
+    a page is cached under its path, query string and theme cookie, the only thing
+    the templates read from an anonymous request, and the generation of the content
+
+    any saved or deleted row starts a new generation, so pages are rendered again
+    after every content change. Votes and signatures are F() updates without signals,
+    the counts they move on an anonymous page are at most PAGE_CACHE_TIMEOUT seconds old,
+    like the homepage board of Leaderboard
+
+    see:
+    middleware PageCacheMiddleware for what's cached
+    signals for the content changes
+    management/commands/benchmark_page_cache for the hit ratio and throughput
+    """
+    PREFIX = 'wildthoughts:page'
+    GENERATION = 'wildthoughts:page:generation'
+    THEMES = ['light', 'dark']
+    VIEWS = [
+        'wildthoughts:index',
+        'wildthoughts:animals',
+        'wildthoughts:animal',
+        'wildthoughts:discussions',
+        'wildthoughts:discussion',
+        'wildthoughts:petitions',
+        'wildthoughts:petition',
+        'wildthoughts:lists',
+        'wildthoughts:list',
+        'wildthoughts:profiles',
+        'wildthoughts:profile',
+    ]
+
+    lock = threading.Lock()
+    counts: Counter = Counter()
+
+    @classmethod
+    def timeout(cls) -> int:
+        # 0 turns the cache off
+        return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60)
+
+    @classmethod
+    def views(cls) -> list[str]:
+        return getattr(settings, 'PAGE_CACHE_VIEWS', cls.VIEWS)
+
+    @classmethod
+    def generation(cls) -> str:
+        generation = cache.get(cls.GENERATION)
+        if generation is None:
+            # another request may have made it first
+            cache.add(cls.GENERATION, uuid.uuid4().hex, None)
+            generation = cache.get(cls.GENERATION)
+        return generation
+
+    @classmethod
+    def key(cls, request) -> str:
+        """
+        returns the cache key of the page, None if the request can't be served from the cache
+        """
+        theme = request.COOKIES.get('theme', 'light')
+        # the theme tags print the cookie as it is, other values aren't cached
+        if theme not in cls.THEMES:
+            return None
+        page = f'{request.path}?{request.META.get("QUERY_STRING", "")}|{theme}'
+        digest = hashlib.md5(page.encode()).hexdigest()
+        return f'{cls.PREFIX}:{cls.generation()}:{digest}'
+
+    @classmethod
+    def get(cls, key: str) -> HttpResponse:
+        page = cache.get(key)
+        cls.record('misses' if page is None else 'hits')
+        if page is None:
+            return None
+        content, content_type = page
+        return HttpResponse(content, content_type=content_type)
+
+    @classmethod
+    def set(cls, key: str, request, response: HttpResponse) -> bool:
+        """
+        cache a response that is the same for every anonymous visitor
+        returns whether it was cached
+        """
+        # a page with a csrf token is unique to the visitor
+        cacheable = (not request.META.get('CSRF_COOKIE_USED')
+                     and response.status_code == 200
+                     and not response.streaming
+                     and not response.cookies
+                     and not response.has_header('Cache-Control'))
+        if cacheable:
+            cache.set(key, (response.content, response['Content-Type']), cls.timeout())
+        else:
+            cls.record('skipped')
+        return cacheable
+
+    @classmethod
+    def invalidate(cls) -> None:
+        cache.delete(cls.GENERATION)
+
+    @classmethod
+    def record(cls, name: str) -> None:
+        with cls.lock:
+            cls.counts[name] += 1
+
+    @classmethod
+    def stats(cls) -> dict:
+        with cls.lock:
+            hits, misses = cls.counts['hits'], cls.counts['misses']
+            ratio = round(hits / (hits + misses), 4) if hits + misses else 0.0
+            return {'hits': hits, 'misses': misses, 'skipped': cls.counts['skipped'], 'ratio': ratio}
+
+    @classmethod
+    def prometheus(cls) -> str:
+        lines = [
+            '# HELP wildthoughts_page_cache_total Anonymous pages by hit, miss or skipped',
+            '# TYPE wildthoughts_page_cache_total counter',
+        ]
+        with cls.lock:
+            lines.extend(f'wildthoughts_page_cache_total{{result="{name}"}} {count}' for name, count in sorted(cls.counts.items()))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def reset_stats(cls) -> None:
+        with cls.lock:
+            cls.counts.clear()
@@ -0,0 +1,141 @@
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q, QuerySet
+
+
+class CursorPage:
+    """
+    page returned by CursorPaginator, iterable like a Django Page
+    the links use opaque cursors instead of page numbers
+
+    see:
+    templates/wildthoughts/widget/pagination_widget.html
+    """
+    cursor_mode = True
+
+    def __init__(self, object_list: list, next_cursor: str = None, previous_cursor: str = None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+
+class CursorPaginator:
+    """
+    keyset pagination over (sort key, id)
+    instead of COUNT(*) and OFFSET n every page is a range query starting
+    after the last row seen, so page 5000 costs the same as page 1 and rows
+    don't shift between pages while votes change. No total count is computed
+
+    the sort key is the first field of the queryset ordering and id breaks ties
+    in the same direction, so every Sorter.OPTIONS_ORDER option is supported
+    """
+    def __init__(self, queryset: QuerySet, per_page: int):
+        ordering = queryset.query.order_by or ['-id']
+        self.field = ordering[0].lstrip('-')
+        self.descending = ordering[0].startswith('-')
+        self.queryset = queryset
+        self.per_page = per_page
+
+    @classmethod
+    def paginate(cls, request, results: QuerySet, per_page: int = 20):
+        """
+        return a CursorPage when cursor mode is requested with ?paginate=cursor,
+        a ?cursor= link or the CURSOR_PAGINATION setting, otherwise a numbered Django Page
+        """
+        cursor = request.GET.get('cursor')
+        if cursor is not None or request.GET.get('paginate') == 'cursor' or getattr(settings, 'CURSOR_PAGINATION', False):
+            return cls(results, per_page).get_page(cursor)
+        p = Paginator(results, per_page)
+        page = request.GET.get('page')
+        return p.get_page(page)
+
+    def encode(self, value, id: int, direction: str) -> str:
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            value = value.isoformat()
+        data = json.dumps([self.field, value, id, direction]).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+    def decode(self, cursor: str) -> tuple:
+        # a malformed cursor, or one made for another sort option, restarts from the first page
+        try:
+            data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            field, value, id, direction = json.loads(data)
+            if field != self.field or direction not in ('next', 'previous'):
+                return None
+            value = self.model_field().to_python(value)
+            if value is None:
+                return None
+            return value, int(id), direction
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def model_field(self):
+        # the field the sort key is read from, following the __ path, or the output field of an annotation
+        if self.field in self.queryset.query.annotations:
+            return self.queryset.query.annotations[self.field].output_field
+        model = self.queryset.model
+        *relations, name = self.field.split('__')
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(name)
+
+    def value(self, instance):
+        for attribute in self.field.split('__'):
+            instance = getattr(instance, attribute)
+        return instance
+
+    def after(self, value, id: int, descending: bool) -> Q:
+        lookup = 'lt' if descending else 'gt'
+        return Q(**{f'{self.field}__{lookup}': value}) | Q(**{self.field: value, f'id__{lookup}': id})
+
+    def ordered(self, descending: bool) -> QuerySet:
+        prefix = '-' if descending else ''
+        return self.queryset.order_by(f'{prefix}{self.field}', f'{prefix}id')
+
+    def get_page(self, cursor: str = None) -> CursorPage:
+        position = self.decode(cursor) if cursor else None
+        if position is None:
+            rows = list(self.ordered(self.descending)[:self.per_page + 1])
+            more = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            return self.page(rows, has_next=more, has_previous=False)
+
+        value, id, direction = position
+        if direction == 'next':
+            rows = list(self.ordered(self.descending).filter(self.after(value, id, self.descending))[:self.per_page + 1])
+            more = len(rows) > self.per_page
+            return self.page(rows[:self.per_page], has_next=more, has_previous=True)
+
+        # walk backwards from the cursor, then restore the page order
+        rows = list(self.ordered(not self.descending).filter(self.after(value, id, not self.descending))[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page][::-1]
+        return self.page(rows, has_next=True, has_previous=more)
+
+    def page(self, rows: list, has_next: bool, has_previous: bool) -> CursorPage:
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = self.encode(self.value(rows[-1]), rows[-1].id, 'next')
+        if rows and has_previous:
+            previous_cursor = self.encode(self.value(rows[0]), rows[0].id, 'previous')
+        return CursorPage(rows, next_cursor, previous_cursor)
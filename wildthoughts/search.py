@@ -0,0 +1,545 @@
+import bisect
+import itertools
+import logging
+import math
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Model
+from django.urls import reverse
+
+from wildthoughts.models import Animal, Discussion, Petition, UserList, UserProfile
+from wildthoughts.sorter import Sorter
+
+logger = logging.getLogger(__name__)
+
+
+class Fts5Backend:
+    """
+    inverted index stored in a SQLite FTS5 virtual table
+    the rowid encodes both the category and the object id, so updates and
+    deletes are rowid lookups instead of scans over the virtual table
+    """
+    TABLE = 'wildthoughts_search'
+    created = set()
+
+    @classmethod
+    def available(cls) -> bool:
+        if connection.vendor != 'sqlite':
+            return False
+        try:
+            cls.ensure_table()
+            return True
+        except Exception:
+            return False
+
+    @classmethod
+    def ensure_table(cls) -> None:
+        name = connection.settings_dict['NAME']
+        if name in cls.created:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {cls.TABLE} USING fts5(title, body)')
+        # a table created inside a transaction may still be rolled back
+        if not connection.in_atomic_block:
+            cls.created.add(name)
+
+    @classmethod
+    def query(cls, text: str) -> str:
+        # every word must match, as a prefix so partial words still find results
+        tokens = SearchIndex.tokenize(text)
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    @classmethod
+    def update(cls, rowid: int, title: str, body: str) -> None:
+        cls.ensure_table()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {cls.TABLE} WHERE rowid = %s', [rowid])
+            cursor.execute(f'INSERT INTO {cls.TABLE} (rowid, title, body) VALUES (%s, %s, %s)', [rowid, title, body])
+
+    @classmethod
+    def add_many(cls, documents) -> None:
+        # only after clear(), the rowids must not be in the table yet
+        cls.ensure_table()
+        with connection.cursor() as cursor:
+            cursor.executemany(f'INSERT INTO {cls.TABLE} (rowid, title, body) VALUES (%s, %s, %s)', documents)
+
+    @classmethod
+    def remove(cls, rowid: int) -> None:
+        cls.ensure_table()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {cls.TABLE} WHERE rowid = %s', [rowid])
+
+    @classmethod
+    def clear(cls) -> None:
+        cls.ensure_table()
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {cls.TABLE}')
+
+    @classmethod
+    def search(cls, category_index: int, text: str) -> list[int]:
+        query = cls.query(text)
+        if not query:
+            return []
+        cls.ensure_table()
+        sql = (f'SELECT rowid FROM {cls.TABLE} WHERE {cls.TABLE} MATCH %s '
+               f'AND rowid %% {SearchIndex.STRIDE} = %s '
+               f'ORDER BY bm25({cls.TABLE}, {SearchIndex.TITLE_WEIGHT}, 1.0), rowid')
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [query, category_index])
+            return [rowid // SearchIndex.STRIDE for rowid, in cursor.fetchall()]
+
+
+class PythonBackend:
+    """
+    pure python inverted index used when FTS5 is not available
+    it is built lazily from the database on the first search of the process
+    and then kept up to date by the same signals as the FTS5 table
+    note that the index lives in the process, saves made by other processes are
+    only picked up after a restart or rebuild_search_index
+    """
+    lock = threading.RLock()
+    loaded = False
+    # token -> {rowid: (title frequency, body frequency)}
+    postings: dict = defaultdict(dict)
+    # rowid -> tokens, needed to remove the old postings on update
+    documents: dict = {}
+    lengths: dict = {}
+    total_length = 0
+    # sorted tokens for prefix lookups with bisect, rebuilt after changes
+    vocabulary: list = []
+    dirty = False
+
+    @classmethod
+    def load(cls) -> None:
+        with cls.lock:
+            if cls.loaded:
+                return
+            cls.loaded = True
+            for instance in SearchIndex.all_instances():
+                rowid, title, body = SearchIndex.document(instance)
+                cls.update(rowid, title, body)
+
+    @classmethod
+    def update(cls, rowid: int, title: str, body: str) -> None:
+        with cls.lock:
+            cls.remove(rowid)
+            title_tokens = SearchIndex.tokenize(title)
+            body_tokens = SearchIndex.tokenize(body)
+            tokens = set(title_tokens) | set(body_tokens)
+            for token in tokens:
+                cls.postings[token][rowid] = (title_tokens.count(token), body_tokens.count(token))
+            cls.documents[rowid] = tokens
+            cls.lengths[rowid] = len(title_tokens) + len(body_tokens)
+            cls.total_length += cls.lengths[rowid]
+            cls.dirty = True
+
+    @classmethod
+    def add_many(cls, documents) -> None:
+        for rowid, title, body in documents:
+            cls.update(rowid, title, body)
+
+    @classmethod
+    def remove(cls, rowid: int) -> None:
+        with cls.lock:
+            for token in cls.documents.pop(rowid, ()):
+                postings = cls.postings[token]
+                postings.pop(rowid, None)
+                if not postings:
+                    del cls.postings[token]
+                    cls.dirty = True
+            cls.total_length -= cls.lengths.pop(rowid, 0)
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls.lock:
+            cls.postings.clear()
+            cls.documents.clear()
+            cls.lengths.clear()
+            cls.total_length = 0
+            cls.vocabulary = []
+            cls.dirty = False
+            cls.loaded = True
+
+    @classmethod
+    def matches(cls, token: str) -> dict:
+        # prefix match, same as the FTS5 "token"* query
+        if cls.dirty:
+            cls.vocabulary = sorted(cls.postings)
+            cls.dirty = False
+        matched = {}
+        start = bisect.bisect_left(cls.vocabulary, token)
+        end = bisect.bisect_left(cls.vocabulary, token + '\uffff')
+        for indexed in cls.vocabulary[start:end]:
+            for rowid, frequencies in cls.postings[indexed].items():
+                title, body = matched.get(rowid, (0, 0))
+                matched[rowid] = (title + frequencies[0], body + frequencies[1])
+        return matched
+
+    @classmethod
+    def search(cls, category_index: int, text: str) -> list[int]:
+        tokens = SearchIndex.tokenize(text)
+        if not tokens:
+            return []
+        cls.load()
+        with cls.lock:
+            total = len(cls.lengths) or 1
+            average = cls.total_length / total or 1
+            scores = None
+            for token in tokens:
+                matched = cls.matches(token)
+                idf = math.log(1 + (total - len(matched) + 0.5) / (len(matched) + 0.5))
+                token_scores = {}
+                for rowid, (title, body) in matched.items():
+                    if rowid % SearchIndex.STRIDE != category_index:
+                        continue
+                    # bm25 with k1=1.2 and b=0.75, title hits weighted like the FTS5 backend
+                    frequency = title * SearchIndex.TITLE_WEIGHT + body
+                    norm = 1.2 * (0.25 + 0.75 * cls.lengths[rowid] / average)
+                    token_scores[rowid] = idf * frequency * 2.2 / (frequency + norm)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {rowid: score + token_scores[rowid] for rowid, score in scores.items() if rowid in token_scores}
+            ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+            return [rowid // SearchIndex.STRIDE for rowid, score in ranked]
+
+
+class SearchResults:
+    """
+    lazy sequence of ranked results, so Paginator only fetches the rows of the current page
+    """
+    def __init__(self, model: Model, ids: list[int]):
+        self.model = model
+        self.ids = ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            ids = self.ids[key]
+            objects = SearchIndex.queryset(self.model).in_bulk(ids)
+            return [objects[id] for id in ids if id in objects]
+        return self[key:key + 1][0]
+
+
+class SearchIndex:
+    """
+    class dedicated to keep a full-text index of every searchable model up to date
+    and query it by relevance. SQLite FTS5 is used when available,
+    otherwise a pure python inverted index
+
+    see:
+    signals for keeping the index up to date on save/delete
+    management/commands/rebuild_search_index for indexing existing rows
+    """
+    CATEGORY_TO_MODEL = {
+        'Animals': Animal,
+        'Discussions': Discussion,
+        'Lists': UserList,
+        'Petitions': Petition,
+        'Profiles': UserProfile,
+    }
+    # rowid = object id * STRIDE + category index
+    STRIDE = 8
+    TITLE_WEIGHT = 10.0
+
+    @classmethod
+    def backend(cls):
+        if getattr(settings, 'SEARCH_BACKEND', 'fts5') == 'fts5' and Fts5Backend.available():
+            return Fts5Backend
+        return PythonBackend
+
+    @classmethod
+    def tokenize(cls, text: str) -> list[str]:
+        return re.findall(r'\w+', (text or '').lower())
+
+    @classmethod
+    def category_index(cls, model: Model) -> int:
+        return list(cls.CATEGORY_TO_MODEL.values()).index(model)
+
+    @classmethod
+    def document(cls, instance: Model) -> tuple[int, str, str]:
+        model = type(instance)
+        rowid = instance.id * cls.STRIDE + cls.category_index(model)
+        if model is UserProfile:
+            title = instance.user.username
+        else:
+            title = str(instance)
+        return rowid, title, instance.description
+
+    @classmethod
+    def queryset(cls, model: Model):
+        # rows are rendered by the same widgets as the list pages
+        return Sorter.build(model.objects.all())
+
+    @classmethod
+    def all_instances(cls):
+        for model in cls.CATEGORY_TO_MODEL.values():
+            queryset = model.objects.select_related('user') if model is UserProfile else model.objects.all()
+            yield from queryset.iterator()
+
+    @classmethod
+    def update(cls, instance: Model) -> None:
+        cls.backend().update(*cls.document(instance))
+
+    @classmethod
+    def remove(cls, instance: Model) -> None:
+        rowid = instance.id * cls.STRIDE + cls.category_index(type(instance))
+        cls.backend().remove(rowid)
+
+    @classmethod
+    def rebuild(cls) -> int:
+        backend = cls.backend()
+        backend.clear()
+        documents = [cls.document(instance) for instance in cls.all_instances()]
+        backend.add_many(documents)
+        return len(documents)
+
+    @classmethod
+    def search(cls, category: str, text: str) -> SearchResults:
+        model = cls.CATEGORY_TO_MODEL[category]
+        ids = cls.backend().search(cls.category_index(model), text)
+        return SearchResults(model, ids)
+
+
+class SuggestIndex:
+    """
+    class dedicated to serve search-as-you-type suggestions from memory
+    every category keeps a sorted list of (lowercased key, id) where the keys are the
+    title and the start of each of its words, so a prefix lookup is two bisects
+    the index is loaded once per process and updated from the save/delete signals once
+    their transaction commits, so a rolled back save never shows up. After SUGGEST_RELOAD_SECONDS
+    a thread reads the tables again to pick up saves of other processes while the old index
+    is served, the changes committed meanwhile are applied again to what it read
+
+    see:
+    signals for keeping the index up to date
+    views SuggestView for the json endpoint
+    static/js/search for client side
+    """
+    LIMIT = 8
+    CACHE_SIZE = 256
+    lock = threading.RLock()
+    # held while the tables are read, so they are read by one thread at a time
+    load_lock = threading.Lock()
+    loaded_at = None
+    reloader: threading.Thread = None
+    # the changes committed while the tables are read
+    replay: list = None
+    # category -> sorted [(key, id)]
+    keys: dict = {}
+    # category -> {id: (text, url)}
+    entries: dict = {}
+    # (category, prefix) -> suggestions, least recently used first
+    cache = OrderedDict()
+
+    @classmethod
+    def entry(cls, instance: Model) -> tuple[str, str]:
+        model = type(instance)
+        if model is Animal:
+            return instance.name, reverse('wildthoughts:animal', args=[instance.slug])
+        elif model is Discussion:
+            return instance.title, reverse('wildthoughts:discussion', args=[instance.slug])
+        elif model is UserList:
+            return instance.title, reverse('wildthoughts:list', args=[instance.slug])
+        elif model is Petition:
+            return instance.title, reverse('wildthoughts:petition', args=[instance.slug])
+        username = instance.user.username
+        return username, reverse('wildthoughts:profile', args=[username])
+
+    @classmethod
+    def tokens(cls, text: str) -> list[str]:
+        return (text or '').lower().split()
+
+    @classmethod
+    def entry_keys(cls, text: str) -> set[str]:
+        text = ' '.join(cls.tokens(text))
+        keys = {text}
+        for match in re.finditer(r'\w+', text):
+            keys.add(text[match.start():])
+        return keys
+
+    @classmethod
+    def category(cls, model: Model) -> str:
+        return list(SearchIndex.CATEGORY_TO_MODEL)[SearchIndex.category_index(model)]
+
+    @classmethod
+    def reload_seconds(cls) -> float:
+        return getattr(settings, 'SUGGEST_RELOAD_SECONDS', 300)
+
+    @classmethod
+    def read(cls) -> tuple[dict, dict]:
+        keys = {}
+        entries = {}
+        for category, model in SearchIndex.CATEGORY_TO_MODEL.items():
+            keys[category] = []
+            entries[category] = {}
+            queryset = model.objects.select_related('user') if model is UserProfile else model.objects.all()
+            for instance in queryset.defer('description').iterator():
+                text, url = cls.entry(instance)
+                entries[category][instance.id] = (text, url)
+                keys[category].extend((key, instance.id) for key in cls.entry_keys(text))
+            keys[category].sort()
+        return keys, entries
+
+    @classmethod
+    def load(cls) -> None:
+        """
+        read the tables on the first suggestion, there's nothing to serve before them,
+        and start a reload in the background once the index is SUGGEST_RELOAD_SECONDS old
+        """
+        if cls.loaded_at is None:
+            cls.reload(first=True)
+        elif time.monotonic() - cls.loaded_at >= cls.reload_seconds():
+            with cls.lock:
+                if cls.reloader is None or not cls.reloader.is_alive():
+                    cls.reloader = threading.Thread(target=cls.reload_in_background, daemon=True)
+                    cls.reloader.start()
+
+    @classmethod
+    def reload(cls, first: bool = False) -> None:
+        with cls.load_lock:
+            if first and cls.loaded_at is not None:
+                # loaded by the request this one waited for
+                return
+            with cls.lock:
+                cls.replay = []
+            try:
+                keys, entries = cls.read()
+            finally:
+                with cls.lock:
+                    replay, cls.replay = cls.replay, None
+            with cls.lock:
+                for change in replay:
+                    cls.apply(keys, entries, *change)
+                cls.keys, cls.entries = keys, entries
+                cls.cache.clear()
+                cls.loaded_at = time.monotonic()
+
+    @classmethod
+    def reload_in_background(cls) -> None:
+        try:
+            cls.reload()
+        except Exception:
+            logger.exception('Reloading the suggestions failed, serving the old ones')
+            with cls.lock:
+                if cls.loaded_at is not None:
+                    # retried after another SUGGEST_RELOAD_SECONDS, not by every request
+                    cls.loaded_at = time.monotonic()
+        finally:
+            # the thread ends here, its connection would be left open
+            connection.close()
+
+    @classmethod
+    def apply(cls, keys: dict, entries: dict, category: str, instance_id: int, entry: tuple) -> None:
+        """
+        replace the entry of an instance in keys and entries, an entry of None removes it
+        returns the entry it replaced
+        """
+        old = entries[category].pop(instance_id, None)
+        if old:
+            category_keys = keys[category]
+            for key in cls.entry_keys(old[0]):
+                index = bisect.bisect_left(category_keys, (key, instance_id))
+                if index < len(category_keys) and category_keys[index] == (key, instance_id):
+                    del category_keys[index]
+        if entry:
+            entries[category][instance_id] = entry
+            for key in cls.entry_keys(entry[0]):
+                bisect.insort(keys[category], (key, instance_id))
+        return old
+
+    @classmethod
+    def change(cls, category: str, instance_id: int, entry: tuple) -> None:
+        with cls.lock:
+            if cls.replay is not None:
+                cls.replay.append((category, instance_id, entry))
+            if cls.loaded_at is not None:
+                old = cls.apply(cls.keys, cls.entries, category, instance_id, entry)
+                cls.evict(category, [changed[0] for changed in [old, entry] if changed])
+
+    @classmethod
+    def evict(cls, category: str, texts: list[str]) -> None:
+        """
+        drop the cached suggestions a changed text could be part of, the others stay cached
+        called with the lock
+        """
+        keys = set()
+        for text in texts:
+            keys |= cls.entry_keys(text)
+        stale = [(cached_category, prefix) for cached_category, prefix in cls.cache
+                 # an unknown category is a lookup in all of them
+                 if (cached_category == category or cached_category not in cls.keys)
+                 and any(key.startswith(prefix) for key in keys)]
+        for cache_key in stale:
+            del cls.cache[cache_key]
+
+    @classmethod
+    def remove(cls, instance: Model) -> None:
+        # the id is read now, a deleted instance loses it
+        category, instance_id = cls.category(type(instance)), instance.id
+        transaction.on_commit(lambda: cls.change(category, instance_id, None))
+
+    @classmethod
+    def update(cls, instance: Model) -> None:
+        category, instance_id, entry = cls.category(type(instance)), instance.id, cls.entry(instance)
+        transaction.on_commit(lambda: cls.change(category, instance_id, entry))
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls.lock:
+            cls.loaded_at = None
+            cls.keys = {}
+            cls.entries = {}
+            cls.cache.clear()
+
+    @classmethod
+    def lookup(cls, category: str, prefix: str) -> list[dict]:
+        keys = cls.keys[category]
+        entries = cls.entries[category]
+        start = bisect.bisect_left(keys, (prefix,))
+        results = []
+        seen = set()
+        # walk from start instead of slicing, a slice would copy the rest of the keys
+        for key, id in itertools.islice(keys, start, None):
+            if not key.startswith(prefix) or len(results) == cls.LIMIT:
+                break
+            if id not in seen:
+                seen.add(id)
+                text, url = entries[id]
+                results.append({'category': category, 'text': text, 'url': url})
+        return results
+
+    @classmethod
+    def suggest(cls, prefix: str, category: str = None) -> list[dict]:
+        prefix = ' '.join(cls.tokens(prefix))
+        if not prefix:
+            return []
+        cls.load()
+        with cls.lock:
+            cache_key = (category, prefix)
+            if cache_key in cls.cache:
+                cls.cache.move_to_end(cache_key)
+                return cls.cache[cache_key]
+
+            if category in cls.keys:
+                results = cls.lookup(category, prefix)
+            else:
+                results = []
+                for name in cls.keys:
+                    results.extend(cls.lookup(name, prefix))
+                results = sorted(results, key=lambda result: result['text'].lower())[:cls.LIMIT]
+
+            cls.cache[cache_key] = results
+            if len(cls.cache) > cls.CACHE_SIZE:
+                cls.cache.popitem(last=False)
+            return results
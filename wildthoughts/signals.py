@@ -0,0 +1,156 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from wildthoughts.counters import ProfileCounters
+from wildthoughts.fragments import CardCache
+from wildthoughts.hot import HotScores
+from wildthoughts.images import ImageDerivatives
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.models import Animal, Comment, Discussion, Petition, UserList, UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.search import Fts5Backend, SearchIndex, SuggestIndex
+
+
+SEARCHABLE_MODELS = [Animal, Discussion, Petition, UserList, UserProfile]
+
+
+def update_search_index(sender, instance, **kwargs):
+    SearchIndex.update(instance)
+    SuggestIndex.update(instance)
+
+
+def remove_from_search_index(sender, instance, **kwargs):
+    SearchIndex.remove(instance)
+    SuggestIndex.remove(instance)
+
+
+for model in SEARCHABLE_MODELS:
+    post_save.connect(update_search_index, sender=model, dispatch_uid=f'search_update_{model.__name__}')
+    post_delete.connect(remove_from_search_index, sender=model, dispatch_uid=f'search_remove_{model.__name__}')
+
+
+@receiver(post_save, sender=User, dispatch_uid='search_update_user')
+def update_profile_search_index(sender, instance, update_fields=None, **kwargs):
+    # profiles are searched by username, which lives on User, a login only saves last_login
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    try:
+        SearchIndex.update(instance.userprofile)
+        SuggestIndex.update(instance.userprofile)
+    except UserProfile.DoesNotExist:
+        pass
+
+
+@receiver(post_save, sender=Animal, dispatch_uid='leaderboard_update')
+def update_leaderboard(sender, instance, **kwargs):
+    Leaderboard.update(instance.id)
+
+
+@receiver(post_delete, sender=Animal, dispatch_uid='leaderboard_remove')
+def remove_from_leaderboard(sender, instance, **kwargs):
+    Leaderboard.remove(instance.id)
+
+
+@receiver(post_save, sender=UserProfile, dispatch_uid='leaderboard_update_author')
+def update_leaderboard_author(sender, instance, **kwargs):
+    Leaderboard.update_author(instance.id)
+
+
+def count_authored(sender, instance, created, **kwargs):
+    if created:
+        ProfileCounters.authored(instance, 1)
+
+
+def uncount_authored(sender, instance, **kwargs):
+    ProfileCounters.authored(instance, -1)
+
+
+for model in ProfileCounters.AUTHORED:
+    post_save.connect(count_authored, sender=model, dispatch_uid=f'counters_created_{model.__name__}')
+    post_delete.connect(uncount_authored, sender=model, dispatch_uid=f'counters_deleted_{model.__name__}')
+
+
+@receiver(pre_delete, sender=Petition, dispatch_uid='counters_petition_signatures')
+def uncount_signatures(sender, instance, **kwargs):
+    ProfileCounters.petition_deleted(instance)
+
+
+def score_hot(sender, instance, **kwargs):
+    # date is only set by auto_now_add after this signal, a new row is dated today
+    instance.hot = HotScores.score(instance.votes, instance.date or datetime.date.today())
+
+
+for model in HotScores.MODELS:
+    pre_save.connect(score_hot, sender=model, dispatch_uid=f'hot_score_{model.__name__}')
+
+
+def bump_card(sender, instance, **kwargs):
+    CardCache.bump(sender, instance.id)
+
+
+for model in CardCache.DEPENDENCIES:
+    post_save.connect(bump_card, sender=model, dispatch_uid=f'cards_update_{model.__name__}')
+    post_delete.connect(bump_card, sender=model, dispatch_uid=f'cards_remove_{model.__name__}')
+
+
+@receiver(post_save, sender=User, dispatch_uid='cards_update_user')
+def bump_profile_card(sender, instance, update_fields=None, **kwargs):
+    # the username is shown on the cards of everything the profile authored, a login only saves last_login
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    CardCache.bump(UserProfile, *UserProfile.objects.filter(user=instance).values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Animal, dispatch_uid='cards_animal_lists')
+@receiver(post_save, sender=Animal, dispatch_uid='cards_update_animal_lists')
+def bump_user_list_cards(sender, instance, **kwargs):
+    # a list card shows its first animals, which aren't part of its key
+    CardCache.bump(UserList, *instance.userlist_set.values_list('id', flat=True))
+
+
+@receiver(m2m_changed, sender=UserList.animals.through, dispatch_uid='cards_user_list_animals')
+def bump_user_list_animals(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # animal.userlist_set.clear(), the lists are unknown afterwards
+        CardCache.bump(UserList, *instance.userlist_set.values_list('id', flat=True))
+    elif action.startswith('post_'):
+        ids = (pk_set or []) if reverse else [instance.id]
+        CardCache.bump(UserList, *ids)
+
+
+def invalidate_pages(sender, action=None, **kwargs):
+    # action is only sent by m2m_changed
+    if action is None or action.startswith('post_'):
+        PageCache.invalidate()
+
+
+for model in [Animal, Comment, Discussion, Petition, UserList, UserProfile]:
+    post_save.connect(invalidate_pages, sender=model, dispatch_uid=f'pages_update_{model.__name__}')
+    post_delete.connect(invalidate_pages, sender=model, dispatch_uid=f'pages_remove_{model.__name__}')
+for through in [UserList.animals.through, Petition.animals.through]:
+    m2m_changed.connect(invalidate_pages, sender=through, dispatch_uid=f'pages_{through.__name__}')
+
+
+@receiver(post_save, sender=User, dispatch_uid='pages_update_user')
+def invalidate_user_pages(sender, instance, update_fields=None, **kwargs):
+    if not (update_fields and set(update_fields) == {'last_login'}):
+        PageCache.invalidate()
+
+
+def generate_image_derivatives(sender, instance, **kwargs):
+    # copies that are already up to date are skipped, so a save without a new picture is cheap
+    ImageDerivatives.generate(instance)
+
+
+for model in ImageDerivatives.SIZES:
+    post_save.connect(generate_image_derivatives, sender=model, dispatch_uid=f'images_{model.__name__}')
+
+
+@receiver(post_migrate, dispatch_uid='search_create_table')
+def create_search_table(sender, **kwargs):
+    # create the FTS5 table with the other tables, available() does nothing on other databases
+    if sender.name == 'wildthoughts':
+        Fts5Backend.available()
@@ -0,0 +1,54 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from wildthoughts.counters import ProfileCounters
+from wildthoughts.fragments import CardCache
+from wildthoughts.models import Petition, UserProfile
+
+
+class SignatureService:
+    """
+    class dedicated to sign a petition without loading and rewriting the petition row
+    the signatures column is incremented by a guarded update, so it never
+    passes the goal, and the signed_by through-row is inserted in the same
+    transaction, so concurrent signers are counted exactly once each
+
+    see:
+    views SignPetitionView for the ajax endpoint
+    static/js/petition for client side
+    """
+    SIGNED = 'success'
+    ALREADY_SIGNED = 'signed'
+    GOAL_REACHED = 'goal_reached'
+
+    @classmethod
+    def sign(cls, profile: UserProfile, petition_id: int) -> str:
+        """
+        returns one of SIGNED, ALREADY_SIGNED or GOAL_REACHED
+        raises DoesNotExist if the petition or the profile is missing
+        """
+        through = Petition.signed_by.through
+        # also resolves a lazy request.profile before the transaction, see the write first comment below
+        if not profile:
+            raise UserProfile.DoesNotExist('Signing requires a profile')
+        try:
+            with transaction.atomic():
+                # write first: on SQLite this takes the write lock before anything is read
+                updated = (Petition.objects
+                           .filter(id=petition_id, signatures__lt=F('goal'))
+                           .update(signatures=F('signatures') + 1))
+                if not updated:
+                    if not Petition.objects.filter(id=petition_id).exists():
+                        raise Petition.DoesNotExist(f'Petition {petition_id} does not exist')
+                    # a signer of a full petition is told they signed it, not that it's full
+                    if through.objects.filter(petition_id=petition_id, userprofile_id=profile.id).exists():
+                        return cls.ALREADY_SIGNED
+                    return cls.GOAL_REACHED
+
+                # unique on (petition, profile), a second signature rolls back the increment
+                through.objects.create(petition_id=petition_id, userprofile_id=profile.id)
+                ProfileCounters.signed(profile.id)
+        except IntegrityError:
+            return cls.ALREADY_SIGNED
+        CardCache.bump(Petition, petition_id)
+        return cls.SIGNED
@@ -0,0 +1,162 @@
+from django.db.models import Model, Prefetch, QuerySet
+
+from wildthoughts.counters import ProfileCounters
+from wildthoughts.hot import HotScores
+from wildthoughts.models import Animal, Comment, Discussion, Petition, UserList, UserProfile
+
+
+class Sorter:
+    """
+    class dedicated to sort a model by specifying a option
+    the option is then converted to an appropriate field
+    if option is invalid returns model sorted by date
+
+    the querysets are also built for the widget that renders them:
+    related rows are joined or prefetched and unused text columns deferred,
+    so a page costs the same number of queries whatever its size
+    """
+    VALID_MODELS = {Animal, Comment, Discussion, Petition, UserList}
+    OPTIONS_ORDER = {
+        'title':'title',
+        'name': 'name',
+        'overrated': '-votes',
+        'underrated': 'votes',
+        # a stored score, only on the models of HotScores
+        'hot': '-hot',
+        'newest': '-date',
+        'oldest': 'date',
+        'most_signed': '-signatures',
+        'least_signed': 'signatures',
+    }
+    # the activity options read the counters of UserProfile, see: counters ProfileCounters
+    PROFILE_OPTIONS_ORDER = {
+        'name': 'user__username',
+        'newest': '-date',
+        'oldest': 'date',
+        'most_active': '-activity',
+        'most_voted': '-votes_received',
+    }
+
+    # what each template in templates/wildthoughts/widget reads from its rows
+    WIDGET_QUERIES = {
+        'animal_widget': {
+            'select_related': ['author__user'],
+            'defer': ['description'],
+        },
+        'comment_widget': {
+            'select_related': ['author__user'],
+        },
+        # comments listed on a profile also show their discussion and animal
+        'profile_comment_widget': {
+            'select_related': ['author__user', 'discussion__animal'],
+            'defer': ['discussion__description', 'discussion__picture', 'discussion__animal__description'],
+        },
+        'discussion_widget': {
+            'select_related': ['animal', 'author__user'],
+            'defer': ['description', 'picture', 'animal__description'],
+        },
+        'petition_widget': {
+            'select_related': ['author__user'],
+        },
+        'profile_widget': {
+            'select_related': ['user'],
+            'defer': ['description'],
+        },
+        'user_list_widget': {
+            'select_related': ['author__user'],
+            'prefetch_related': [Prefetch('animals', queryset=Animal.objects.only('id', 'name', 'slug', 'picture'))],
+            'defer': ['description'],
+        },
+    }
+    MODEL_TO_WIDGET = {
+        Animal: 'animal_widget',
+        Comment: 'comment_widget',
+        Discussion: 'discussion_widget',
+        Petition: 'petition_widget',
+        UserList: 'user_list_widget',
+        UserProfile: 'profile_widget',
+    }
+
+    @classmethod
+    def build(cls, results: QuerySet, widget: str = None) -> QuerySet:
+        """
+        apply the joins, prefetches and deferred fields of a widget to a queryset
+        the widget defaults to the one rendering the queryset's model
+        """
+        widget = widget or cls.MODEL_TO_WIDGET[results.model]
+        queries = cls.WIDGET_QUERIES[widget]
+        if queries.get('select_related'):
+            results = results.select_related(*queries['select_related'])
+        if queries.get('prefetch_related'):
+            results = results.prefetch_related(*queries['prefetch_related'])
+        if queries.get('defer'):
+            results = results.defer(*queries['defer'])
+        return results
+
+    @classmethod
+    def order(cls, field: str) -> tuple[str, str]:
+        # id breaks ties in the same direction so pages are stable, see pagination CursorPaginator
+        return field, '-id' if field.startswith('-') else 'id'
+
+    @classmethod
+    def validate(cls, choice: str, model: Model) -> str:
+        if model not in cls.VALID_MODELS:
+            raise TypeError(f'Model must be {cls.VALID_MODELS}')
+        elif model is Animal and choice == 'title':
+            choice = 'name'
+        elif model is Comment and choice in ['title', 'name']:
+            choice = 'newest'
+        elif choice == 'hot' and model not in HotScores.MODELS:
+            choice = 'newest'
+        elif choice not in cls.OPTIONS_ORDER:
+            choice = 'newest'
+        return choice
+
+    @classmethod
+    def sort_model(cls, choice: str, model: Model, profile: UserProfile = None, widget: str = None) -> tuple[str, list[Model]]:
+
+        choice = cls.validate(choice, model)
+        field = cls.OPTIONS_ORDER[choice]
+
+        if profile:
+            # filter by a profile instance if specified
+            results = model.objects.filter(author=profile).order_by(*cls.order(field))
+        else:
+            results = model.objects.order_by(*cls.order(field))
+
+        return choice, cls.build(results, widget)
+
+    @classmethod
+    def sort_profiles(cls, choice: str) -> tuple[str, list[Model]]:
+        if choice not in cls.PROFILE_OPTIONS_ORDER:
+            choice = 'newest'
+
+        results = UserProfile.objects.all()
+        if choice == 'most_active':
+            results = results.annotate(activity=ProfileCounters.activity())
+        results = results.order_by(*cls.order(cls.PROFILE_OPTIONS_ORDER[choice]))
+
+        return choice, cls.build(results)
+
+    @classmethod
+    def sort_user_list_animals(cls, choice: str, user_list: UserList) -> tuple[str, list[Model]]:
+        choice = cls.validate(choice, Animal)
+        field = Sorter.OPTIONS_ORDER[choice]
+        results = user_list.animals.order_by(*cls.order(field))
+        return choice, cls.build(results)
+
+    @classmethod
+    def sort_animal_discussions(cls, choice, animal: Animal) -> tuple[str, list[Model]]:
+        choice = cls.validate(choice, Discussion)
+        field = cls.OPTIONS_ORDER[choice]
+        results = Discussion.objects.filter(animal=animal).order_by(*cls.order(field))
+
+        return choice, cls.build(results)
+
+    @classmethod
+    def sort_discussion_comments(cls, choice, discussion: Discussion) -> tuple[str, list[Model]]:
+        choice = cls.validate(choice, Comment)
+        field = cls.OPTIONS_ORDER[choice]
+        results = Comment.objects.filter(discussion=discussion).order_by(*cls.order(field))
+
+        return choice, cls.build(results)
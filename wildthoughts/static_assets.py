@@ -0,0 +1,194 @@
+import gzip
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core import checks
+from django.http import FileResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    # the .br copies are left out, browsers get the .gz ones
+    brotli = None
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    """
+    the files collected by collectstatic, with the hash of their content in their name,
+    e.g. CSS/WildThoughts.3f2a9c1d0b7e.css, and a gzip and brotli copy next to the text ones
+    a name that isn't in the manifest, because collectstatic hasn't run like in development
+    and the tests, is served unhashed. The static_assets check reports those in the templates
+
+    see:
+    StaticAssets for the compression and the serving
+    """
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        processed = set()
+        for name, hashed_name, result in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(result, Exception):
+                processed.update([name, hashed_name])
+            yield name, hashed_name, result
+        if not dry_run:
+            for name in sorted(processed):
+                StaticAssets.compress(self.path(name))
+
+
+class StaticAssets:
+    """
+    class dedicated to serve the collected static files from STATIC_ROOT
+    a hashed name never changes content, so it's cached by the browser for a year without
+    asking again. Other names are revalidated with their modification time. The browser
+    gets the brotli or gzip copy it accepts, with Vary: Accept-Encoding for proxies
+
+    see:
+    middleware StaticAssetsMiddleware
+    check_templates() for the template references that wouldn't be hashed
+    """
+    # already compressed formats gain nothing
+    COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt', '.html', '.map', '.ico', '.xml')
+    # a copy that isn't at least this much smaller isn't kept
+    MIN_RATIO = 0.95
+    ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+    IMMUTABLE = 'public, max-age=31536000, immutable'
+    REVALIDATE = 'public, max-age=0, must-revalidate'
+    # a path in an attribute or url() written out instead of with {% static %}
+    LITERAL = r'''(?:src|href|srcset|content)\s*=\s*["']\s*({url}[^"'\s]+)|url\(\s*["']?({url}[^"')\s]+)'''
+    STATIC_TAG = re.compile(r'''{%\s*static\s+(["'])([^"']+)\1''')
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return bool(settings.STATIC_ROOT) and getattr(settings, 'STATIC_ASSETS', True)
+
+    @classmethod
+    def compress(cls, path: str) -> list[str]:
+        """
+        write the .gz and .br copies of a text file, returns the encodings written
+        """
+        if not path.endswith(cls.COMPRESSIBLE):
+            return []
+        with open(path, 'rb') as f:
+            content = f.read()
+        copies = {'gzip': gzip.compress(content, 9, mtime=0)}
+        if brotli is not None:
+            copies['br'] = brotli.compress(content, quality=11)
+        written = []
+        for encoding, suffix in cls.ENCODINGS:
+            if encoding in copies and len(copies[encoding]) < len(content) * cls.MIN_RATIO:
+                with open(path + suffix, 'wb') as f:
+                    f.write(copies[encoding])
+                written.append(encoding)
+        return written
+
+    @classmethod
+    def hashed_names(cls) -> set:
+        return set(getattr(staticfiles_storage, 'hashed_files', {}).values())
+
+    @classmethod
+    def accepted_encodings(cls, header: str) -> set:
+        accepted = set()
+        for part in header.split(','):
+            encoding, _, params = part.strip().partition(';')
+            # gzip;q=0 refuses gzip
+            if params.replace(' ', '') not in ['q=0', 'q=0.0', 'q=0.00', 'q=0.000']:
+                accepted.add(encoding.strip().lower())
+        return accepted
+
+    @classmethod
+    def serve(cls, request, name: str):
+        """
+        returns the response for a file under STATIC_ROOT, None if there's no such file
+        """
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except ValueError:
+            return None
+        if not os.path.isfile(path):
+            return None
+
+        accepted = cls.accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        content_type, _ = mimetypes.guess_type(path)
+        encoding = None
+        for candidate, suffix in cls.ENCODINGS:
+            if candidate in accepted and os.path.isfile(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+
+        stat = os.stat(path)
+        if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), stat.st_mtime, stat.st_size):
+            response = HttpResponseNotModified()
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=content_type or 'application/octet-stream')
+            response['Content-Length'] = stat.st_size
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        response['Cache-Control'] = cls.IMMUTABLE if name in cls.hashed_names() else cls.REVALIDATE
+        if name.endswith(cls.COMPRESSIBLE):
+            response['Vary'] = 'Accept-Encoding'
+        return response
+
+    @classmethod
+    def template_files(cls) -> list[str]:
+        files = []
+        for engine in settings.TEMPLATES:
+            for directory in engine.get('DIRS', []):
+                for root, _, names in os.walk(directory):
+                    files.extend(os.path.join(root, name) for name in sorted(names) if name.endswith('.html'))
+        return files
+
+    @classmethod
+    def check_templates(cls, app_configs=None, **kwargs) -> list:
+        """
+        a system check that fails on a template asking for a static file that wouldn't
+        be served hashed: a path written out instead of {% static %}, a {% static %} name
+        that isn't a static file, or one missing from the manifest once collectstatic has run
+        """
+        errors = []
+        literal = re.compile(cls.LITERAL.format(url=re.escape(settings.STATIC_URL)))
+        hashed = getattr(staticfiles_storage, 'hashed_files', {})
+        for path in cls.template_files():
+            with open(path, encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            for number, line in enumerate(lines, 1):
+                where = f'{os.path.relpath(path, settings.BASE_DIR)}:{number}'
+                for match in literal.finditer(line):
+                    errors.append(checks.Error(
+                        f'references {match.group(1) or match.group(2)} without {{% static %}}',
+                        hint='Use {% static %} so the hashed name is served with the far-future cache headers.',
+                        obj=where,
+                        id='wildthoughts.E001',
+                    ))
+                for match in cls.STATIC_TAG.finditer(line):
+                    name = match.group(2)
+                    if not finders.find(name):
+                        errors.append(checks.Error(
+                            f'references {name}, which is not a static file',
+                            obj=where,
+                            id='wildthoughts.E002',
+                        ))
+                    elif hashed and staticfiles_storage.hash_key(name) not in hashed:
+                        errors.append(checks.Error(
+                            f'references {name}, which is not in the manifest of STATIC_ROOT',
+                            hint='Run collectstatic.',
+                            obj=where,
+                            id='wildthoughts.E003',
+                        ))
+        return errors
+
+
+@checks.register('staticfiles')
+def check_static_references(app_configs=None, **kwargs):
+    return StaticAssets.check_templates(app_configs, **kwargs)
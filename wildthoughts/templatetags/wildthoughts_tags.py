@@ -1,5 +1,11 @@
 from django import template
-from ..models import UserProfile
+from django.conf import settings
+from django.template.loader import get_template
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+from ..fragments import CardCache
+from ..images import ImageDerivatives
+from ..votes import VoteBuffer, VoteStates
 
 
 register = template.Library()
@@ -30,38 +36,52 @@ def profile_picture(context):
     retrieve the user picture
     used in the dropdown profile in base/base.html
     """
-    request = context['request']
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        if profile.picture:
-            return profile.picture
-    except:
-        pass
+    profile = get_profile(context)
+    if profile and profile.picture:
+        return profile.picture
     return None
 
 @register.simple_tag(takes_context=True)
 def profile(context):
-    request = context['request']
-    try:
-        profile = UserProfile.objects.get(user=request.user)
-        return profile
-    except:
-        return None
+    return get_profile(context)
+
+def get_profile(context):
+    # resolved once per request, see: middleware ProfileMiddleware
+    request = context.get('request')
+    return getattr(request, 'profile', None) or None
     
+@register.filter
+def sort_label(sort_by):
+    # e.g. most_signed -> Most Signed
+    return sort_by.replace('_', ' ').title()
+
+@register.simple_tag
+def vote_states(instances, profile):
+    """
+    resolve the vote status of every instance on the page in one go
+    the result is then passed to render_vote for each card
+    """
+    return VoteStates.resolve(profile, instances)
+
 @register.inclusion_tag('wildthoughts/widget/vote_widget.html')
-def render_vote(category, instance, profile):
+def render_vote(category, instance, profile, states=None):
     upvote_class = NORMAL_CLASS
     upvote_status = 'upvote'
     downvote_class = NORMAL_CLASS
     downvote_status = 'downvote'
     
     if profile:
-        if instance.upvoted_by.filter(id=profile.id).exists():
+        if states is None:
+            # single instance, e.g. the discussion page header
+            states = VoteStates.resolve(profile, [instance])
+
+        state = states.get(instance.id)
+        if state == VoteStates.UPVOTED:
             upvote_class = UPVOTE_CLASS
             upvote_status = 'upvoted'
             downvote_class = NORMAL_CLASS
             downvote_status = 'downvote'
-        elif instance.downvoted_by.filter(id=profile.id).exists():
+        elif state == VoteStates.DOWNVOTED:
             upvote_class = NORMAL_CLASS
             upvote_status = 'upvote'
             downvote_class = DOWNVOTE_CLASS
@@ -74,7 +94,80 @@ def render_vote(category, instance, profile):
         'upvote_status': upvote_status,
         'downvote_status': downvote_status,
         'id': instance.id,
-        'votes':  instance.votes
+        # plus what the vote buffer hasn't written yet
+        'votes':  instance.votes + VoteBuffer.delta(type(instance), instance.id)
     }
 
-    return context_dict
\ No newline at end of file
+    return context_dict
+
+
+@register.simple_tag
+def card_cache(instances):
+    """
+    look up the cached cards of every instance on the page in one go
+    the result is then passed to card for each instance
+    """
+    return CardCache.fetch(instances)
+
+@register.simple_tag
+def vote_slot():
+    # where card puts the vote buttons of the viewer
+    return mark_safe(CardCache.SLOT)
+
+@register.tag
+def card(parser, token):
+    """
+    {% card cards instance [category profile states] %} ... {% endcard %}
+    render the block once per version of the instance, see: fragments CardCache
+    with a category, the vote buttons of render_vote replace the vote_slot of the block
+    """
+    bits = token.split_contents()
+    if len(bits) not in (3, 6):
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes the cards and an instance, then optionally category, profile and states")
+    nodelist = parser.parse(('endcard',))
+    parser.delete_first_token()
+    return CardNode(nodelist, [parser.compile_filter(bit) for bit in bits[1:]])
+
+
+class CardNode(template.Node):
+    def __init__(self, nodelist, arguments):
+        self.nodelist = nodelist
+        self.arguments = arguments
+
+    def render(self, context):
+        cards, instance, *vote = [argument.resolve(context) for argument in self.arguments]
+        html = cards.get(instance)
+        if html is None:
+            html = self.nodelist.render(context)
+            cards.set(instance, html)
+        if vote:
+            category, profile, states = vote
+            buttons = get_template('wildthoughts/widget/vote_widget.html').render(render_vote(category, instance, profile, states))
+            html = html.replace(CardCache.SLOT, buttons, 1)
+        return mark_safe(html)
+
+
+@register.simple_tag
+def picture(field, width, height, alt='', css='', **attributes):
+    """
+    an <img> of an uploaded picture shown at width x height, lazily loaded, using
+    the resized WebP copies with a fallback when they exist, see: images ImageDerivatives
+    other keyword arguments are added as attributes, with - for _
+    e.g. {% picture animal.picture 150 90 alt=animal.name css="rounded m-3" data_toggle="popover-hover" %}
+    """
+    name = str(field)
+    extra = format_html_join('', ' {}="{}"', ((key.replace('_', '-'), value) for key, value in attributes.items()))
+    sources = ImageDerivatives.sources(name, width, height) if ImageDerivatives.enabled() else {}
+    fallback = ImageDerivatives.extension(name)
+    if fallback not in sources:
+        return format_html('<img src="{}{}" class="{}" width="{}" height="{}" alt="{}" loading="lazy"{}>',
+                           settings.MEDIA_URL, name, css, width, height, alt, extra)
+
+    def srcset(candidates):
+        return format_html_join(', ', '{}{} {}x', ((settings.MEDIA_URL, path, density) for path, density in candidates))
+
+    webp = ''
+    if 'webp' in sources:
+        webp = format_html('<source type="image/webp" srcset="{}">', srcset(sources['webp']))
+    return format_html('<picture>{}<img src="{}{}" srcset="{}" class="{}" width="{}" height="{}" alt="{}" loading="lazy" decoding="async"{}></picture>',
+                       webp, settings.MEDIA_URL, sources[fallback][0][0], srcset(sources[fallback]), css, width, height, alt, extra)
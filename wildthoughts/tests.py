@@ -1,9 +1,56 @@
+import asyncio
+import base64
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock, skipIf
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, F, Max, Min
 from django.forms import ValidationError
-from django.test import TestCase
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.models import User
+from django.template import Context, Template
 from django.template.defaultfilters import slugify
-from wildthoughts.models import Animal, Discussion, Petition, UserList, UserProfile
+from django.templatetags.static import static
+from wildthoughts.asgi import ASGIHandler
+from wildthoughts.counters import ProfileCounters
+from wildthoughts.fragments import CardCache
+from wildthoughts import hot
+from wildthoughts.hot import HotScores
+from wildthoughts.images import ImageDerivatives
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.metrics import Metrics
+from wildthoughts.models import Animal, Comment, Discussion, Petition, UserList, UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.pagination import CursorPaginator
+from wildthoughts.search import PythonBackend, SearchIndex, SuggestIndex
+from wildthoughts.signatures import SignatureService
+from wildthoughts.sorter import Sorter
+from wildthoughts.static_assets import StaticAssets
+from wildthoughts.templatetags.wildthoughts_tags import render_vote
+from wildthoughts.votes import VoteBuffer, VoteService, VoteStates
+from util.animal_downloader import AnimalDownloader
+from util.asgi_server import ASGIServer
+from util.bulk_loader import BulkLoader
+from util.download_cache import DownloadCache
+from util.fetcher import Fetcher
+from util.fixture_server import FixtureServer
+from util.load_test import LoadTest, PooledWSGIServer
+from util.profile_downloader import ProfileDownloader
+from util.synthetic import SyntheticDataset
 
 # Create your tests here.
 # Models
@@ -84,6 +131,9 @@ class PetitionMethodTests(TestCase):
 
 # Views
 class IndexViewTests(TestCase):
+    def setUp(self):
+        Leaderboard.clear()
+
     def test_view_with_no_animals(self):
         response = self.client.get(reverse('wildthoughts:index'))
         self.assertEqual(response.status_code, 200)
@@ -107,6 +157,17 @@ class AnimalViewTests(TestCase):
         self.assertContains(response, 'There are no discussions yet...')
         self.assertQuerysetEqual(response.context['discussions'], [])
 
+    def test_default_pictures_have_alt_text(self):
+        response = self.client.get(reverse('wildthoughts:animal', kwargs={'animal_name_slug': self.animal.slug}))
+        self.assertContains(response, 'width="615" height="410" alt="Lion\'s image">', html=False)
+        response = self.client.get(reverse('wildthoughts:animals'))
+        self.assertContains(response, 'alt="Lion\'s image">', html=False)
+
+        Petition.objects.create(title='Save the Lions', author=self.animal.author)
+        response = self.client.get(reverse('wildthoughts:petitions'))
+        self.assertContains(response, 'alt="Save the Lions\'s image">', html=False)
+        self.assertNotContains(response, '|add:')
+
 
 class ListAnimalsViewTests(TestCase):
     def test_view_with_no_animals(self):
@@ -143,10 +204,1583 @@ class ProfileViewTests(TestCase):
         self.assertContains(response, 'There are no animals yet...')
         self.assertQuerysetEqual(response.context['animals'], [])
 
+    def test_tabs_are_paginated(self):
+        for i in range(25):
+            Animal.objects.create(name=f'Animal {i}', author=self.profile)
+        url = reverse('wildthoughts:profile', kwargs={'username': self.profile.user.username})
+        response = self.client.get(url, {'tab': 'animals'})
+        self.assertEqual(len(response.context['results']), 20)
+        self.assertContains(response, 'Page 1 of 2')
+        self.assertContains(response, '&amp;tab=animals')
+        response = self.client.get(url, {'tab': 'animals', 'page': 2})
+        self.assertEqual(len(response.context['results']), 5)
+        response = self.client.get(url, {'tab': 'animals', 'paginate': 'cursor'})
+        response = self.client.get(url, {'tab': 'animals', 'cursor': response.context['results'].next_cursor})
+        self.assertEqual(len(response.context['results']), 5)
+
 
 class ListProfileViewTests(TestCase):
     def test_view_with_no_profiles(self):
         response = self.client.get(reverse('wildthoughts:profiles'))
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, 'There are no profiles yet...')
-        self.assertQuerysetEqual(response.context['profiles'], [])
\ No newline at end of file
+        self.assertQuerysetEqual(response.context['profiles'], [])
+
+class VoteStatesTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=user)
+        self.client.force_login(user)
+
+    def create_animals(self, count):
+        for i in range(count):
+            animal = Animal.objects.create(name=f'Animal {i}', author=self.profile)
+            if i % 2:
+                animal.upvoted_by.add(self.profile)
+            else:
+                animal.downvoted_by.add(self.profile)
+
+    def count_vote_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('wildthoughts:animals'))
+        self.assertEqual(response.status_code, 200)
+        return len([query for query in context.captured_queries if 'voted_by' in query['sql']])
+
+    def test_vote_queries_do_not_grow_with_page_size(self):
+        self.create_animals(2)
+        small_page = self.count_vote_queries()
+        for i in range(2, 20):
+            Animal.objects.create(name=f'Animal {i}', author=self.profile).upvoted_by.add(self.profile)
+        full_page = self.count_vote_queries()
+        self.assertEqual(small_page, 2)
+        self.assertEqual(full_page, 2)
+
+    def test_resolve_vote_states(self):
+        self.create_animals(4)
+        states = VoteStates.resolve(self.profile, Animal.objects.order_by('name'))
+        self.assertEqual(states[Animal.objects.get(name='Animal 0').id], VoteStates.DOWNVOTED)
+        self.assertEqual(states[Animal.objects.get(name='Animal 1').id], VoteStates.UPVOTED)
+        self.assertEqual(VoteStates.resolve(None, Animal.objects.all()), {})
+
+    def test_rendered_buttons_reflect_vote_state(self):
+        self.create_animals(2)
+        response = self.client.get(reverse('wildthoughts:animals'))
+        self.assertContains(response, 'data-status="upvoted"', count=1)
+        self.assertContains(response, 'data-status="downvoted"', count=1)
+
+
+class VoteServiceTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=user)
+        self.animal = Animal.objects.create(name='Lion', author=self.profile)
+
+    def vote(self, status):
+        return VoteService.vote(self.profile, 'animals', self.animal.id, status)
+
+    def test_transitions(self):
+        self.assertEqual(self.vote('upvote'), 1)
+        self.assertEqual(self.vote('upvote'), 1)
+        self.assertEqual(self.vote('downvote'), -1)
+        self.assertFalse(self.animal.upvoted_by.exists())
+        self.assertEqual(self.vote('downvoted'), 0)
+        self.assertFalse(self.animal.downvoted_by.exists())
+        self.assertEqual(self.vote('upvote'), 1)
+        self.assertEqual(self.vote('upvoted'), 0)
+
+    def test_query_count(self):
+        # savepoints, the through-table delete and insert, the locked read,
+        # one update of the votes and hot score and one of the author's counter
+        with self.assertNumQueries(9):
+            self.assertEqual(self.vote('upvote'), 1)
+        self.animal.refresh_from_db()
+        self.assertEqual(self.animal.hot, HotScores.score(1, self.animal.date))
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.votes_received, 1)
+        # a repeated vote moves nothing, the failed insert is rolled back and only the count is read
+        with self.assertNumQueries(8):
+            self.assertEqual(self.vote('upvote'), 1)
+
+    def test_missing_instance(self):
+        with self.assertRaises(Animal.DoesNotExist):
+            VoteService.vote(self.profile, 'animals', self.animal.id + 1, 'upvote')
+        self.assertFalse(Animal.upvoted_by.through.objects.exists())
+
+    def test_reconcile_votes(self):
+        self.animal.upvoted_by.add(self.profile)
+        Animal.objects.filter(id=self.animal.id).update(votes=42)
+        call_command('reconcile_votes', stdout=StringIO())
+        self.animal.refresh_from_db()
+        self.assertEqual(self.animal.votes, 1)
+
+
+@override_settings(VOTE_BUFFER=True, VOTE_BUFFER_EVENTS=3, VOTE_BUFFER_INTERVAL=60000)
+class VoteBufferTests(TestCase):
+    def setUp(self):
+        self.author = UserProfile.objects.create(user=User.objects.create(username='author'))
+        self.animal = Animal.objects.create(name='Lion', author=self.author)
+        self.profiles = [UserProfile.objects.create(user=User.objects.create(username=f'voter{i}')) for i in range(3)]
+        self.addCleanup(VoteBuffer.clear)
+
+    def votes(self):
+        return Animal.objects.values_list('votes', flat=True).get(id=self.animal.id)
+
+    def test_coalesced_until_the_batch_is_full(self):
+        self.assertEqual(VoteService.vote(self.profiles[0], 'animals', self.animal.id, 'upvote'), 1)
+        self.assertEqual(VoteService.vote(self.profiles[1], 'animals', self.animal.id, 'upvote'), 2)
+        # the voters are recorded, the column isn't written yet
+        self.assertEqual(self.animal.upvoted_by.count(), 2)
+        self.assertEqual(self.votes(), 0)
+        self.assertEqual(VoteBuffer.delta(Animal, self.animal.id), 2)
+
+        # the third vote fills the batch
+        self.assertEqual(VoteService.vote(self.profiles[2], 'animals', self.animal.id, 'downvote'), 1)
+        self.assertEqual(self.votes(), 1)
+        self.assertEqual(VoteBuffer.delta(Animal, self.animal.id), 0)
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.votes_received, 1)
+
+    def test_widget_adds_the_pending_delta(self):
+        VoteService.vote(self.profiles[0], 'animals', self.animal.id, 'upvote')
+        self.animal.refresh_from_db()
+        self.assertEqual(render_vote('animals', self.animal, None)['votes'], 1)
+
+    def test_reconcile_writes_the_buffer_first(self):
+        VoteService.vote(self.profiles[0], 'animals', self.animal.id, 'upvote')
+        self.assertEqual(VoteService.reconcile(), {'animals': 0, 'discussions': 0, 'comments': 0, 'lists': 0})
+        self.assertEqual(self.votes(), 1)
+
+    def test_missing_instance(self):
+        with self.assertRaises(Animal.DoesNotExist):
+            VoteService.vote(self.profiles[0], 'animals', self.animal.id + 1, 'upvote')
+        self.assertEqual(VoteBuffer.delta(Animal, self.animal.id + 1), 0)
+
+    def test_failed_batch_is_kept(self):
+        VoteService.vote(self.profiles[0], 'animals', self.animal.id, 'upvote')
+        with mock.patch.object(ProfileCounters, 'voted', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('wildthoughts.votes', 'ERROR'):
+            self.assertEqual(VoteBuffer.flush(), 0)
+        self.assertEqual(VoteBuffer.delta(Animal, self.animal.id), 1)
+        # retried by the timer, not only by the next vote
+        self.assertIsNotNone(VoteBuffer.timer)
+        self.assertEqual(VoteBuffer.flush(), 1)
+        self.assertEqual(self.votes(), 1)
+
+
+class VoteConcurrencyTests(TransactionTestCase):
+    VOTERS = 12
+
+    def test_concurrent_votes_stay_exact(self):
+        author = UserProfile.objects.create(user=User.objects.create(username='author'))
+        animal = Animal.objects.create(name='Lion', author=author)
+        users = [User.objects.create(username=f'voter{i}') for i in range(self.VOTERS)]
+        for user in users:
+            UserProfile.objects.create(user=user)
+
+        def hammer(user):
+            client = Client()
+            client.force_login(user)
+            responses = []
+            try:
+                for status in ['upvote', 'downvote', 'upvote', 'upvoted', 'upvote']:
+                    data = {'category': 'animals', 'id': animal.id, 'status': status}
+                    responses.append(client.get(reverse('wildthoughts:vote'), data).json()['status'])
+            finally:
+                connection.close()
+            return responses
+
+        with ThreadPoolExecutor(max_workers=self.VOTERS) as executor:
+            results = list(executor.map(hammer, users))
+
+        for responses in results:
+            self.assertEqual(responses, ['success'] * 5)
+        animal.refresh_from_db()
+        self.assertEqual(animal.votes, self.VOTERS)
+        self.assertEqual(animal.upvoted_by.count(), self.VOTERS)
+        self.assertEqual(animal.downvoted_by.count(), 0)
+
+
+class SignatureServiceTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=user)
+        self.petition = Petition.objects.create(title='Save the Lions', author=self.profile, goal=1)
+
+    def test_sign_once(self):
+        self.assertEqual(SignatureService.sign(self.profile, self.petition.id), SignatureService.SIGNED)
+        # the goal of 1 is reached, the signer is still told they signed
+        self.assertEqual(SignatureService.sign(self.profile, self.petition.id), SignatureService.ALREADY_SIGNED)
+        self.petition.refresh_from_db()
+        self.assertEqual(self.petition.signatures, 1)
+        self.assertEqual(self.petition.signed_by.count(), 1)
+
+    def test_goal_reached(self):
+        SignatureService.sign(self.profile, self.petition.id)
+        other = UserProfile.objects.create(user=User.objects.create(username='other'))
+        self.assertEqual(SignatureService.sign(other, self.petition.id), SignatureService.GOAL_REACHED)
+        self.assertEqual(self.petition.signed_by.count(), 1)
+
+    def test_already_signed_does_not_count(self):
+        Petition.objects.filter(id=self.petition.id).update(goal=10)
+        SignatureService.sign(self.profile, self.petition.id)
+        self.assertEqual(SignatureService.sign(self.profile, self.petition.id), SignatureService.ALREADY_SIGNED)
+        self.petition.refresh_from_db()
+        self.assertEqual(self.petition.signatures, 1)
+
+    def test_missing_petition(self):
+        with self.assertRaises(Petition.DoesNotExist):
+            SignatureService.sign(self.profile, self.petition.id + 1)
+
+
+class SignatureConcurrencyTests(TransactionTestCase):
+    SIGNERS = 16
+
+    def setUp(self):
+        self.author = UserProfile.objects.create(user=User.objects.create(username='author'))
+        self.users = [User.objects.create(username=f'signer{i}') for i in range(self.SIGNERS)]
+        self.profiles = [UserProfile.objects.create(user=user) for user in self.users]
+
+    def sign_all(self, petitions):
+        def sign(args):
+            profile, petition = args
+            try:
+                return SignatureService.sign(profile, petition.id)
+            finally:
+                connection.close()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.SIGNERS) as executor:
+            results = list(executor.map(sign, zip(self.profiles, petitions)))
+        return results, time.perf_counter() - start
+
+    def test_concurrent_signers_are_counted_exactly(self):
+        petition = Petition.objects.create(title='Save the Lions', author=self.author, goal=1000)
+
+        def sign(user):
+            client = Client()
+            client.force_login(user)
+            try:
+                url = reverse('wildthoughts:sign_petition')
+                return [client.get(url, {'petition_id': petition.id}).json()['status'] for i in range(2)]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=self.SIGNERS) as executor:
+            results = list(executor.map(sign, self.users))
+
+        self.assertEqual(results, [['success', 'signed']] * self.SIGNERS)
+        petition.refresh_from_db()
+        self.assertEqual(petition.signatures, self.SIGNERS)
+        self.assertEqual(petition.signed_by.count(), self.SIGNERS)
+
+    def test_goal_is_never_exceeded(self):
+        petition = Petition.objects.create(title='Save the Lions', author=self.author, goal=5)
+        results, elapsed = self.sign_all([petition] * self.SIGNERS)
+        self.assertEqual(results.count(SignatureService.SIGNED), 5)
+        self.assertEqual(results.count(SignatureService.GOAL_REACHED), self.SIGNERS - 5)
+        petition.refresh_from_db()
+        self.assertEqual(petition.signatures, 5)
+
+    def test_hot_petition_throughput(self):
+        # one hot petition should not be much slower than the same load spread over many
+        hot = Petition.objects.create(title='Hot', author=self.author, goal=1000)
+        spread = [Petition.objects.create(title=f'Spread {i}', author=self.author, goal=1000) for i in range(self.SIGNERS)]
+        hot_results, hot_elapsed = self.sign_all([hot] * self.SIGNERS)
+        spread_results, spread_elapsed = self.sign_all(spread)
+        self.assertEqual(hot_results, [SignatureService.SIGNED] * self.SIGNERS)
+        self.assertEqual(spread_results, [SignatureService.SIGNED] * self.SIGNERS)
+        self.assertLess(hot_elapsed, spread_elapsed * 5 + 1)
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=user)
+        self.lion = Animal.objects.create(name='Lion', author=self.profile, description='A big cat')
+        self.cat = Animal.objects.create(name='Cat', author=self.profile, description='Smaller than a lion')
+        Discussion.objects.create(title='Lions are overrated', author=self.profile, animal=self.lion)
+
+    def search(self, category, text):
+        return list(SearchIndex.search(category, text)[0:20])
+
+    def test_ranked_by_relevance(self):
+        self.assertEqual(self.search('Animals', 'lion'), [self.lion, self.cat])
+        self.assertEqual(self.search('Animals', 'li'), [self.lion, self.cat])
+        self.assertEqual(self.search('Animals', 'big cat'), [self.lion])
+        self.assertEqual([d.title for d in self.search('Discussions', 'lion')], ['Lions are overrated'])
+        self.assertEqual(self.search('Profiles', 'test'), [self.profile])
+
+    def test_index_follows_save_and_delete(self):
+        self.lion.name = 'Tiger'
+        self.lion.save()
+        self.assertEqual(self.search('Animals', 'tiger'), [self.lion])
+        self.cat.delete()
+        self.assertEqual(self.search('Animals', 'lion'), [])
+
+    def test_login_leaves_the_index(self):
+        with mock.patch.object(SearchIndex, 'update') as update, mock.patch.object(SuggestIndex, 'update') as suggest:
+            self.client.force_login(self.profile.user)
+        update.assert_not_called()
+        suggest.assert_not_called()
+        self.profile.user.username = 'renamed'
+        self.profile.user.save()
+        self.assertEqual(self.search('Profiles', 'renamed'), [self.profile])
+
+    @override_settings(SEARCH_BACKEND='python')
+    def test_python_backend(self):
+        self.addCleanup(setattr, PythonBackend, 'loaded', False)
+        self.addCleanup(PythonBackend.clear)
+        self.assertEqual(SearchIndex.rebuild(), 4)
+        self.assertEqual(self.search('Animals', 'lion'), [self.lion, self.cat])
+        self.assertEqual(self.search('Animals', 'big cat'), [self.lion])
+        self.cat.delete()
+        self.assertEqual(self.search('Animals', 'lion'), [self.lion])
+
+    def test_search_view_is_paginated(self):
+        for i in range(25):
+            Animal.objects.create(name=f'Zebra {i}', author=self.profile)
+        response = self.client.get(reverse('wildthoughts:search'), {'searched': 'zebra', 'category': 'Animals'})
+        self.assertEqual(len(response.context['results']), 20)
+        self.assertContains(response, 'Page 1 of 2')
+        response = self.client.get(reverse('wildthoughts:search'), {'searched': 'zebra', 'category': 'Animals', 'page': 2})
+        self.assertEqual(len(response.context['results']), 5)
+
+
+class SuggestIndexTests(TestCase):
+    def setUp(self):
+        SuggestIndex.clear()
+        self.addCleanup(SuggestIndex.clear)
+        user = User.objects.create(username='lionfan')
+        self.profile = UserProfile.objects.create(user=user)
+        self.lion = Animal.objects.create(name='African Lion', author=self.profile)
+        Animal.objects.create(name='Lynx', author=self.profile)
+
+    def suggest(self, prefix, category=None):
+        return [result['text'] for result in SuggestIndex.suggest(prefix, category)]
+
+    def test_prefix_and_word_prefix(self):
+        self.assertEqual(self.suggest('afr', 'Animals'), ['African Lion'])
+        self.assertEqual(self.suggest('li', 'Animals'), ['African Lion'])
+        self.assertEqual(self.suggest('l', 'Animals'), ['African Lion', 'Lynx'])
+        self.assertEqual(self.suggest('li'), ['African Lion', 'lionfan'])
+
+    def test_endpoint_does_not_query_database(self):
+        url = reverse('wildthoughts:suggest')
+        self.client.get(url, {'q': 'ly'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': 'lyn', 'category': 'Animals'})
+        self.assertEqual(response.json()['results'][0]['url'], reverse('wildthoughts:animal', args=['lynx']))
+
+
+class SuggestIndexCommitTests(TransactionTestCase):
+    """
+    the index follows the commits, a TestCase never commits
+    """
+    def setUp(self):
+        SuggestIndex.clear()
+        self.addCleanup(SuggestIndex.clear)
+        self.profile = UserProfile.objects.create(user=User.objects.create(username='lionfan'))
+        self.lion = Animal.objects.create(name='African Lion', author=self.profile)
+
+    def suggest(self, prefix, category='Animals'):
+        return [result['text'] for result in SuggestIndex.suggest(prefix, category)]
+
+    def test_updated_from_signals(self):
+        self.suggest('li')
+        self.lion.name = 'Tiger'
+        self.lion.save()
+        self.assertEqual(self.suggest('li'), [])
+        self.assertEqual(self.suggest('tig'), ['Tiger'])
+        self.lion.delete()
+        self.assertEqual(self.suggest('tig'), [])
+
+    def test_a_save_only_evicts_its_prefixes(self):
+        self.assertEqual(self.suggest('afr'), ['African Lion'])
+        self.assertEqual(self.suggest('ti'), [])
+        self.assertEqual(self.suggest('ti', 'Unknown'), [])
+        Animal.objects.create(name='Tiger', author=self.profile)
+        self.assertIn(('Animals', 'afr'), SuggestIndex.cache)
+        self.assertNotIn(('Animals', 'ti'), SuggestIndex.cache)
+        self.assertNotIn(('Unknown', 'ti'), SuggestIndex.cache)
+        self.assertEqual(self.suggest('ti'), ['Tiger'])
+
+    def test_rolled_back_save_is_not_suggested(self):
+        self.suggest('li')
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Animal.objects.create(name='Lynx', author=self.profile)
+            self.assertEqual(self.suggest('ly'), [])
+            raise RuntimeError
+        self.assertEqual(self.suggest('ly'), [])
+
+    def test_reloaded_in_the_background(self):
+        self.suggest('li')
+        # a save of another process, no signal reaches this one
+        Animal.objects.filter(id=self.lion.id).update(name='Tiger')
+        with override_settings(SUGGEST_RELOAD_SECONDS=0):
+            # the stale index is served while the tables are read again
+            self.assertEqual(self.suggest('li'), ['African Lion'])
+            SuggestIndex.reloader.join()
+        self.assertEqual(self.suggest('tig'), ['Tiger'])
+
+    def test_changes_during_a_reload_are_kept(self):
+        self.suggest('li')
+        read = SuggestIndex.read
+
+        def read_then_save():
+            tables = read()
+            Animal.objects.create(name='Lynx', author=self.profile)
+            return tables
+
+        with mock.patch.object(SuggestIndex, 'read', side_effect=read_then_save):
+            SuggestIndex.reload()
+        self.assertEqual(self.suggest('ly'), ['Lynx'])
+
+
+class QueryBudgetTests(TestCase):
+    """
+    every page costs a fixed number of queries whatever its size,
+    so widgets must not trigger lazy queries per row
+    """
+    def setUp(self):
+        user = User.objects.create(username='viewer')
+        self.viewer = UserProfile.objects.create(user=user)
+        self.client.force_login(user)
+        self.created = 0
+
+    def populate(self, count):
+        for i in range(self.created, self.created + count):
+            author = UserProfile.objects.create(user=User.objects.create(username=f'author{i}'), picture='profile_images/1.jpg')
+            animal = Animal.objects.create(name=f'Animal {i}', author=author, picture='animal_images/ant-1-340x200.jpg')
+            animal.upvoted_by.add(self.viewer)
+            discussion = Discussion.objects.create(title=f'Discussion {i}', author=author, animal=animal)
+            discussion.downvoted_by.add(self.viewer)
+            self.discussion = Discussion.objects.order_by('id').first()
+            Comment.objects.create(author=author, discussion=self.discussion, content=f'Comment {i}')
+            Comment.objects.create(author=self.viewer, discussion=discussion, content=f'Reply {i}')
+            user_list = UserList.objects.create(title=f'List {i}', author=author)
+            user_list.animals.add(animal)
+            Petition.objects.create(title=f'Petition {i}', author=author)
+            # content of the viewer, listed on the profile tabs
+            Animal.objects.create(name=f'Viewer animal {i}', author=self.viewer).downvoted_by.add(self.viewer)
+            Discussion.objects.create(title=f'Viewer discussion {i}', author=self.viewer, animal=animal)
+            UserList.objects.create(title=f'Viewer list {i}', author=self.viewer).animals.add(animal)
+            Petition.objects.create(title=f'Viewer petition {i}', author=self.viewer)
+        self.created += count
+
+    def assertQueryBudget(self, budget, url, data=None):
+        for count in [2, 18]:
+            self.populate(count)
+            with self.assertNumQueries(budget):
+                response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+
+    def test_list_animals(self):
+        self.assertQueryBudget(7, reverse('wildthoughts:animals'))
+
+    def test_list_discussions(self):
+        self.assertQueryBudget(7, reverse('wildthoughts:discussions'))
+
+    def test_list_petitions(self):
+        self.assertQueryBudget(5, reverse('wildthoughts:petitions'))
+
+    def test_list_user_lists(self):
+        self.assertQueryBudget(8, reverse('wildthoughts:lists'))
+
+    def test_profile_tabs(self):
+        url = reverse('wildthoughts:profile', kwargs={'username': 'viewer'})
+        for tab, budget in [('animals', 7), ('discussions', 7), ('comments', 7), ('lists', 8), ('petitions', 5)]:
+            with self.subTest(tab=tab):
+                self.assertQueryBudget(budget, url, {'tab': tab})
+
+    def test_discussion(self):
+        self.populate(1)
+        url = reverse('wildthoughts:discussion', kwargs={'discussion_slug': self.discussion.slug})
+        self.assertQueryBudget(9, url)
+
+
+class ProfileMemoizationTests(TestCase):
+    """
+    the profile of the logged in user is looked up once per request
+    see: middleware ProfileMiddleware
+    """
+    def setUp(self):
+        Leaderboard.clear()
+        user = User.objects.create(username='viewer')
+        self.profile = UserProfile.objects.create(user=user, picture='profile_images/1.jpg')
+        self.client.force_login(user)
+        animal = Animal.objects.create(name='Lion', author=self.profile)
+        self.discussion = Discussion.objects.create(title='Roar', author=self.profile, animal=animal)
+        Comment.objects.create(author=self.profile, discussion=self.discussion, content='Hello')
+        self.user_list = UserList.objects.create(title='Cats', author=self.profile)
+        self.user_list.animals.add(animal)
+        self.petition = Petition.objects.create(title='Save', author=self.profile)
+
+    def profile_lookups(self, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        return [query for query in context.captured_queries
+                if 'WHERE "wildthoughts_userprofile"."user_id" =' in query['sql']]
+
+    def test_pages_look_up_profile_once(self):
+        urls = [
+            reverse('wildthoughts:index'),
+            reverse('wildthoughts:animals'),
+            reverse('wildthoughts:animal', kwargs={'animal_name_slug': 'lion'}),
+            reverse('wildthoughts:discussions'),
+            reverse('wildthoughts:discussion', kwargs={'discussion_slug': self.discussion.slug}),
+            reverse('wildthoughts:lists'),
+            reverse('wildthoughts:list', kwargs={'user_list_slug': self.user_list.slug}),
+            reverse('wildthoughts:petitions'),
+            reverse('wildthoughts:petition', kwargs={'petition_slug': self.petition.slug}),
+            reverse('wildthoughts:profiles'),
+            reverse('wildthoughts:edit_profile'),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(len(self.profile_lookups(url)), 1)
+
+    def test_own_profile_page(self):
+        url = reverse('wildthoughts:profile', kwargs={'username': 'viewer'})
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        profile_queries = [query for query in context.captured_queries if 'FROM "wildthoughts_userprofile"' in query['sql']]
+        self.assertEqual(len(profile_queries), 1)
+
+    def test_anonymous_pages_skip_lookup(self):
+        self.client.logout()
+        self.assertEqual(self.profile_lookups(reverse('wildthoughts:animals')), [])
+
+    def test_vote_uses_request_profile(self):
+        data = {'category': 'animals', 'id': self.discussion.animal_id, 'status': 'upvote'}
+        self.assertEqual(len(self.profile_lookups(reverse('wildthoughts:vote'), data)), 1)
+        self.assertEqual(self.discussion.animal.upvoted_by.get(), self.profile)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=user)
+        for i in range(45):
+            # plenty of ties on votes to check id breaks them
+            Animal.objects.create(name=f'Animal {i:02}', author=self.profile, votes=i % 4)
+
+    def walk(self, sort_by):
+        names = []
+        data = {'sort_by': sort_by, 'paginate': 'cursor'}
+        pages = []
+        while True:
+            response = self.client.get(reverse('wildthoughts:animals'), data)
+            page = response.context['animals']
+            pages.append(page)
+            names.extend(animal.name for animal in page)
+            if not page.has_next():
+                return names, pages
+            data = {'sort_by': sort_by, 'cursor': page.next_cursor}
+
+    def test_every_sort_option(self):
+        for sort_by in ['name', 'overrated', 'underrated', 'newest', 'oldest']:
+            with self.subTest(sort_by=sort_by):
+                sort_by, expected = Sorter.sort_model(sort_by, Animal)
+                names, pages = self.walk(sort_by)
+                self.assertEqual(names, [animal.name for animal in expected])
+                self.assertEqual([len(page) for page in pages], [20, 20, 5])
+
+    def test_previous_page(self):
+        names, pages = self.walk('overrated')
+        paginator = CursorPaginator(Sorter.sort_model('overrated', Animal)[1], 20)
+        previous = paginator.get_page(pages[2].previous_cursor)
+        self.assertEqual(list(previous), list(pages[1]))
+        self.assertTrue(previous.has_previous())
+        first = paginator.get_page(previous.previous_cursor)
+        self.assertEqual(list(first), list(pages[0]))
+        self.assertFalse(first.has_previous())
+
+    def test_deep_pages_do_not_count(self):
+        names, pages = self.walk('overrated')
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('wildthoughts:animals'), {'sort_by': 'overrated', 'cursor': pages[1].next_cursor})
+        self.assertFalse([query for query in context.captured_queries if 'COUNT' in query['sql']])
+
+    def test_invalid_cursor_restarts(self):
+        response = self.client.get(reverse('wildthoughts:animals'), {'sort_by': 'name', 'cursor': 'not a cursor'})
+        self.assertEqual(response.context['animals'][0].name, 'Animal 00')
+
+    def test_wrongly_typed_cursor_restarts(self):
+        first = Sorter.sort_model('newest', Animal)[1][0]
+        for value in ['abc', 5, None, [1]]:
+            with self.subTest(value=value):
+                cursor = base64.urlsafe_b64encode(json.dumps(['date', value, 1, 'next']).encode()).decode()
+                response = self.client.get(reverse('wildthoughts:animals'), {'sort_by': 'newest', 'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.context['animals'][0], first)
+
+
+class SortIndexTests(TestCase):
+    def test_sorts_use_indexes(self):
+        out = StringIO()
+        call_command('benchmark_sorter', scale=50, repeat=1, stdout=out)
+        # every "after" section up to the next "before" holds one plan with the indexes
+        after = [section.split('  before:')[0] for section in out.getvalue().split('  after:')[1:]]
+        self.assertTrue(after)
+        for plan in after:
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_benchmark_rolls_back(self):
+        call_command('benchmark_sorter', scale=50, repeat=1, stdout=StringIO())
+        self.assertFalse(Animal.objects.exists())
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'animal_votes_idx'")
+            self.assertTrue(cursor.fetchall())
+
+
+@override_settings(HOT_DECAY_DAYS=1)
+class HotScoresTests(TestCase):
+    def setUp(self):
+        self.author = UserProfile.objects.create(user=User.objects.create(username='author'))
+        self.voter = UserProfile.objects.create(user=User.objects.create(username='voter'))
+        self.today = datetime.date.today()
+
+    def stored(self, animal: Animal) -> float:
+        return Animal.objects.values_list('hot', flat=True).get(id=animal.id)
+
+    def test_a_day_newer_needs_ten_times_fewer_votes(self):
+        yesterday = self.today - datetime.timedelta(days=1)
+        self.assertAlmostEqual(HotScores.score(100, yesterday), HotScores.score(10, self.today))
+        self.assertAlmostEqual(HotScores.score(-100, yesterday) + 2, HotScores.score(0, yesterday))
+        self.assertEqual(HotScores.score(1, self.today), HotScores.score(0, self.today))
+
+    def test_created_rows_are_scored(self):
+        animal = Animal.objects.create(name='Lion', author=self.author)
+        self.assertEqual(self.stored(animal), HotScores.score(0, self.today))
+
+    def test_vote_rewrites_the_score(self):
+        animal = Animal.objects.create(name='Lion', author=self.author)
+        Animal.objects.filter(id=animal.id).update(votes=9)
+        VoteService.vote(self.voter, 'animals', animal.id, 'upvote')
+        self.assertEqual(self.stored(animal), HotScores.score(10, self.today))
+
+    @override_settings(VOTE_BUFFER=True, VOTE_BUFFER_EVENTS=100, VOTE_BUFFER_INTERVAL=60000)
+    def test_buffered_vote_is_scored_on_flush(self):
+        self.addCleanup(VoteBuffer.clear)
+        animal = Animal.objects.create(name='Lion', author=self.author)
+        Animal.objects.filter(id=animal.id).update(votes=9)
+        VoteService.vote(self.voter, 'animals', animal.id, 'upvote')
+        self.assertEqual(self.stored(animal), HotScores.score(0, self.today))
+        VoteBuffer.flush()
+        self.assertEqual(self.stored(animal), HotScores.score(10, self.today))
+
+    def test_rebuild_writes_the_changed_rows(self):
+        lion = Animal.objects.create(name='Lion', author=self.author)
+        Animal.objects.create(name='Tiger', author=self.author)
+        # like bulk_create or reconcile_votes, no signal is sent
+        Animal.objects.filter(id=lion.id).update(votes=1000)
+
+        self.assertEqual(HotScores.rebuild(Animal, dry_run=True), 1)
+        self.assertEqual(self.stored(lion), HotScores.score(0, self.today))
+        self.assertEqual(HotScores.rebuild(Animal), 1)
+        self.assertEqual(self.stored(lion), HotScores.score(1000, self.today))
+        self.assertEqual(HotScores.rebuild(Animal), 0)
+
+    @skipIf(hot.numpy is None, 'numpy is not installed')
+    def test_vectorised_scores_match(self):
+        votes = [-500, -1, 0, 1, 7, 123456]
+        dates = [self.today - datetime.timedelta(days=days) for days in [0, 3, 30, 300, 3000, 1]]
+        for vectorised, score in zip(HotScores.scores(votes, dates), map(HotScores.score, votes, dates)):
+            self.assertAlmostEqual(vectorised, score)
+
+    def test_sort_by_hot(self):
+        old = Animal.objects.create(name='Old', author=self.author)
+        new = Animal.objects.create(name='New', author=self.author)
+        Animal.objects.filter(id=old.id).update(votes=50, date=self.today - datetime.timedelta(days=1))
+        Animal.objects.filter(id=new.id).update(votes=10)
+        HotScores.rebuild(Animal)
+        self.assertEqual(list(Sorter.sort_model('hot', Animal)[1]), [new, old])
+
+        Animal.objects.filter(id=old.id).update(votes=500)
+        HotScores.rebuild(Animal)
+        self.assertEqual(list(Sorter.sort_model('hot', Animal)[1]), [old, new])
+
+        response = self.client.get(reverse('wildthoughts:animals'), {'sort_by': 'hot'})
+        self.assertEqual(response.context['sort_by'], 'hot')
+        self.assertEqual(list(response.context['animals']), [old, new])
+
+    def test_hot_falls_back_without_a_score(self):
+        self.assertEqual(Sorter.validate('hot', Comment), 'newest')
+        self.assertEqual(Sorter.validate('hot', Petition), 'newest')
+        self.assertEqual(Sorter.validate('hot', UserList), 'hot')
+
+    def test_command(self):
+        animal = Animal.objects.create(name='Lion', author=self.author)
+        Animal.objects.filter(id=animal.id).update(votes=10)
+        out = StringIO()
+        call_command('update_hot_scores', stdout=out)
+        self.assertIn('Animal: 1 changed', out.getvalue())
+        self.assertIn('Discussion: 0 changed', out.getvalue())
+        self.assertEqual(self.stored(animal), HotScores.score(10, self.today))
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        Leaderboard.clear()
+        self.addCleanup(Leaderboard.clear)
+        self.profile = UserProfile.objects.create(user=User.objects.create(username='testuser'))
+        self.animals = [Animal.objects.create(name=f'Animal {i:02}', author=self.profile) for i in range(15)]
+        for i, animal in enumerate(self.animals):
+            Animal.objects.filter(id=animal.id).update(votes=i)
+
+    def names(self):
+        top, bottom = Leaderboard.animals()
+        return [animal.name for animal in top], [animal.name for animal in bottom]
+
+    def expected(self):
+        top = Sorter.sort_model('overrated', Animal)[1][:5]
+        bottom = Sorter.sort_model('underrated', Animal)[1][:5]
+        return [animal.name for animal in top], [animal.name for animal in bottom]
+
+    def test_matches_sorter(self):
+        self.assertEqual(self.names(), self.expected())
+        self.assertEqual(self.names()[0][0], 'Animal 14')
+
+    def test_homepage_skips_animal_table(self):
+        self.client.get(reverse('wildthoughts:index'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('wildthoughts:index'))
+        self.assertContains(response, 'Animal 14')
+        self.assertFalse([query for query in context.captured_queries if 'wildthoughts_animal' in query['sql']])
+
+    def test_votes_move_animals(self):
+        Leaderboard.animals()
+        voters = [UserProfile.objects.create(user=User.objects.create(username=f'voter{i}')) for i in range(20)]
+        # from the middle, outside both windows, to the top, then to the bottom
+        middle = self.animals[7]
+        for voter in voters:
+            VoteService.vote(voter, 'animals', middle.id, 'upvote')
+        self.assertEqual(self.names(), self.expected())
+        self.assertEqual(self.names()[0][0], middle.name)
+        for voter in voters:
+            VoteService.vote(voter, 'animals', middle.id, 'downvote')
+        self.assertEqual(self.names(), self.expected())
+        self.assertEqual(self.names()[1][0], middle.name)
+
+    def test_windows_shrink_and_rebuild(self):
+        Leaderboard.animals()
+        voter = UserProfile.objects.create(user=User.objects.create(username='voter'))
+        # push the top animals far down, one at a time, until the window runs out
+        for animal in self.animals[-8:]:
+            Animal.objects.filter(id=animal.id).update(votes=-100)
+            VoteService.vote(voter, 'animals', animal.id, 'downvote')
+            self.assertEqual(self.names(), self.expected())
+
+    def test_saved_and_deleted_animals(self):
+        Leaderboard.animals()
+        animal = Animal.objects.create(name='Newcomer', author=self.profile)
+        self.assertEqual(self.names(), self.expected())
+        self.animals[14].delete()
+        self.animals[0].delete()
+        self.assertEqual(self.names(), self.expected())
+        animal.name = 'Renamed'
+        animal.save()
+        self.assertEqual(self.names(), self.expected())
+
+    @override_settings(LEADERBOARD_STALENESS=0)
+    def test_staleness_bound(self):
+        Leaderboard.animals()
+        Animal.objects.filter(id=self.animals[0].id).update(votes=1000)
+        self.assertEqual(self.names(), self.expected())
+
+
+class ProfileCountersTests(TestCase):
+    def setUp(self):
+        self.author = UserProfile.objects.create(user=User.objects.create(username='author'))
+        self.voter = UserProfile.objects.create(user=User.objects.create(username='voter'))
+
+    def counters(self, profile):
+        profile.refresh_from_db()
+        return {field: getattr(profile, field) for field in ProfileCounters.actual()}
+
+    def assertCountersMatch(self):
+        # the rebuild finds nothing to fix when the counters were kept in step
+        self.assertEqual(ProfileCounters.rebuild(dry_run=True), 0)
+
+    def test_authored_content(self):
+        animal = Animal.objects.create(name='Lion', author=self.author)
+        discussion = Discussion.objects.create(title='Roar', author=self.author, animal=animal)
+        Comment.objects.create(author=self.author, discussion=discussion, content='Hello')
+        UserList.objects.create(title='Cats', author=self.author)
+        Petition.objects.create(title='Save', author=self.author)
+        counters = self.counters(self.author)
+        for field in ['animals_count', 'discussions_count', 'comments_count', 'lists_count', 'petitions_count']:
+            self.assertEqual(counters[field], 1)
+        self.assertCountersMatch()
+
+        # the cascade removes the discussion and its comment too
+        animal.delete()
+        counters = self.counters(self.author)
+        self.assertEqual([counters['animals_count'], counters['discussions_count'], counters['comments_count']], [0, 0, 0])
+        self.assertCountersMatch()
+
+    def test_votes_received(self):
+        animal = Animal.objects.create(name='Lion', author=self.author)
+        discussion = Discussion.objects.create(title='Roar', author=self.author, animal=animal)
+        VoteService.vote(self.voter, 'animals', animal.id, 'upvote')
+        VoteService.vote(self.voter, 'discussions', discussion.id, 'upvote')
+        VoteService.vote(self.voter, 'discussions', discussion.id, 'downvote')
+        self.assertEqual(self.counters(self.author)['votes_received'], 0)
+        self.assertEqual(self.counters(self.voter)['votes_received'], 0)
+        VoteService.vote(self.voter, 'discussions', discussion.id, 'downvoted')
+        self.assertEqual(self.counters(self.author)['votes_received'], 1)
+        self.assertCountersMatch()
+        discussion.delete()
+        self.assertEqual(self.counters(self.author)['votes_received'], 1)
+        self.assertCountersMatch()
+
+    def test_signatures(self):
+        petition = Petition.objects.create(title='Save', author=self.author, goal=1)
+        SignatureService.sign(self.voter, petition.id)
+        SignatureService.sign(self.voter, petition.id)
+        SignatureService.sign(self.author, petition.id)
+        self.assertEqual(self.counters(self.voter)['signatures_count'], 1)
+        self.assertEqual(self.counters(self.author)['signatures_count'], 0)
+        self.assertCountersMatch()
+        petition.delete()
+        self.assertEqual(self.counters(self.voter)['signatures_count'], 0)
+
+    def test_rebuild_fixes_drift(self):
+        Animal.objects.create(name='Lion', author=self.author)
+        UserProfile.objects.filter(id=self.author.id).update(animals_count=7, votes_received=3)
+        out = StringIO()
+        call_command('rebuild_profile_counters', '--dry-run', stdout=out)
+        self.assertIn('1 drifted', out.getvalue())
+        self.assertEqual(self.counters(self.author)['animals_count'], 7)
+        call_command('rebuild_profile_counters', stdout=StringIO())
+        self.assertEqual(self.counters(self.author)['animals_count'], 1)
+        self.assertEqual(self.counters(self.author)['votes_received'], 0)
+
+    def test_sort_profiles_by_activity(self):
+        for i in range(3):
+            Animal.objects.create(name=f'Animal {i}', author=self.voter)
+        animal = Animal.objects.create(name='Lion', author=self.author)
+        VoteService.vote(self.voter, 'animals', animal.id, 'upvote')
+        sort_by, results = Sorter.sort_profiles('most_active')
+        self.assertEqual([profile.user.username for profile in results], ['voter', 'author'])
+        sort_by, results = Sorter.sort_profiles('most_voted')
+        self.assertEqual([profile.user.username for profile in results], ['author', 'voter'])
+
+    def test_profile_list_pages_by_activity(self):
+        for i in range(25):
+            profile = UserProfile.objects.create(user=User.objects.create(username=f'user{i:02}'))
+            UserProfile.objects.filter(id=profile.id).update(comments_count=i % 5)
+        names = []
+        data = {'sort_by': 'most_active', 'paginate': 'cursor'}
+        while True:
+            response = self.client.get(reverse('wildthoughts:profiles'), data)
+            self.assertContains(response, 'Most Active')
+            page = response.context['profiles']
+            names += [profile.user.username for profile in page]
+            if not page.has_next():
+                break
+            data = {'sort_by': 'most_active', 'cursor': page.next_cursor}
+        expected = Sorter.sort_profiles('most_active')[1]
+        self.assertEqual(names, [profile.user.username for profile in expected])
+
+
+class DownloaderTests(TestCase):
+    """
+    the downloaders run against a local FixtureServer, no network needed
+    """
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+
+    def test_scrape_fixture(self):
+        with FixtureServer(count=30) as server:
+            output_dict, report = AnimalDownloader.scrape(30, base_url=server.url, concurrency=4, folder=self.folder.name)
+        self.assertEqual(len(output_dict), 30)
+        self.assertEqual(report['failures'], {})
+        self.assertEqual(len(os.listdir(self.folder.name)), 30)
+        # the index, 30 pages and 30 images
+        self.assertEqual(report['requests'], 61)
+
+    def test_failures_are_reported(self):
+        with FixtureServer(count=5) as server:
+            missing = next(iter(server.images))
+            del server.images[missing]
+            output_dict, report = AnimalDownloader.scrape(5, base_url=server.url, folder=self.folder.name)
+        self.assertEqual(len(output_dict), 4)
+        self.assertEqual(list(report['failures']), [server.url + missing])
+        self.assertIn('404', report['failures'][server.url + missing])
+        self.assertFalse([name for name in os.listdir(self.folder.name) if name.endswith('.part')])
+
+    def test_retry_with_backoff(self):
+        with FixtureServer(count=2, failures={'/animals/': 2}) as server:
+            with Fetcher(retries=2, backoff=0.01) as fetcher:
+                [html_file] = fetcher.run([fetcher.content(server.url + '/animals/')])
+            self.assertIn(b'Animal Corner', html_file)
+            self.assertEqual(fetcher.requests, 3)
+
+            server.failures['/animals/'] = 3
+            with Fetcher(retries=2, backoff=0.01) as fetcher:
+                [html_file] = fetcher.run([fetcher.content(server.url + '/animals/')])
+            self.assertIsNone(html_file)
+            self.assertIn('503', fetcher.failures[server.url + '/animals/'])
+
+    def test_failed_stream_leaves_no_partial_file(self):
+        def chunks(size):
+            yield b'first chunk'
+            raise OSError('connection reset')
+
+        path = os.path.join(self.folder.name, 'lion.jpg')
+        response = mock.MagicMock(status_code=200)
+        response.__enter__.return_value = response
+        response.iter_content.side_effect = chunks
+        with Fetcher() as fetcher, mock.patch.object(fetcher.session, 'get', return_value=response):
+            with self.assertRaises(OSError):
+                fetcher.stream('http://example.com/lion.jpg', path)
+        self.assertEqual(os.listdir(self.folder.name), [])
+
+    def test_malformed_profile_is_reported(self):
+        entries = [{'login': {'username': 'alice'}}, {'login': {'username': '', 'password': ''}, 'email': '', 'picture': {'large': ''}}]
+        with Fetcher() as fetcher:
+            results = fetcher.run([ProfileDownloader._ProfileDownloader__get_data(fetcher, f'api#results[{i}]', entry)
+                                   for i, entry in enumerate(entries)])
+        self.assertEqual(results, [None, None])
+        self.assertEqual(list(fetcher.failures), ['api#results[0]'])
+        self.assertIn('KeyError', fetcher.failures['api#results[0]'])
+
+
+class DownloadCacheTests(TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        self.cache_folder = os.path.join(self.folder.name, 'cache')
+
+    def scrape(self, server, max_age=0, count=5):
+        cache = DownloadCache(self.cache_folder, max_age=max_age)
+        with tempfile.TemporaryDirectory() as folder:
+            output_dict, report = AnimalDownloader.scrape(count, base_url=server.url, folder=folder, cache=cache)
+            self.assertEqual(len(os.listdir(folder)), count)
+        self.assertEqual(len(output_dict), count)
+        return report
+
+    def test_reruns_skip_unchanged_files(self):
+        with FixtureServer(count=5) as server:
+            cold = self.scrape(server)
+            self.assertEqual(cold['cache']['downloaded'], 11)
+
+            revalidated = self.scrape(server)
+            self.assertEqual(revalidated['cache']['revalidated'], 11)
+            self.assertEqual(revalidated['bytes'], 0)
+
+            server.requests.clear()
+            warm = self.scrape(server, max_age=DownloadCache.MAX_AGE)
+            self.assertEqual(warm['cache']['hits'], 11)
+            self.assertEqual(server.requests, [])
+
+    def test_identical_content_stored_once(self):
+        with FixtureServer(count=30) as server:
+            self.scrape(server, count=30)
+        # 24 distinct images are served under 30 urls
+        blobs = os.listdir(os.path.join(self.cache_folder, 'objects'))
+        entries = os.listdir(os.path.join(self.cache_folder, 'entries'))
+        self.assertLess(len(blobs), len(entries))
+
+    def test_interrupted_download_resumes(self):
+        with FixtureServer(count=1) as server:
+            path = next(iter(server.images))
+            # a generated image of IMAGE_SIZE, so the first half spans whole chunks
+            server.images[path] = 'generated.jpg'
+            image = server.image(path)
+            server.interruptions[path] = 1
+            cache = DownloadCache(self.cache_folder)
+            target = os.path.join(self.folder.name, 'image')
+            with Fetcher(backoff=0.01, cache=cache) as fetcher:
+                [size] = fetcher.run([fetcher.save(server.url + path, target)])
+
+        self.assertEqual(size, len(image))
+        with open(target, 'rb') as f:
+            self.assertEqual(f.read(), image)
+        self.assertEqual(cache.report()['resumed'], 1)
+        # the first half wasn't downloaded twice
+        self.assertLess(fetcher.bytes, len(image))
+        self.assertEqual(os.listdir(os.path.join(self.cache_folder, 'partial')), [])
+
+    def test_unsatisfiable_range_drops_the_partial_download(self):
+        cache = DownloadCache(self.cache_folder)
+        url = 'http://example.com/image.jpg'
+        # a stale sidecar whose partial file is already gone
+        cache.write_json(cache.partial_path(url) + '.json', {'etag': '"1"', 'last_modified': None})
+        session = mock.MagicMock()
+        session.get.return_value.__enter__.return_value.status_code = 416
+        check = mock.Mock(side_effect=ValueError('416'))
+        with self.assertRaisesMessage(ValueError, '416'):
+            cache.fetch(session, url, 1, check)
+        check.assert_called_once()
+        self.assertEqual(os.listdir(os.path.join(self.cache_folder, 'partial')), [])
+
+    def test_one_lock_per_url(self):
+        cache = DownloadCache(self.cache_folder)
+        urls = ['http://example.com/a.jpg', 'http://example.com/b.jpg'] * 50
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            locks = list(executor.map(cache.url_lock, urls))
+        self.assertEqual(len({id(lock) for lock in locks[0::2]}), 1)
+        self.assertEqual(len({id(lock) for lock in locks[1::2]}), 1)
+        self.assertIsNot(locks[0], locks[1])
+
+
+class BulkLoaderTests(TestCase):
+    def setUp(self):
+        self.animal_dict = BulkLoader.expand_animals({
+            'Lion': {'description': 'The king of the jungle!', 'image_path': 'animal_images/lion.jpg'},
+            'Tiger': {'description': 'Striped', 'image_path': 'animal_images/tiger.jpg'},
+        }, 20)
+        self.profile_dict = BulkLoader.expand_profiles({
+            'alice': {'email': 'alice@example.com', 'password': 'secret', 'image_path': 'profile_images/alice.jpg'},
+        }, 15)
+
+    def populate(self, **kwargs):
+        options = {'discussions': 10, 'user_lists': 10, 'petitions': 10, 'votes': 200, 'seed': 1}
+        options.update(kwargs)
+        BulkLoader.populate(self.animal_dict, self.profile_dict, **options)
+
+    def counts(self):
+        return [model.objects.count() for model in [User, UserProfile, Animal, Discussion, UserList, Petition]]
+
+    def test_expand(self):
+        self.assertEqual(len(self.animal_dict), 20)
+        self.assertIn('Lion 10', self.animal_dict)
+        self.assertEqual(len({data['email'] for data in self.profile_dict.values()}), 15)
+
+    def test_populate(self):
+        self.populate()
+        # the profiles and the animalcorner author
+        self.assertEqual(self.counts(), [16, 16, 20, 10, 10, 10])
+        self.assertEqual(Animal.objects.get(name='Lion 2').slug, 'lion-2')
+        self.assertEqual(UserList.objects.first().animals.count(), 5)
+
+        # the columns and counters agree with the through-tables
+        self.assertEqual(sum(VoteService.reconcile(dry_run=True).values()), 0)
+        self.assertEqual(ProfileCounters.rebuild(dry_run=True), 0)
+        for petition in Petition.objects.all():
+            self.assertEqual(petition.signatures, petition.signed_by.count())
+        upvotes = set(Animal.upvoted_by.through.objects.values_list('animal_id', 'userprofile_id'))
+        downvotes = set(Animal.downvoted_by.through.objects.values_list('animal_id', 'userprofile_id'))
+        self.assertTrue(upvotes)
+        self.assertFalse(upvotes & downvotes)
+        self.assertEqual(SearchIndex.search('Animals', 'jungle').count(), 10)
+
+    def test_rerun_only_adds_missing_rows(self):
+        self.populate()
+        votes = list(Animal.objects.order_by('id').values_list('votes', flat=True))
+        self.populate()
+        self.assertEqual(self.counts(), [16, 16, 20, 10, 10, 10])
+        self.assertEqual(list(Animal.objects.order_by('id').values_list('votes', flat=True)), votes)
+        self.assertEqual(sum(VoteService.reconcile(dry_run=True).values()), 0)
+
+    def test_reruns_keep_petitions_under_their_goal(self):
+        self.populate()
+        Petition.objects.update(goal=F('signatures') + 2)
+        for _ in range(3):
+            self.populate(seed=None)
+        for petition in Petition.objects.all():
+            self.assertLessEqual(petition.signatures, petition.goal)
+            self.assertEqual(petition.signatures, petition.signed_by.count())
+
+    def test_upsert(self):
+        self.populate()
+        self.animal_dict['Lion']['description'] = 'Changed'
+        self.profile_dict['alice']['image_path'] = 'profile_images/changed.jpg'
+
+        self.populate()
+        self.assertEqual(Animal.objects.get(name='Lion').description, 'The king of the jungle!')
+        self.populate(upsert=True)
+        self.assertEqual(Animal.objects.get(name='Lion').description, 'Changed')
+        self.assertEqual(UserProfile.objects.get(user__username='alice').picture, 'profile_images/changed.jpg')
+
+
+class SyntheticDatasetTests(TestCase):
+    def snapshot(self):
+        return {
+            'animals': list(Animal.objects.order_by('name').values_list('name', 'votes', 'date')),
+            'comments': list(Discussion.objects.annotate(comments=Count('comment')).order_by('title').values_list('title', 'comments')),
+            'lists': list(UserList.objects.annotate(size=Count('animals')).order_by('title').values_list('title', 'size')),
+            'signatures': list(Petition.objects.order_by('title').values_list('title', 'signatures')),
+        }
+
+    def test_deterministic(self):
+        counts = SyntheticDataset.generate(60, seed=3)
+        self.assertEqual(counts, {'UserProfile': 61, 'Animal': 60, 'Discussion': 120, 'Comment': 600, 'UserList': 30, 'Petition': 6})
+        snapshot = self.snapshot()
+        urls = SyntheticDataset.load_profile(50, seed=3)
+
+        User.objects.all().delete()
+        SyntheticDataset.generate(60, seed=3)
+        self.assertEqual(self.snapshot(), snapshot)
+        self.assertEqual(SyntheticDataset.load_profile(50, seed=3), urls)
+
+        User.objects.all().delete()
+        SyntheticDataset.generate(60, seed=4)
+        self.assertNotEqual(self.snapshot(), snapshot)
+
+    def test_skewed_and_consistent(self):
+        SyntheticDataset.generate(200, seed=0, votes=8000)
+        votes = sorted(Animal.objects.values_list('votes', flat=True), reverse=True)
+        self.assertGreater(votes[0], 10 * max(votes[len(votes) // 2], 1))
+        comments = sorted(Discussion.objects.annotate(comments=Count('comment')).values_list('comments', flat=True), reverse=True)
+        self.assertGreater(comments[0], 10 * max(comments[len(comments) // 2], 1))
+
+        self.assertEqual(sum(VoteService.reconcile(dry_run=True).values()), 0)
+        self.assertEqual(ProfileCounters.rebuild(dry_run=True), 0)
+        self.assertFalse(Petition.objects.filter(signatures__gt=F('goal')).exists())
+        self.assertGreater(Animal.objects.values('date').distinct().count(), 1)
+
+    def test_dates_do_not_depend_on_the_day(self):
+        SyntheticDataset.generate(60, seed=3)
+        for model in [Animal, Discussion, Comment, UserList, Petition, UserProfile]:
+            dates = model.objects.aggregate(first=Min('date'), last=Max('date'))
+            self.assertLessEqual(dates['last'], SyntheticDataset.END_DATE, model)
+            self.assertGreaterEqual(dates['first'], SyntheticDataset.END_DATE - datetime.timedelta(days=SyntheticDataset.DAYS), model)
+
+    def test_load_profile(self):
+        SyntheticDataset.generate(60, seed=0)
+        for url in SyntheticDataset.load_profile(20):
+            self.assertEqual(self.client.get(url).status_code, 200, url)
+
+
+class BenchmarkUrlsTests(TestCase):
+    def test_every_url_answers(self):
+        with tempfile.TemporaryDirectory() as folder:
+            output = os.path.join(folder, 'results.json')
+            call_command('benchmark_urls', scale=60, repeat=1, warmup=0, output=output, stdout=StringIO())
+            with open(output, 'r') as f:
+                results = json.load(f)['results']
+
+            self.assertIn('index (anonymous)', results)
+            self.assertIn('discussions newest cursor at page 3 (logged in)', results)
+            self.assertIn('vote animals (logged in)', results)
+            for label, result in results.items():
+                self.assertEqual(result['status'], [200], label)
+                self.assertGreater(result['bytes'], 0, label)
+
+            # everything was rolled back
+            self.assertFalse(Animal.objects.exists())
+
+            out = StringIO()
+            call_command('benchmark_urls', scale=60, repeat=1, warmup=0, filter='index', output=os.path.join(folder, 'new.json'),
+                         compare=output, stdout=out)
+            self.assertIn('regressions in 2 urls', out.getvalue())
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        Metrics.clear()
+        Leaderboard.clear()
+        self.addCleanup(Metrics.clear)
+
+    def test_records_requests(self):
+        response = self.client.get(reverse('wildthoughts:index'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.client.get(reverse('wildthoughts:index'))
+
+        metrics = Metrics.snapshot()['views']['wildthoughts:index']
+        self.assertEqual(metrics['count'], 2)
+        self.assertEqual(metrics['view'], 'wildthoughts.views.IndexView')
+        self.assertGreater(metrics['mean_queries'], 0)
+        self.assertGreater(metrics['mean_template_ms'], 0)
+        self.assertGreaterEqual(metrics['p95_ms'], metrics['p50_ms'])
+
+    def test_repeated_queries(self):
+        record = Metrics.start()
+        with connection.execute_wrapper(record):
+            for id in range(4):
+                Animal.objects.filter(id=id).exists()
+            list(Animal.objects.filter(id__in=[1, 2]))
+            list(Animal.objects.filter(id__in=[1, 2, 3]))
+        Metrics.finish(record, 'test', None, '/test/')
+
+        metrics = Metrics.snapshot()['views']['test']
+        self.assertEqual(metrics['mean_queries'], 6)
+        self.assertEqual(metrics['duplicate_queries'], 4)
+        [fingerprint] = metrics['top_duplicates']
+        self.assertIn('"wildthoughts_animal"."id" = %s', fingerprint)
+
+    @override_settings(METRICS_SAMPLE_RATE=0)
+    def test_sampling_off(self):
+        response = self.client.get(reverse('wildthoughts:index'))
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(Metrics.snapshot()['views'], {})
+
+    @override_settings(METRICS_SLOW_MS=0)
+    def test_slow_requests(self):
+        with self.assertLogs('wildthoughts.metrics', 'WARNING'):
+            self.client.get(reverse('wildthoughts:animals'))
+        [slow] = Metrics.snapshot()['slow']
+        self.assertEqual(slow['url_name'], 'wildthoughts:animals')
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint(self):
+        self.client.get(reverse('wildthoughts:index'))
+        url = reverse('wildthoughts:metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        response = self.client.get(url, {'format': 'prometheus'}, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        text = response.content.decode()
+        self.assertIn('wildthoughts_request_duration_seconds_bucket{view="wildthoughts:index",le="+Inf"} 1', text)
+        self.assertIn('# TYPE wildthoughts_request_queries_total counter', text)
+
+        staff = User.objects.create(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertIn('wildthoughts:index', self.client.get(url).json()['views'])
+
+
+# the pages would otherwise come from the page cache
+@override_settings(PAGE_CACHE_TIMEOUT=0)
+class CardCacheTests(TestCase):
+    def setUp(self):
+        CardCache.clear()
+        CardCache.reset_stats()
+        Leaderboard.clear()
+        self.addCleanup(CardCache.reset_stats)
+        self.user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.animal = Animal.objects.create(name='Lion', author=self.profile)
+
+    def test_second_render_is_cached(self):
+        user_list = UserList.objects.create(title='Top cats', author=self.profile)
+        user_list.animals.add(self.animal)
+        first = self.client.get(reverse('wildthoughts:lists'))
+        second = self.client.get(reverse('wildthoughts:lists'))
+        self.assertEqual(first.content, second.content)
+        self.assertContains(second, 'Lion')
+        self.assertEqual(CardCache.stats()['userlist'], {'hits': 1, 'misses': 1, 'ratio': 0.5})
+
+    def test_vote_buttons_per_viewer(self):
+        self.client.get(reverse('wildthoughts:animals'))
+        voter = User.objects.create(username='voter')
+        Animal.objects.filter(id=self.animal.id).update(votes=0)
+        self.animal.upvoted_by.add(UserProfile.objects.create(user=voter))
+        self.client.force_login(voter)
+
+        response = self.client.get(reverse('wildthoughts:animals'))
+        self.assertContains(response, 'data-status="upvoted"')
+        self.assertEqual(CardCache.stats()['animal']['hits'], 1)
+        self.client.logout()
+        self.assertNotContains(self.client.get(reverse('wildthoughts:animals')), 'data-status="upvoted"')
+
+    def test_edits_bump_versions(self):
+        discussion = Discussion.objects.create(title='Lions?', author=self.profile, animal=self.animal)
+        self.client.get(reverse('wildthoughts:discussions'))
+
+        self.animal.name = 'Tiger'
+        self.animal.save()
+        self.assertContains(self.client.get(reverse('wildthoughts:discussions')), 'Tiger')
+        self.user.username = 'renamed'
+        self.user.save()
+        self.assertContains(self.client.get(reverse('wildthoughts:discussions')), 'Posted by renamed')
+
+        VoteService.vote(self.profile, 'discussions', discussion.id, 'upvote')
+        response = self.client.get(reverse('wildthoughts:discussions'))
+        self.assertContains(response, f'<h4 id="count_discussions_{discussion.id}">1</h4>')
+        self.assertEqual(CardCache.stats()['discussion'], {'hits': 0, 'misses': 4, 'ratio': 0.0})
+
+    def test_signature_bumps_petition(self):
+        petition = Petition.objects.create(title='Save the Lions', author=self.profile, goal=10)
+        self.client.get(reverse('wildthoughts:petitions'))
+        SignatureService.sign(self.profile, petition.id)
+        self.assertContains(self.client.get(reverse('wildthoughts:petitions')), '1 Signatures')
+
+    def test_profile_counters_in_key(self):
+        self.client.get(reverse('wildthoughts:profiles'))
+        Discussion.objects.create(title='Lions?', author=self.profile, animal=self.animal)
+        self.assertContains(self.client.get(reverse('wildthoughts:profiles')), '1 discussions')
+
+    @override_settings(CARD_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.client.get(reverse('wildthoughts:animals'))
+        self.client.get(reverse('wildthoughts:animals'))
+        self.assertEqual(CardCache.stats(), {})
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_metrics(self):
+        self.client.get(reverse('wildthoughts:animals'))
+        url = reverse('wildthoughts:metrics')
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.json()['cards']['animal']['misses'], 1)
+        response = self.client.get(url, {'format': 'prometheus'}, HTTP_AUTHORIZATION='Bearer secret')
+        self.assertIn('wildthoughts_card_cache_misses_total{card="animal"} 1', response.content.decode())
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        PageCache.invalidate()
+        PageCache.reset_stats()
+        Leaderboard.clear()
+        self.addCleanup(PageCache.reset_stats)
+        self.user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.animal = Animal.objects.create(name='Lion', author=self.profile)
+
+    def test_anonymous_pages_are_cached(self):
+        url = reverse('wildthoughts:animal', args=[self.animal.slug])
+        first = self.client.get(url)
+        second = self.client.get(url)
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(second['X-Frame-Options'], 'SAMEORIGIN')
+        self.assertEqual(self.client.get(url, {'sort_by': 'newest'})['X-Page-Cache'], 'miss')
+        self.assertEqual(PageCache.stats(), {'hits': 1, 'misses': 2, 'skipped': 0, 'ratio': 0.3333})
+
+    def test_theme_cookie(self):
+        url = reverse('wildthoughts:animals')
+        self.client.get(url)
+        self.client.cookies['theme'] = 'dark'
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'data-bs-theme="dark"')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+
+        self.client.cookies['theme'] = '"><script>'
+        self.assertNotIn('X-Page-Cache', self.client.get(url))
+
+    def test_content_change_invalidates(self):
+        url = reverse('wildthoughts:animals')
+        self.client.get(url)
+        Animal.objects.create(name='Tiger', author=self.profile)
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Tiger')
+
+    def test_bypassed(self):
+        url = reverse('wildthoughts:animals')
+        self.client.get(url)
+        self.client.force_login(self.user)
+        self.assertNotIn('X-Page-Cache', self.client.get(url))
+        self.client.logout()
+
+        # the comment form uses the csrf token
+        discussion = Discussion.objects.create(title='Lions?', author=self.profile, animal=self.animal)
+        url = reverse('wildthoughts:discussion', args=[discussion.slug])
+        self.client.get(url)
+        self.assertNotIn('X-Page-Cache', self.client.get(url))
+        self.assertEqual(PageCache.stats()['skipped'], 2)
+
+    @override_settings(PAGE_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        self.assertNotIn('X-Page-Cache', self.client.get(reverse('wildthoughts:animals')))
+
+    def test_benchmark_command(self):
+        stdout = StringIO()
+        call_command('benchmark_page_cache', requests=50, write_every=20, stdout=stdout)
+        self.assertIn('with page cache: requests/s', stdout.getvalue())
+        self.assertTrue(Animal.objects.filter(description='').exists())
+
+
+@override_settings(COMMENTS_PER_PAGE=3)
+class CommentPaginationTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=user)
+        animal = Animal.objects.create(name='Lion', author=self.profile)
+        self.discussion = Discussion.objects.create(title='Lions?', author=self.profile, animal=animal)
+        for i in range(8):
+            Comment.objects.create(author=self.profile, discussion=self.discussion, content=f'Comment {i}', votes=i % 3)
+
+    def test_first_page(self):
+        response = self.client.get(reverse('wildthoughts:discussion', args=[self.discussion.slug]))
+        self.assertContains(response, 'Comment 7')
+        self.assertNotContains(response, 'Comment 4')
+        self.assertContains(response, 'id="load_comments"')
+
+    def test_load_more_walks_every_ordering(self):
+        url = reverse('wildthoughts:discussion_comments', args=[self.discussion.slug])
+        for sort_by in ['newest', 'oldest', 'overrated', 'underrated']:
+            with self.subTest(sort_by=sort_by):
+                _, comments = Sorter.sort_discussion_comments(sort_by, self.discussion)
+                expected = [comment.content for comment in comments]
+                page = self.client.get(reverse('wildthoughts:discussion', args=[self.discussion.slug]), {'sort_by': sort_by})
+                seen = [content for content in expected if content in page.content.decode()]
+                cursor = page.context['comments'].next_cursor
+                while cursor:
+                    data = self.client.get(url, {'sort_by': sort_by, 'cursor': cursor}).json()
+                    seen += [content for content in expected if f'>{content}<' in data['html']]
+                    cursor = data['next_cursor']
+                self.assertEqual(seen, expected)
+
+    def test_missing_discussion(self):
+        response = self.client.get(reverse('wildthoughts:discussion_comments', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+
+
+class ImageDerivativesTests(TestCase):
+    def setUp(self):
+        self.media = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media.cleanup)
+        override = override_settings(MEDIA_ROOT=self.media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media.name, 'animal_images'))
+        # 340x200 like the scraped pictures, big enough for 150x90 at 2x but not 615x410
+        Image.new('RGB', (340, 200), 'green').save(os.path.join(self.media.name, 'animal_images', 'lion.jpg'))
+        user = User.objects.create(username='testuser')
+        self.profile = UserProfile.objects.create(user=user)
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media.name, ImageDerivatives.FOLDER, 'animal_images', name))
+
+    def test_generated_on_save(self):
+        Animal.objects.create(name='Lion', author=self.profile, picture='animal_images/lion.jpg')
+        self.assertTrue(self.exists('lion.150x90@2x.webp'))
+        self.assertTrue(self.exists('lion.150x90@1x.jpg'))
+        # the original can't fill 615x410, the picture tag shows the original instead
+        self.assertFalse(self.exists('lion.615x410@1x.webp'))
+        self.assertFalse(self.exists('lion.615x410@1x.jpg'))
+        self.assertFalse(self.exists('lion.615x410@2x.webp'))
+        with Image.open(os.path.join(self.media.name, ImageDerivatives.FOLDER, 'animal_images', 'lion.150x90@2x.webp')) as image:
+            self.assertEqual(image.size, (300, 180))
+
+    def test_picture_tag(self):
+        animal = Animal.objects.create(name='Lion', author=self.profile, picture='animal_images/lion.jpg')
+        html = Template('{% load wildthoughts_tags %}{% picture animal.picture 150 90 alt=animal.name css="rounded" data_toggle="popover" %}').render(Context({'animal': animal}))
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/animal_images/lion.150x90@1x.webp 1x, '
+                      '/media/derivatives/animal_images/lion.150x90@2x.webp 2x">', html)
+        self.assertIn('src="/media/derivatives/animal_images/lion.150x90@1x.jpg"', html)
+        self.assertIn('loading="lazy"', html)
+        self.assertIn('data-toggle="popover"', html)
+
+        with override_settings(IMAGE_DERIVATIVES=False):
+            html = Template('{% load wildthoughts_tags %}{% picture animal.picture 150 90 %}').render(Context({'animal': animal}))
+        self.assertEqual(html, '<img src="/media/animal_images/lion.jpg" class="" width="150" height="90" alt="" loading="lazy">')
+
+        html = Template('{% load wildthoughts_tags %}{% picture animal.picture 615 410 %}').render(Context({'animal': animal}))
+        self.assertEqual(html, '<img src="/media/animal_images/lion.jpg" class="" width="615" height="410" alt="" loading="lazy">')
+
+    def test_build_command(self):
+        with override_settings(IMAGE_DERIVATIVES=False):
+            Animal.objects.create(name='Lion', author=self.profile, picture='animal_images/lion.jpg')
+        self.assertFalse(self.exists('lion.150x90@1x.webp'))
+        stdout = StringIO()
+        call_command('build_image_derivatives', workers=2, stdout=stdout)
+        self.assertIn('copies of 1 pictures', stdout.getvalue())
+        self.assertTrue(self.exists('lion.150x90@1x.webp'))
+        # up to date copies are kept
+        self.assertEqual(ImageDerivatives.build(workers=1)['written'], 0)
+
+
+class StaticAssetsTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        override = override_settings(STATIC_ROOT=self.root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def collect(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    def test_unhashed_before_collectstatic(self):
+        self.assertEqual(static('CSS/WildThoughts.css'), '/static/CSS/WildThoughts.css')
+        self.assertEqual(self.client.get('/static/CSS/WildThoughts.css').status_code, 404)
+
+    def test_collectstatic_hashes_and_compresses(self):
+        self.collect()
+        url = static('js/jquery-3.6.0.min.js')
+        self.assertRegex(url, r'^/static/js/jquery-3\.6\.0\.min\.[0-9a-f]{12}\.js$')
+        path = os.path.join(self.root.name, url[len('/static/'):])
+        self.assertTrue(os.path.exists(path + '.gz'))
+        # pictures are already compressed
+        self.assertFalse(os.path.exists(os.path.join(self.root.name, 'images', 'rango.jpg.gz')))
+        # the index links the hashed stylesheet
+        self.assertContains(self.client.get(reverse('index')), static('CSS/WildThoughts.css'))
+
+    def test_serve(self):
+        self.collect()
+        url = static('js/jquery-3.6.0.min.js')
+        with open(os.path.join(settings.STATIC_DIR, 'js', 'jquery-3.6.0.min.js'), 'rb') as f:
+            original = f.read()
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Cache-Control'], StaticAssets.IMMUTABLE)
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(response['Content-Type'], 'text/javascript')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), original)
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), original)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        # the unhashed name can change content
+        response = self.client.get('/static/js/jquery-3.6.0.min.js')
+        self.assertEqual(response['Cache-Control'], StaticAssets.REVALIDATE)
+        self.assertEqual(self.client.get('/static/js/missing.js').status_code, 404)
+
+    def test_check_templates(self):
+        self.assertEqual(StaticAssets.check_templates(), [])
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'page.html'), 'w') as f:
+                f.write('{% load staticfiles %}\n<link href="/static/CSS/WildThoughts.css">\n'
+                        '<div style="background: url(\'/static/images/Landscape.jpg\')"></div>\n'
+                        '<img src="{% static \'images/missing.png\' %}">\n')
+            templates = [{**settings.TEMPLATES[0], 'DIRS': [directory]}]
+            with override_settings(TEMPLATES=templates):
+                errors = StaticAssets.check_templates()
+        self.assertEqual([(error.id, error.obj) for error in errors], [
+            ('wildthoughts.E001', f'{os.path.relpath(directory, settings.BASE_DIR)}/page.html:2'),
+            ('wildthoughts.E001', f'{os.path.relpath(directory, settings.BASE_DIR)}/page.html:3'),
+            ('wildthoughts.E002', f'{os.path.relpath(directory, settings.BASE_DIR)}/page.html:4'),
+        ])
+
+
+class ASGIHandlerTests(TestCase):
+    def request(self, path, query=b'', headers=None):
+        handler = ASGIHandler(get_wsgi_application())
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query,
+                 'headers': headers or [(b'host', b'127.0.0.1')], 'server': ('127.0.0.1', 80)}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(handler(scope, receive, send))
+        return messages[0]['status'], dict(messages[0]['headers']), messages[1]['body']
+
+    def test_theme_on_the_event_loop(self):
+        status, headers, body = self.request(reverse('wildthoughts:theme'), b'theme=dark')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'Theme set to: dark')
+        self.assertTrue(headers[b'set-cookie'].startswith(b'theme=dark'))
+
+    def test_views_on_the_pool(self):
+        status, headers, body = self.request(reverse('wildthoughts:vote'), b'category=animals&id=1&status=upvote')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['status'], 'login')
+        self.assertEqual(headers[b'content-type'], b'application/json')
+        status, _, _ = self.request('/wildthoughts/missing/')
+        self.assertEqual(status, 404)
+
+    def test_environ(self):
+        environ = ASGIHandler.environ({
+            'method': 'POST', 'path': '/wildthoughts/caf\u00e9/', 'query_string': b'a=1',
+            'headers': [(b'content-type', b'text/plain'), (b'cookie', b'a=1'), (b'cookie', b'b=2'), (b'x-forwarded-for', b'1.2.3.4')],
+        }, None)
+        self.assertEqual(environ['PATH_INFO'], '/wildthoughts/caf\u00c3\u00a9/')
+        self.assertEqual(environ['CONTENT_TYPE'], 'text/plain')
+        self.assertEqual(environ['HTTP_COOKIE'], 'a=1; b=2')
+        self.assertEqual(environ['HTTP_X_FORWARDED_FOR'], '1.2.3.4')
+
+    def test_load_test(self):
+        paths = [reverse('wildthoughts:theme') + '?theme=dark', reverse('wildthoughts:vote') + '?id=1'] * 10
+        application = get_wsgi_application()
+        with ASGIServer(ASGIHandler(application)) as server:
+            result = LoadTest.run(server.url, paths, concurrency=5)
+        self.assertEqual((result['requests'], result['errors']), (20, 0))
+        with PooledWSGIServer(application, workers=2) as server:
+            result = LoadTest.run(server.url, paths, concurrency=5)
+        self.assertEqual((result['requests'], result['errors']), (20, 0))
@@ -11,7 +11,9 @@ urlpatterns = [
 
     # base urls
     path('index/', views.IndexView.as_view(), name='index'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
     path('search/', views.SearchView.as_view(), name='search'),
+    path('search/suggest/', views.SuggestView.as_view(), name='suggest'),
     path('theme/', views.ThemeView.as_view(), name='theme'),
     path('vote/', views.VoteView.as_view(), name='vote'),
     
@@ -21,6 +23,7 @@ urlpatterns = [
     path('add_discussion/', views.AddDiscussionView.as_view(), name='add_discussion'),
     path('discussions/', views.ListDiscussionView.as_view(), name = "discussions"),
     path('discussion/<slug:discussion_slug>', views.DiscussionView.as_view(), name = "discussion"),
+    path('discussion/<slug:discussion_slug>/comments/', views.DiscussionCommentsView.as_view(), name='discussion_comments'),
 
     # petition urls
     path('petitions/', views.ListPetitionView.as_view(), name='petitions'),
@@ -1,103 +1,34 @@
+import logging
+
+from django.conf import settings
 from django.core.paginator import Paginator
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.models import User
-from django.db.models import Model
-from django.http import HttpResponse, JsonResponse
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse
 
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.template.defaultfilters import slugify
 from django.utils.decorators import method_decorator
+from django.utils.http import urlencode
 from django.urls import reverse
 from django.views import View
 
 from registration.backends.simple.views import RegistrationView
 
 from wildthoughts.forms import AnimalForm, CommentForm, DiscussionForm, EditProfileForm, UserListForm, PetitionForm
+from wildthoughts.fragments import CardCache
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.metrics import Metrics
 from wildthoughts.models import Animal, Comment, Discussion, Petition, UserList, UserProfile
+from wildthoughts.page_cache import PageCache
+from wildthoughts.pagination import CursorPage, CursorPaginator
+from wildthoughts.search import SearchIndex, SuggestIndex
+from wildthoughts.signatures import SignatureService
+from wildthoughts.sorter import Sorter
+from wildthoughts.votes import VoteService
 
-
-"""--------------------------------------------------------HELPER CLASSES -------------------------------------------------------------"""
-class Sorter:
-    """
-    class dedicated to sort a model by specifying a option
-    the option is then converted to an appropriate field
-    if option is invalid returns model sorted by date
-    """
-    VALID_MODELS = {Animal, Comment, Discussion, Petition, UserList}
-    OPTIONS_ORDER = {
-        'title':'title', 
-        'name': 'name', 
-        'overrated': '-votes',
-        'underrated': 'votes',
-        'newest': '-date',
-        'oldest': 'date',
-        'most_signed': '-signatures',
-        'least_signed': 'signatures',
-    } 
-
-    @classmethod
-    def validate(cls, choice: str, model: Model) -> str:
-        if model not in cls.VALID_MODELS:
-            raise TypeError(f'Model must be {cls.VALID_MODELS}')
-        elif model is Animal and choice == 'title':
-            choice = 'name'
-        elif model is Comment and choice in ['title', 'name']:
-            choice = 'newest'
-        elif choice not in cls.OPTIONS_ORDER:
-            choice = 'newest'
-        return choice
-
-    @classmethod
-    def sort_model(cls, choice: str, model: Model, profile: UserProfile = None) -> tuple[str, list[Model]]:
-    
-        choice = cls.validate(choice, model)
-        field = cls.OPTIONS_ORDER[choice]
-
-        if profile:
-            # filter by a profile instance if specified
-            results = model.objects.filter(author=profile).order_by(field)
-        else:
-            results = model.objects.order_by(field)
-
-        return choice, results    
-    
-    @classmethod
-    def sort_profiles(cls, choice: str) -> tuple[str, list[Model]]:
-        if choice not in ['name', 'oldest', 'newest']:
-            choice = 'newest'
-        
-        if choice == 'name':
-            results = UserProfile.objects.order_by('user__username')
-        elif choice == 'newest':
-            results = UserProfile.objects.order_by('-date')
-        elif choice == 'oldest':
-            results = UserProfile.objects.order_by('date')
-
-        return choice, results
-
-    @classmethod
-    def sort_user_list_animals(cls, choice: str, user_list: UserList) -> tuple[str, list[Model]]:
-        choice = cls.validate(choice, Animal)
-        field = Sorter.OPTIONS_ORDER[choice]
-        results = user_list.animals.order_by(field)
-        return choice, results
-    
-    @classmethod
-    def sort_animal_discussions(cls, choice, animal: Animal) -> tuple[str, list[Model]]:
-        choice = cls.validate(choice, Discussion)
-        field = cls.OPTIONS_ORDER[choice]
-        results = Discussion.objects.filter(animal=animal).order_by(field)
-
-        return choice, results    
-    
-    @classmethod
-    def sort_discussion_comments(cls, choice, discussion: Discussion) -> tuple[str, list[Model]]:
-        choice = cls.validate(choice, Comment)
-        field = cls.OPTIONS_ORDER[choice]
-        results = Comment.objects.filter(discussion=discussion).order_by(field)
-
-        return choice, results    
-
+logger = logging.getLogger(__name__)
 
 """------------------------------------------------------- ANIMAL VIEWS ------------------------------------------------------------"""
 class AnimalView(View):
@@ -120,10 +51,12 @@ class AddAnimalView(View):
 
         if form.is_valid():
             animal = form.save(commit=False)
-            author = UserProfile.objects.get(user=request.user)
+            author = request.profile
             animal.author = author
             animal.slug = slugify(animal.name)
-            animal.save()
+            # saved with the author's counters, see: counters ProfileCounters
+            with transaction.atomic():
+                animal.save()
             return redirect(reverse('wildthoughts:animal', kwargs={'animal_name_slug': animal.slug}))
         else:
             print(form.errors)
@@ -142,18 +75,19 @@ class ListAnimalsView(View):
     def get(self, request):
         sort_by = request.GET.get('sort_by')
         sort_by, results = Sorter.sort_model(sort_by, Animal)
-        p = Paginator(results, 20)
-        page = request.GET.get('page')
-        animals = p.get_page(page)
+        animals = CursorPaginator.paginate(request, results)
         return render(request, 'wildthoughts/animal/list_animals.html', {'animals':animals, 'sort_by':sort_by})
     
 
 """------------------------------------------------------------ BASE VIEWS------------------------------------------------------------"""
 # Views at the core of our applications, usually shared between multiple pages/templates
 class IndexView(View):
+    """
+    the leaderboards are served from the cache
+    see: leaderboard Leaderboard
+    """
     def get(self, request):
-        overrated_animals = Animal.objects.order_by('-votes')[:5]
-        underrated_animals = Animal.objects.order_by('votes')[:5]
+        overrated_animals, underrated_animals = Leaderboard.animals()
         context_dict = {
             'overrated_animals': overrated_animals,
             'underrated_animals': underrated_animals
@@ -162,33 +96,53 @@ class IndexView(View):
     
 
 class SearchView(View):
-    # Codemy.com, Search: https://youtu.be/AGtae4L5BbI?si=KSDHD2XQh5S6YceP
+    """
+    return the results of the full-text index ranked by relevance
+    and set up pagination
+
+    see:
+    search SearchIndex for the index
+
+    Resources used:
+     Codemy.com, Search: https://youtu.be/AGtae4L5BbI?si=KSDHD2XQh5S6YceP
+    """
     def get(self, request):
-        searched = request.GET.get('searched')
+        searched = request.GET.get('searched', '').strip()
         category = request.GET.get('category')
+        if category not in SearchIndex.CATEGORY_TO_MODEL:
+            category = 'Animals'
+
+        results = None
+        if searched:
+            p = Paginator(SearchIndex.search(category, searched), 20)
+            page = request.GET.get('page')
+            results = p.get_page(page)
 
-        if not searched.strip():
-            searched = ''
-            results = None
-        elif category == 'Animals':
-            results = Animal.objects.filter(name__contains=searched)
-        elif category == 'Discussions':
-            results = Discussion.objects.filter(title__contains=searched)
-        elif category == 'Lists':
-            results = UserList.objects.filter(title__contains=searched)
-        elif category == 'Petitions':
-            results = Petition.objects.filter(title__contains=searched)
-        elif category == 'Profiles':
-            results = UserProfile.objects.filter(user__username__contains=searched)
         context_dict = {
             'searched': searched,
             'category': category,
-            'results': results
+            'results': results,
+            'query': '&' + urlencode({'searched': searched, 'category': category})
         }
         
         return render(request, 'wildthoughts/base/search.html', context=context_dict)
 
 
+class SuggestView(View):
+    """
+    return search-as-you-type suggestions for the navbar as json
+    served from memory, the database is only read when the index is loaded
+
+    see:
+    search SuggestIndex for the prefix index
+    static/js/search for client side
+    """
+    def get(self, request):
+        prefix = request.GET.get('q', '')
+        category = request.GET.get('category')
+        return JsonResponse({'results': SuggestIndex.suggest(prefix, category)})
+
+
 class ThemeView(View):
     """
     set the cookie for theme which is then used
@@ -199,14 +153,42 @@ class ThemeView(View):
     templatetags/wildthoughts theme() for retrieving theme from cookie, used in base/base.html
     static/js/theme for client side
     """
-    def get(self, request):
-        theme = request.GET.get('theme')
+    @classmethod
+    def respond(cls, theme: str) -> HttpResponse:
+        # also answers the theme switch on the event loop, see: asgi ASGIHandler
         if theme in ['dark', 'light']:
             response = HttpResponse("Theme set to: " + theme)
             response.set_cookie('theme', theme)
             return response
         else:
             return HttpResponse(-1)
+
+    def get(self, request):
+        return self.respond(request.GET.get('theme'))
+
+
+class MetricsView(View):
+    """
+    the per view timings recorded by MetricsMiddleware, as json
+    or in the Prometheus text format with ?format=prometheus
+    only for staff, in DEBUG, or with the METRICS_TOKEN setting as a bearer token
+
+    see:
+    metrics Metrics
+    fragments CardCache and page_cache PageCache for the hit ratios of the caches
+    """
+    def allowed(self, request) -> bool:
+        token = getattr(settings, 'METRICS_TOKEN', None)
+        if token and request.META.get('HTTP_AUTHORIZATION') == f'Bearer {token}':
+            return True
+        return settings.DEBUG or request.user.is_staff
+
+    def get(self, request):
+        if not self.allowed(request):
+            return HttpResponseForbidden()
+        if request.GET.get('format') == 'prometheus':
+            return HttpResponse(Metrics.prometheus() + CardCache.prometheus() + PageCache.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+        return JsonResponse({**Metrics.snapshot(), 'cards': CardCache.stats(), 'pages': PageCache.stats()})
         
 
 class VoteView(View):
@@ -215,71 +197,21 @@ class VoteView(View):
     and update the vote
 
     see:
+    votes VoteService for the state transitions
     templatetags/wildthoughts render_vote() for rendering vote in templates
     static/js/vote for client side
     """
-    def update_upvote(self, profile, instance):
-        if not instance.upvoted_by.filter(id=profile.id).exists():
-            instance.upvoted_by.add(profile)
-            instance.votes += 1
-
-        if instance.downvoted_by.filter(id=profile.id).exists():
-            instance.votes += 1
-            instance.downvoted_by.remove(profile)
-            
-        instance.save()
-
-    def update_downvote(self, profile, instance):
-        if instance.upvoted_by.filter(id=profile.id).exists():
-            instance.upvoted_by.remove(profile)
-            instance.votes -= 1
-
-        if not instance.downvoted_by.filter(id=profile.id).exists():
-            instance.votes -= 1
-            instance.downvoted_by.add(profile)
-
-        instance.save()
-
-    def update_upvoted(self, profile, instance):
-        if instance.upvoted_by.filter(id=profile.id).exists():
-            instance.upvoted_by.remove(profile)
-            instance.votes -= 1
-
-        instance.save()
-
-    def update_downvoted(self, profile, instance):
-        if instance.downvoted_by.filter(id=profile.id).exists():
-            instance.downvoted_by.remove(profile)
-            instance.votes += 1
-
-        instance.save()
-
-    def update_vote(self, profile, instance, status):            
-        if status == 'upvote':
-            self.update_upvote(profile, instance)
-
-        elif status == 'downvote':
-            self.update_downvote(profile, instance)
-
-        elif status == 'upvoted':
-            self.update_upvoted(profile, instance)
-
-        elif status == 'downvoted':
-            self.update_downvoted(profile, instance)
-
     def get(self, request):
         category = request.GET.get('category')
         id = request.GET.get('id')
         status = request.GET.get('status')
         if request.user.is_authenticated:
             try:
-                profile = UserProfile.objects.get(user=request.user)
-                model = ProfileView.TAB_TO_MODEL[category]
-                instance = model.objects.get(id=int(id))
-                self.update_vote(profile, instance, status)
-                return JsonResponse({'status': 'success', 'count': instance.votes})
-            except Exception as e:
-                print(e)
+                profile = request.profile
+                votes = VoteService.vote(profile, category, int(id), status)
+                return JsonResponse({'status': 'success', 'count': votes})
+            except Exception:
+                logger.exception('Vote failed: category=%s id=%s status=%s', category, id, status)
                 return JsonResponse({'status': 'error'})    
         else:
             login_url = reverse('auth_login')
@@ -288,10 +220,24 @@ class VoteView(View):
 
 """------------------------------------------------------- DISCUSSION VIEWS------------------------------------------------------------"""
 class DiscussionView(View):
+    """
+    the discussion with the first page of its comments, the next pages
+    are added by DiscussionCommentsView
+
+    see:
+    static/js/comments for the load more button
+    """
+    @classmethod
+    def comments_page(cls, discussion: Discussion, sort_by: str, cursor: str = None) -> tuple[str, CursorPage]:
+        # keyset pages, deep threads cost the same as the first page
+        sort_by, comments = Sorter.sort_discussion_comments(sort_by, discussion)
+        per_page = getattr(settings, 'COMMENTS_PER_PAGE', 20)
+        return sort_by, CursorPaginator(comments, per_page).get_page(cursor)
+
     def get(self, request, discussion_slug):
         sort_by = request.GET.get('sort_by')
-        discussion = Discussion.objects.get(slug=discussion_slug)
-        sort_by, comments = Sorter.sort_discussion_comments(sort_by, discussion)
+        discussion = Discussion.objects.select_related('animal', 'author__user').get(slug=discussion_slug)
+        sort_by, comments = self.comments_page(discussion, sort_by, request.GET.get('cursor'))
         form = CommentForm()
 
         context_dict = {
@@ -310,13 +256,33 @@ class DiscussionView(View):
 
         if form.is_valid():
             comment = form.save(commit=False)
-            comment.author = UserProfile.objects.get(user=request.user)
+            comment.author = request.profile
             comment.discussion = Discussion.objects.get(slug=discussion_slug)
-            comment.save()
+            with transaction.atomic():
+                comment.save()
 
         return redirect(reverse('wildthoughts:discussion', kwargs={'discussion_slug': discussion_slug}) + '?sort_by=' + sort_by)
 
 
+class DiscussionCommentsView(View):
+    """
+    the next page of comments after ?cursor= as json, rendered
+    by the comment widget, with the cursor of the page after it
+
+    see:
+    static/js/comments for client side
+    """
+    def get(self, request, discussion_slug):
+        try:
+            discussion = Discussion.objects.only('id').get(slug=discussion_slug)
+        except Discussion.DoesNotExist:
+            return JsonResponse({'status': 'error'}, status=404)
+        sort_by, comments = DiscussionView.comments_page(discussion, request.GET.get('sort_by'), request.GET.get('cursor'))
+        html = render_to_string('wildthoughts/widget/comment_widget.html',
+                                {'comments': comments, 'profile': request.profile}, request=request)
+        return JsonResponse({'status': 'success', 'html': html, 'next_cursor': comments.next_cursor})
+
+
 class AddDiscussionView(View):
     @method_decorator(login_required)
     def get(self, request):
@@ -337,10 +303,11 @@ class AddDiscussionView(View):
 
         if form.is_valid():
             discussion = form.save(commit=False)
-            author = UserProfile.objects.get(user=request.user)
+            author = request.profile
             discussion.author = author
             discussion.slug = slugify(discussion.title)
-            discussion.save()
+            with transaction.atomic():
+                discussion.save()
             return redirect(reverse('wildthoughts:discussion', kwargs={'discussion_slug': discussion.slug}))
         else:
             print(form.errors)
@@ -354,9 +321,7 @@ class ListDiscussionView(View):
         sort_by, results = Sorter.sort_model(sort_by, Discussion)
 
         # set up pagination
-        p = Paginator(results, 20)
-        page = request.GET.get('page')
-        discussions = p.get_page(page)
+        discussions = CursorPaginator.paginate(request, results)
         
         return render(request, 'wildthoughts/discussion/list_discussions.html', context={'discussions': discussions, 'sort_by': sort_by})
     
@@ -364,13 +329,11 @@ class ListDiscussionView(View):
 """-------------------------------------------------------- LIST VIEWS -------------------------------------------------------------"""
 class UserListView(View):
     def get(self, request, user_list_slug):
-        user_list = UserList.objects.get(slug=user_list_slug)
+        user_list = UserList.objects.select_related('author__user').get(slug=user_list_slug)
         sort_by = request.GET.get('sort_by')
         sort_by, results = Sorter.sort_user_list_animals(sort_by, user_list)
         # set up pagination
-        p = Paginator(results, 20)
-        page = request.GET.get('page')
-        animals = p.get_page(page)
+        animals = CursorPaginator.paginate(request, results)
         return render(request, 'wildthoughts/user_list/user_list.html', {'user_list':user_list, 'animals':animals, 'sort_by':sort_by})
     
 
@@ -380,9 +343,7 @@ class ListUserListView(View):
         sort_by, results = Sorter.sort_model(sort_by, UserList)
 
         # set up pagination
-        p = Paginator(results, 20)
-        page = request.GET.get('page')
-        user_lists = p.get_page(page)
+        user_lists = CursorPaginator.paginate(request, results)
         
         return render(request, 'wildthoughts/user_list/list_user_lists.html', context={'user_lists': user_lists, 'sort_by': sort_by})
     
@@ -401,10 +362,11 @@ class AddUserListView(View):
 
         if form.is_valid():
             user_list = form.save(commit=False)
-            author = UserProfile.objects.get(user=request.user)
+            author = request.profile
             user_list.author = author
-            user_list.save()
-            form.save_m2m() 
+            with transaction.atomic():
+                user_list.save()
+                form.save_m2m()
             return redirect(reverse('wildthoughts:list', kwargs={'user_list_slug': user_list.slug}))
         else:
             print(form.errors)
@@ -415,7 +377,7 @@ class AddUserListView(View):
 """--------------------------------------------------------- PETITION VIEWS------------------------------------------------------------"""
 class PetitionView(View):
     def get(self, request, petition_slug):
-        petition = Petition.objects.get(slug=petition_slug)
+        petition = Petition.objects.select_related('author__user').get(slug=petition_slug)
 
         # set the width of progress bar in petition page
         if petition.goal == 0:
@@ -426,7 +388,7 @@ class PetitionView(View):
         # check if user has signed petition
         has_signed = False
         if request.user.is_authenticated:
-            profile = UserProfile.objects.get(user=request.user)
+            profile = request.profile
             if petition.signed_by.filter(id=profile.id).exists():
                 has_signed = True
 
@@ -440,19 +402,22 @@ class PetitionView(View):
     
 
 class SignPetitionView(View):
+    """
+    sign the petition from an ajax request
+
+    see:
+    signatures SignatureService for the signing path
+    static/js/petition for client side
+    """
     def get(self, request):
         petition_id = request.GET['petition_id']
         if request.user.is_authenticated:
             try:
-                petition = Petition.objects.get(id=int(petition_id))
-                profile = UserProfile.objects.get(user=request.user)
-                if not petition.signed_by.filter(id=profile.id).exists():
-                    petition.signatures += 1
-                    petition.signed_by.add(profile)
-                    petition.save()
-                    return JsonResponse({'status': 'success'})
-            except Exception as e:
-                print(e)
+                profile = request.profile
+                status = SignatureService.sign(profile, int(petition_id))
+                return JsonResponse({'status': status})
+            except Exception:
+                logger.exception('Signing failed: petition_id=%s', petition_id)
                 return JsonResponse({'status': 'error'})
         else:
             login_url = reverse('auth_login')
@@ -464,13 +429,8 @@ class ListPetitionView(View):
         sort_by = request.GET.get('sort_by')
         sort_by, results = Sorter.sort_model(sort_by, Petition)
 
-        if sort_by in ['most_signed', 'least_signed']:
-            sort_by = sort_by.replace('_', ' ')
-
         # set up pagination
-        p = Paginator(results, 20)
-        page = request.GET.get('page')
-        petitions = p.get_page(page)
+        petitions = CursorPaginator.paginate(request, results)
         
         return render(request, 'wildthoughts/petition/list_petitions.html', context={'petitions': petitions, 'sort_by': sort_by})
     
@@ -489,10 +449,11 @@ class AddPetitionForm(View):
 
         if form.is_valid():
             petition = form.save(commit=False)
-            author = UserProfile.objects.get(user=request.user)
+            author = request.profile
             petition.author = author
-            petition.save()
-            form.save_m2m() 
+            with transaction.atomic():
+                petition.save()
+                form.save_m2m()
             return redirect(reverse('wildthoughts:petition', kwargs={'petition_slug': petition.slug}))
         else:
             print(form.errors)
@@ -511,7 +472,10 @@ class ProfileView(View):
     }
 
     def get(self, request, username):
-        profile = UserProfile.objects.get(user=User.objects.get(username=username))
+        if request.profile and request.profile.user.username == username:
+            profile = request.profile
+        else:
+            profile = UserProfile.objects.select_related('user').get(user__username=username)
         loguser = None
         if (request.user.is_authenticated):
             loguser = request.user
@@ -522,17 +486,17 @@ class ProfileView(View):
             tab = 'animals'
         
         model = ProfileView.TAB_TO_MODEL[tab]
-        sort_by, results = Sorter.sort_model(sort_by, model, profile)
+        widget = 'profile_comment_widget' if model is Comment else None
+        sort_by, results = Sorter.sort_model(sort_by, model, profile, widget)
+        results = CursorPaginator.paginate(request, results)
         
-        if sort_by in ['most_signed', 'least_signed']:
-            sort_by = sort_by.replace('_', ' ')
-
         context_dict = {
         'profile': profile, 
          'loguser':loguser, 
          'sort_by':sort_by, 
          'tab': tab, 
-         'results': results
+         'results': results,
+         'query': '&' + urlencode({'tab': tab})
          }
         
         return render(request, 'wildthoughts/profile/profile.html', context=context_dict)    
@@ -554,9 +518,7 @@ class ListProfileView(View):
         sort_by = request.GET.get('sort_by')
         sort_by, results = Sorter.sort_profiles(sort_by)
         # set up pagination
-        p = Paginator(results, 20)
-        page = request.GET.get('page')
-        profiles = p.get_page(page)
+        profiles = CursorPaginator.paginate(request, results)
 
         return render(request, 'wildthoughts/profile/list_profiles.html', {'profiles':profiles, 'sort_by':sort_by})
 
@@ -564,13 +526,13 @@ class ListProfileView(View):
 class EditProfileView(View):
     @method_decorator(login_required)
     def get(self, request):
-        profile = UserProfile.objects.get(user=request.user)
+        profile = request.profile
         form = EditProfileForm(instance=profile)
         return render(request, 'wildthoughts/profile/edit_profile.html', {'form': form})
     
     @method_decorator(login_required)
     def post(self, request):
-        profile = UserProfile.objects.get(user=request.user)
+        profile = request.profile
         form = EditProfileForm(request.POST, request.FILES, instance=profile)
 
         if form.is_valid():
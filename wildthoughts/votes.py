@@ -0,0 +1,317 @@
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, F, IntegerField, Model, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from wildthoughts.counters import ProfileCounters
+from wildthoughts.fragments import CardCache
+from wildthoughts.hot import HotScores
+from wildthoughts.leaderboard import Leaderboard
+from wildthoughts.models import Animal, Comment, Discussion, UserList, UserProfile
+
+logger = logging.getLogger(__name__)
+
+
+class VoteStates:
+    """
+    class dedicated to resolve the vote status of a profile for a whole page
+    of instances at once, using one query per through-table instead of
+    two queries per rendered card
+
+    see:
+    templatetags/wildthoughts vote_states() and render_vote()
+    """
+    UPVOTED = 'upvoted'
+    DOWNVOTED = 'downvoted'
+
+    @classmethod
+    def voted_ids(cls, profile: UserProfile, model: Model, field: str, ids: list[int]) -> set[int]:
+        # query the auto-created through-table directly, no join needed
+        through, source, target = VoteService.through(model, field)
+        filters = {target: profile.id, f'{source}__in': ids}
+        return set(through.objects.filter(**filters).values_list(f'{source}_id', flat=True))
+
+    @classmethod
+    def resolve(cls, profile: UserProfile, instances) -> dict[int, str]:
+        """
+        returns a dictionary mapping instance ids to 'upvoted' or 'downvoted'
+        instances not voted by the profile are left out
+        """
+        if not profile:
+            return {}
+
+        instances = list(instances)
+        if not instances:
+            return {}
+
+        model = type(instances[0])
+        ids = [instance.id for instance in instances]
+        states = {}
+        for instance_id in cls.voted_ids(profile, model, 'downvoted_by', ids):
+            states[instance_id] = cls.DOWNVOTED
+        # an upvote takes precedence, matching the order render_vote checks them
+        for instance_id in cls.voted_ids(profile, model, 'upvoted_by', ids):
+            states[instance_id] = cls.UPVOTED
+        return states
+
+
+class VoteBuffer:
+    """
+    class dedicated to coalesce the votes column updates when the VOTE_BUFFER setting is on
+    the upvoted_by and downvoted_by rows of a vote are written right away, the moved count is
+    added to a buffer in the process instead and written in one transaction per batch: after
+    VOTE_BUFFER_EVENTS votes or VOTE_BUFFER_INTERVAL milliseconds since the first one pending,
+    so a viral animal takes one update per batch instead of one per click
+
+    the vote widget adds the pending delta to the count it shows, see: templatetags/wildthoughts
+    render_vote(). Sorting by votes or hot and the votes received of the author are behind by at most
+    one batch. Each process keeps its own buffer, and what a crashed process hadn't written is
+    recomputed from the through-tables by reconcile_votes, which writes the buffer first
+
+    see:
+    VoteService.vote for the buffered path
+    management/commands/benchmark_vote_buffer for the votes per second on one animal
+    """
+    lock = threading.Lock()
+    pending: Counter = Counter()
+    # taken out of pending by a flush that hasn't committed yet
+    writing: Counter = Counter()
+    events = 0
+    timer: threading.Timer = None
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return getattr(settings, 'VOTE_BUFFER', False)
+
+    @classmethod
+    def interval(cls) -> float:
+        return getattr(settings, 'VOTE_BUFFER_INTERVAL', 500) / 1000
+
+    @classmethod
+    def max_events(cls) -> int:
+        return getattr(settings, 'VOTE_BUFFER_EVENTS', 100)
+
+    @classmethod
+    def add(cls, model: Model, instance_id: int, delta: int) -> int:
+        """
+        buffer the delta of a vote, returns the delta now pending for the instance
+        including this one, even if it fills the batch and is written right away
+        """
+        key = (model, instance_id)
+        with cls.lock:
+            cls.pending[key] += delta
+            cls.events += 1
+            total = cls.pending[key] + cls.writing.get(key, 0)
+            full = cls.events >= cls.max_events()
+            if not full:
+                cls.arm()
+        if full:
+            cls.flush()
+        return total
+
+    @classmethod
+    def arm(cls) -> None:
+        # called with the lock, the timer flushes INTERVAL after the first delta pending
+        if cls.timer is None:
+            cls.timer = threading.Timer(cls.interval(), cls.flush_on_timer)
+            cls.timer.daemon = True
+            cls.timer.start()
+
+    @classmethod
+    def delta(cls, model: Model, instance_id: int) -> int:
+        # with the lock, a flush moves the deltas from pending to writing in two steps
+        key = (model, instance_id)
+        with cls.lock:
+            return cls.pending.get(key, 0) + cls.writing.get(key, 0)
+
+    @classmethod
+    def flush(cls) -> int:
+        """
+        write the pending deltas, returns how many instances were written
+        if the write fails they are put back for the next batch
+        """
+        with cls.lock:
+            pending = {key: delta for key, delta in cls.pending.items() if delta}
+            cls.writing.update(pending)
+            cls.pending = Counter()
+            cls.events = 0
+            if cls.timer is not None:
+                cls.timer.cancel()
+                cls.timer = None
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                for (model, instance_id), delta in pending.items():
+                    if model.objects.filter(id=instance_id).update(votes=F('votes') + delta):
+                        ProfileCounters.voted(model, instance_id, delta)
+                        HotScores.refresh(model, instance_id)
+        except Exception:
+            logger.exception('Writing %d buffered vote counts failed, retrying with the next batch', len(pending))
+            with cls.lock:
+                cls.pending.update(pending)
+                cls.written(pending)
+                cls.arm()
+            return 0
+        with cls.lock:
+            cls.written(pending)
+        return len(pending)
+
+    @classmethod
+    def written(cls, deltas: dict) -> None:
+        # called with the lock, a counter left at 0 is dropped
+        cls.writing.subtract(deltas)
+        cls.writing = Counter({key: delta for key, delta in cls.writing.items() if delta})
+
+    @classmethod
+    def flush_on_timer(cls) -> None:
+        with cls.lock:
+            cls.timer = None
+        try:
+            cls.flush()
+        finally:
+            # the timer thread ends here, its connection would be left open
+            connection.close()
+
+    @classmethod
+    def clear(cls) -> None:
+        with cls.lock:
+            cls.pending = Counter()
+            cls.writing = Counter()
+            cls.events = 0
+            if cls.timer is not None:
+                cls.timer.cancel()
+                cls.timer = None
+
+
+# what's left is written when the process exits normally
+atexit.register(VoteBuffer.flush)
+
+
+class VoteService:
+    """
+    class dedicated to apply a vote in a single transaction
+    the through-tables are updated with conditional inserts and deletes
+    and the votes column is moved with a database side F() increment,
+    so concurrent clicks can neither lose votes nor drift from the through-tables
+
+    see:
+    views VoteView for the ajax endpoint
+    leaderboard Leaderboard for the homepage animals
+    fragments CardCache for the cached cards
+    management/commands/reconcile_votes for fixing existing drift
+    VoteBuffer for the write-behind counts
+    hot HotScores for the hot score of the voted row
+    """
+    CATEGORY_TO_MODEL = {
+        'animals': Animal,
+        'discussions': Discussion,
+        'comments': Comment,
+        'lists': UserList,
+    }
+    # status sent by static/js/vote: (field to add the profile to, field to remove it from)
+    TRANSITIONS = {
+        'upvote': ('upvoted_by', 'downvoted_by'),
+        'downvote': ('downvoted_by', 'upvoted_by'),
+        'upvoted': (None, 'upvoted_by'),
+        'downvoted': (None, 'downvoted_by'),
+    }
+    WEIGHTS = {
+        'upvoted_by': 1,
+        'downvoted_by': -1,
+    }
+
+    @classmethod
+    def through(cls, model: Model, field: str) -> tuple[Model, str, str]:
+        relation = getattr(model, field)
+        return relation.through, relation.field.m2m_field_name(), relation.field.m2m_reverse_field_name()
+
+    @classmethod
+    def add(cls, profile: UserProfile, model: Model, field: str, instance_id: int) -> int:
+        # the through-table is unique on (instance, profile) so a duplicate insert is a no-op
+        through, source, target = cls.through(model, field)
+        try:
+            with transaction.atomic():
+                through.objects.create(**{f'{source}_id': instance_id, f'{target}_id': profile.id})
+            return 1
+        except IntegrityError:
+            return 0
+
+    @classmethod
+    def remove(cls, profile: UserProfile, model: Model, field: str, instance_id: int) -> int:
+        through, source, target = cls.through(model, field)
+        deleted, _ = through.objects.filter(**{source: instance_id, target: profile.id}).delete()
+        return deleted
+
+    @classmethod
+    def vote(cls, profile: UserProfile, category: str, instance_id: int, status: str) -> int:
+        """
+        apply the transition for status and return the new vote count
+        raises KeyError for an invalid category or status
+        and DoesNotExist if the instance or the profile is missing
+        """
+        model = cls.CATEGORY_TO_MODEL[category]
+        add_field, remove_field = cls.TRANSITIONS[status]
+        # also resolves a lazy request.profile before the transaction, see the write first comment below
+        if not profile:
+            raise UserProfile.DoesNotExist('Voting requires a profile')
+
+        buffered = VoteBuffer.enabled()
+        with transaction.atomic():
+            # write first: on SQLite this takes the write lock before anything is read
+            delta = -cls.WEIGHTS[remove_field] * cls.remove(profile, model, remove_field, instance_id)
+            if add_field:
+                delta += cls.WEIGHTS[add_field] * cls.add(profile, model, add_field, instance_id)
+
+            # raises DoesNotExist for a missing instance, the row stays locked until the commit
+            votes, date = model.objects.select_for_update().filter(id=instance_id).values_list('votes', 'date').get()
+            if delta and not buffered:
+                # the count read above is the one incremented, so the new count and hot score are known
+                votes += delta
+                columns = HotScores.columns(model, votes, date)
+                model.objects.filter(id=instance_id).update(votes=F('votes') + delta, **columns)
+                ProfileCounters.voted(model, instance_id, delta)
+
+        if buffered:
+            # after the commit, a rolled back vote never reaches the buffer
+            votes += VoteBuffer.add(model, instance_id, delta) if delta else VoteBuffer.delta(model, instance_id)
+
+        if model is Animal:
+            Leaderboard.update(instance_id, votes)
+        CardCache.bump(model, instance_id)
+        return votes
+
+    @classmethod
+    def count_subquery(cls, model: Model, field: str) -> Coalesce:
+        through, source, target = cls.through(model, field)
+        counts = (through.objects.filter(**{source: OuterRef('pk')})
+                  .values(source)
+                  .annotate(total=Count('*'))
+                  .values('total'))
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    @classmethod
+    def reconcile(cls, dry_run: bool = False) -> dict[str, int]:
+        """
+        recompute the votes column of every category from the through-tables
+        returns how many instances had drifted per category
+        """
+        # the buffered counts would be taken as drift and then added on top
+        VoteBuffer.flush()
+        drifted_counts = {}
+        for category, model in cls.CATEGORY_TO_MODEL.items():
+            actual = cls.count_subquery(model, 'upvoted_by') - cls.count_subquery(model, 'downvoted_by')
+            with transaction.atomic():
+                drifted = model.objects.annotate(actual=actual).filter(~Q(votes=F('actual')))
+                drifted_counts[category] = drifted.count()
+                if drifted_counts[category] and not dry_run:
+                    model.objects.filter(id__in=drifted.values('id')).update(votes=actual)
+                    HotScores.rebuild(model)
+        return drifted_counts